@@ -2,11 +2,25 @@ import asyncio
 import json
 import logging
 import datetime
+import re
 import signal
+import time
+from collections import OrderedDict
 import pytz
 from telegram import Bot, Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
-from models import get_db_connection, Channel, Question
+from telegram.ext import CommandHandler, MessageHandler, ContextTypes, filters
+from models import Channel, Question, QuestionCache, PollRegistry, get_data_versions
+from webhook import application_builder, start_receiving_updates
+from outbox import Outbox
+from repository import Repository
+from question_index import QuestionIndex
+from config import (ANSWER_BOT_WEBHOOK_PORT, OUTBOX_MAX_ATTEMPTS, OUTBOX_BASE_DELAY,
+                    OUTBOX_MAX_DELAY, OUTBOX_RETENTION, QUESTION_MATCH_THRESHOLD,
+                    ANSWER_BOT_TEXT_MATCHING, POLL_REGISTRY_GRACE_PERIOD, POLL_REGISTRY_MAX_ENTRIES,
+                    POLL_REGISTRY_RETENTION, QUESTION_REFRESH_INTERVAL, DEFAULT_POLL_DURATION,
+                    POLL_CLOSE_GRACE, POLL_CLOSE_CHECK_INTERVAL, ANSWER_DIGEST_MODE,
+                    ANSWER_DIGEST_MAX_WAIT, QUIZ_INTERVAL_SECONDS, MESSAGE_MAX_LENGTH,
+                    ANSWER_ENTRY_CACHE_SIZE, DB_READ_THREADS)
 
 # Configure logging
 logging.basicConfig(
@@ -26,14 +40,48 @@ ADMIN_CHAT_ID = '1352855793'
 # Set timezone for India
 IST = pytz.timezone('Asia/Kolkata')
 
+def question_data_versions():
+    """Return the (questions, channels) data versions, as QuestionCache.versions"""
+    versions = get_data_versions()
+    return versions.get('questions'), versions.get('channels')
+
 class AnswerBot:
-    def __init__(self):
+    # Update types with a registered handler, nothing else is delivered
+    ALLOWED_UPDATES = [Update.MESSAGE, Update.CHANNEL_POST]
+    
+    def __init__(self, request=None, question_cache=None, poll_registry=None, db=None):
         self.application = None
-        self.question_database = {}  # Store questions for lookup
+        self.loop = None
+        self.request = request  # HTTP pool shared with the quiz bot in the single-process runtime
+        self.owns_db = db is None
+        self.db = db if db is not None else Repository(DB_READ_THREADS)  # Runs SQLite work off the event loop
+        # On its own the bot only needs question texts in memory, answers are read when a poll comes in
+        self.question_cache = question_cache if question_cache is not None else QuestionCache(texts_only=True)
+        self.question_index = QuestionIndex(QUESTION_MATCH_THRESHOLD)  # Text lookup for unregistered polls
+        self.answer_entries = OrderedDict()  # LRU of question id -> question_entry
+        self.entry_versions = None  # Data versions of the cached entries while the question cache is not loaded
+        self.poll_registry = poll_registry if poll_registry is not None else PollRegistry(
+            # Polls the quiz bot sent, poll id -> question id
+            grace_period=POLL_REGISTRY_GRACE_PERIOD,
+            max_entries=POLL_REGISTRY_MAX_ENTRIES,
+            retention=POLL_REGISTRY_RETENTION
+        )
+        self.outbox = Outbox(  # Durable queue for answer explanations
+            'answer_bot',
+            max_attempts=OUTBOX_MAX_ATTEMPTS,
+            base_delay=OUTBOX_BASE_DELAY,
+            max_delay=OUTBOX_MAX_DELAY,
+            retention=OUTBOX_RETENTION,
+            digest_limit=MESSAGE_MAX_LENGTH,
+            db=self.db
+        )
+        self.refresh_task = None
+        self.close_watch_task = None
+        self.question_cache.subscribe(self.on_questions_changed)
         
     async def initialize(self):
         """Initialize the bot application"""
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        self.application = application_builder(BOT_TOKEN, self.request).build()
         
         # Add handlers
         self.application.add_handler(CommandHandler("start", self.start))
@@ -46,48 +94,190 @@ class AnswerBot:
         
         logger.info("Answer bot initialized successfully")
     
-    async def load_questions_database(self):
-        """Load all questions into memory for fast lookup"""
+    def question_entry(self, question, channel):
+        """Question data used to build an answer"""
+        return {
+            'id': question.id,
+            'channel_id': question.channel_id,
+            'question_text': question.question_text,
+            'option_a': question.option_a,
+            'option_b': question.option_b,
+            'option_c': question.option_c,
+            'option_d': question.option_d,
+            'correct_option': question.correct_option,
+            'explanation': question.explanation,
+            'reason': question.reason,
+            'channel_telegram_id': channel.channel_id,
+            'discussion_group_id': channel.discussion_group_id,
+            'channel_name': channel.channel_name
+        }
+    
+    async def get_answer_entry(self, question_id):
+        """Return the question_entry of a question, or None if it does not exist"""
+        entry = self.answer_entries.get(question_id)
+        if entry:
+            self.answer_entries.move_to_end(question_id)
+            return entry
+        
+        versions, found = await self.db.read(self.read_answer_entry, question_id)
+        if not found:
+            return None
+        entry = self.question_entry(*found)
+        if self.question_cache.versions is None and self.entry_versions is None:
+            self.entry_versions = versions
+        # A change during the read may have dropped this question's entry already, then it could be stale
+        if versions == (self.question_cache.versions or self.entry_versions):
+            self.answer_entries[question_id] = entry
+            if len(self.answer_entries) > ANSWER_ENTRY_CACHE_SIZE:
+                self.answer_entries.popitem(last=False)
+        return entry
+    
+    def read_answer_entry(self, question_id):
+        """Return (data versions, (Question, Channel) or None) of a question, on a database thread"""
+        # A loaded cache reports edits, otherwise the data versions tell when the entries go stale
+        versions = self.question_cache.versions or question_data_versions()
+        return versions, self.question_cache.get_with_channel(question_id)
+    
+    def set_entry_versions(self, versions):
+        """Drop the cached entries once questions or channels changed, while the cache is not loaded"""
+        if versions != self.entry_versions:
+            self.answer_entries.clear()
+            self.entry_versions = versions
+    
+    async def load_questions_database(self, force=False):
+        """Load all questions into memory for text matching"""
+        if not ANSWER_BOT_TEXT_MATCHING:
+            logger.info("Text matching disabled, questions are looked up by poll id")
+            return
+        
         try:
-            with get_db_connection() as conn:
-                questions = conn.execute('''
-                    SELECT q.*, c.channel_id, c.discussion_group_id, c.channel_name
-                    FROM questions q
-                    JOIN channels c ON q.channel_id = c.id
-                    WHERE c.active = 1
-                ''').fetchall()
-                
-                for question in questions:
-                    # Create a searchable key from question text
-                    question_key = self.normalize_question_text(question[2])  # question_text
-                    
-                    self.question_database[question_key] = {
-                        'id': question[0],
-                        'channel_id': question[1],
-                        'question_text': question[2],
-                        'option_a': question[3],
-                        'option_b': question[4],
-                        'option_c': question[5],
-                        'option_d': question[6],
-                        'correct_option': question[7],
-                        'explanation': question[8],
-                        'reason': question[9],
-                        'channel_telegram_id': question[11],
-                        'discussion_group_id': question[12],
-                        'channel_name': question[13]
-                    }
-                
-                logger.info(f"Loaded {len(self.question_database)} questions into memory")
+            changes = await self.db.read(self.question_cache.refresh, force)
+            if not changes and not len(self.question_index):
+                # The cache was loaded already, by the quiz bot in the shared runtime
+                self.set_question_index(await self.db.read(self.build_question_index))
         except Exception as e:
             logger.error(f"Error loading questions database: {e}")
     
-    def normalize_question_text(self, text):
-        """Normalize question text for matching"""
-        # Remove extra whitespace, convert to lowercase, remove special characters
-        import re
-        normalized = re.sub(r'[^\w\s]', '', text.lower().strip())
-        normalized = re.sub(r'\s+', ' ', normalized)
-        return normalized
+    async def question_count(self):
+        """Questions the bot can answer: those indexed for text matching, or every question
+        in the database when polls are only looked up by poll id"""
+        if ANSWER_BOT_TEXT_MATCHING:
+            return len(self.question_index)
+        return await self.db.read(Question.count)
+    
+    def build_question_index(self):
+        """Index the texts of all cached questions"""
+        question_index = QuestionIndex(QUESTION_MATCH_THRESHOLD)
+        for question, channel in self.question_cache.items():
+            # Index by normalized question text and its trigrams
+            question_index.add(question.question_text, question.id)
+        return question_index
+    
+    def set_question_index(self, question_index):
+        self.question_index = question_index
+        logger.info(f"Loaded {len(self.question_index)} questions into memory")
+    
+    def on_questions_changed(self, changes):
+        """Question cache listener, called on the database thread that refreshed the cache"""
+        # A full reload is indexed right here, off the event loop
+        question_index = None
+        if changes.full and ANSWER_BOT_TEXT_MATCHING:
+            question_index = self.build_question_index()
+        
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.apply_question_changes, changes, question_index)
+        else:
+            self.apply_question_changes(changes, question_index)
+    
+    def apply_question_changes(self, changes, question_index=None):
+        """Apply a question cache refresh to the answer entries and the text index"""
+        if changes.full:
+            # Channel changes reload everything, their names and groups are in the entries too
+            self.answer_entries.clear()
+        for question_id in changes.updated + changes.deleted:
+            self.answer_entries.pop(question_id, None)
+        
+        if not ANSWER_BOT_TEXT_MATCHING:
+            return
+        if question_index is not None:
+            self.set_question_index(question_index)
+            return
+        
+        for question_id in changes.deleted:
+            self.question_index.remove(question_id)
+        for question_id in changes.updated:
+            question = self.question_cache.get(question_id)
+            if question:
+                self.question_index.add(question.question_text, question.id)
+    
+    async def refresh_questions(self):
+        """Pick up question uploads and edits every few seconds"""
+        while True:
+            await asyncio.sleep(QUESTION_REFRESH_INTERVAL)
+            try:
+                # Only a loaded cache, otherwise questions are read by id from the database
+                if self.question_cache.versions is None:
+                    self.set_entry_versions(await self.db.read(question_data_versions))
+                    continue
+                await self.db.read(self.question_cache.refresh)
+            except Exception as e:
+                logger.error(f"Error refreshing questions: {e}")
+    
+    async def find_question(self, poll):
+        """Return (question data, close time, closed, PollRecord) of a poll, question data is
+        None if not found and the record None if the quiz bot did not send the poll"""
+        if poll.close_date:
+            close_time = poll.close_date.timestamp()
+        else:
+            close_time = time.time() + DEFAULT_POLL_DURATION
+        
+        # The quiz bot registers its polls right after sending them, but its write can queue
+        # behind others. Keep looking until the poll closes, its answer is not due before
+        delay = 0.5
+        while True:
+            record = await self.db.read(self.poll_registry.get, poll.id)
+            if record:
+                entry = await self.get_answer_entry(record.question_id)
+                return entry, record.close_time, record.closed_at is not None, record
+            remaining = close_time - time.time()
+            if poll.is_closed or remaining <= 0:
+                break
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, POLL_CLOSE_CHECK_INTERVAL)
+        
+        if not ANSWER_BOT_TEXT_MATCHING:
+            logger.warning(f"Poll {poll.id} was not registered by the quiz bot before it closed, "
+                           f"no explanation is sent")
+            return None, None, False, None
+        
+        # Not sent by the quiz bot, match the text instead
+        # Remove question number prefix if present (e.g., "Q1: ")
+        clean_question = re.sub(r'^Q\d+:\s*', '', poll.question)
+        
+        # Exact normalized text first, then the most similar question
+        question_id = self.question_index.lookup(clean_question)
+        entry = await self.get_answer_entry(question_id) if question_id else None
+        return entry, close_time, poll.is_closed, None
+    
+    async def watch_poll_closures(self):
+        """Send explanations as soon as the quiz bot reports their polls closed"""
+        # Closes from before the start are no news, answers of polls closed by then are queued
+        # to send right away and the rest still go out at their close time plus grace
+        checked_until = time.time()
+        while True:
+            await asyncio.sleep(POLL_CLOSE_CHECK_INTERVAL)
+            try:
+                for poll_id, closed_at in await self.db.read(self.poll_registry.get_closed_since, checked_until):
+                    checked_until = max(checked_until, closed_at)
+                    if ANSWER_DIGEST_MODE:
+                        # A digest goes out with the last poll of its quiz, earlier closes change nothing
+                        record = await self.db.read(self.poll_registry.get, poll_id)
+                        if record and record.quiz_key and record.poll_number != record.poll_count:
+                            continue
+                    if await self.outbox.expedite(f"answer:{poll_id}"):
+                        logger.info(f"Poll {poll_id} closed, sending its explanation now")
+            except Exception as e:
+                logger.error(f"Error checking closed polls: {e}")
     
     async def handle_poll(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming polls and provide answers"""
@@ -98,22 +288,17 @@ class AnswerBot:
             if not poll:
                 return
             
-            # Extract question text from poll
-            poll_question = poll.question
+            # Resolving the question may wait for the quiz bot, keep the handler free
+            self.application.create_task(self.answer_poll(poll))
             
-            # Remove question number prefix if present (e.g., "Q1: ")
-            import re
-            clean_question = re.sub(r'^Q\d+:\s*', '', poll_question)
-            
-            # Normalize for search
-            normalized_question = self.normalize_question_text(clean_question)
-            
-            # Search for matching question
-            matching_question = None
-            for question_key, question_data in self.question_database.items():
-                if question_key in normalized_question or normalized_question in question_key:
-                    matching_question = question_data
-                    break
+        except Exception as e:
+            logger.error(f"Error handling poll: {e}")
+    
+    async def answer_poll(self, poll):
+        """Queue the answer explanation of a poll"""
+        try:
+            matching_question, close_time, closed, record = await self.find_question(poll)
+            clean_question = re.sub(r'^Q\d+:\s*', '', poll.question)
             
             if not matching_question:
                 logger.info(f"No matching question found for: {clean_question}")
@@ -125,9 +310,6 @@ class AnswerBot:
                 logger.warning(f"No discussion group configured for question: {clean_question}")
                 return
             
-            # Wait for poll to close (or timeout)
-            await asyncio.sleep(320)  # Wait 5 minutes + 20 seconds buffer
-            
             # Prepare answer message
             options = [
                 matching_question['option_a'],
@@ -139,6 +321,11 @@ class AnswerBot:
             correct_option_index = matching_question['correct_option']
             correct_answer = options[correct_option_index]
             
+            if ANSWER_DIGEST_MODE and record and record.quiz_key and record.poll_count:
+                await self.queue_digest_answer(poll, matching_question, correct_option_index, correct_answer,
+                                               close_time, closed, record)
+                return
+            
             # Format answer message
             answer_message = f"📝 **Answer Explanation**\n\n"
             answer_message += f"❓ **Question:** {matching_question['question_text']}\n\n"
@@ -150,20 +337,52 @@ class AnswerBot:
             if matching_question['reason']:
                 answer_message += f"🔍 **Detailed Reason:** {matching_question['reason']}\n\n"
             
-            answer_message += f"📚 **Channel:** {matching_question['channel_name']}\n"
-            answer_message += f"⏰ **Answered at:** {datetime.datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S IST')}"
-            
-            # Send answer to discussion group
-            await self.application.bot.send_message(
-                chat_id=discussion_group_id,
-                text=answer_message,
-                parse_mode='Markdown'
-            )
+            answer_message += f"📚 **Channel:** {matching_question['channel_name']}"
+            # Send once the poll has closed, watch_poll_closures sends it earlier if the
+            # close is reported before the close time plus grace. The text is fixed when
+            # queued, so it carries no send time, Telegram shows that on the message
+            send_at = time.time() if closed else close_time + POLL_CLOSE_GRACE
             
-            logger.info(f"Sent answer explanation to discussion group for question: {clean_question}")
+            # Queue answer for the discussion group, the poll id keeps it from being sent twice
+            if await self.outbox.enqueue_async(f"answer:{poll.id}", discussion_group_id, 'send_message', {
+                'text': answer_message,
+                'parse_mode': 'Markdown'
+            }, not_before=send_at):
+                logger.info(f"Queued answer explanation to discussion group for question: {clean_question}")
             
         except Exception as e:
-            logger.error(f"Error handling poll: {e}")
+            logger.error(f"Error answering poll {poll.id}: {e}")
+    
+    async def queue_digest_answer(self, poll, question, correct_option_index, correct_answer, close_time,
+                                  closed, record):
+        """Queue the explanation of a quiz poll as one section of the quiz's answer digest"""
+        number = record.poll_number
+        answer_message = f"❓ **Q{number}:** {question['question_text']}\n"
+        answer_message += f"✅ **Correct Answer:** {chr(65 + correct_option_index)} - {correct_answer}\n"
+        if question['explanation']:
+            answer_message += f"💡 **Explanation:** {question['explanation']}\n"
+        if question['reason']:
+            answer_message += f"🔍 **Detailed Reason:** {question['reason']}\n"
+        if number == 1:
+            answer_message = (f"📝 **Answer Explanations**\n📚 **Channel:** {question['channel_name']}\n\n"
+                              + answer_message)
+        
+        # The whole digest goes out with the last poll of the quiz: once watch_poll_closures
+        # sees it closed, or at its own close time plus grace. Earlier polls only set a deadline
+        # for quizzes whose last poll never comes, well past when it should have closed
+        remaining = record.poll_count - number
+        if remaining:
+            send_at = close_time + remaining * QUIZ_INTERVAL_SECONDS + ANSWER_DIGEST_MAX_WAIT
+        elif closed:
+            send_at = time.time()
+        else:
+            send_at = close_time + POLL_CLOSE_GRACE
+        
+        if await self.outbox.enqueue_async(f"answer:{poll.id}", question['discussion_group_id'], 'send_message', {
+            'text': answer_message.rstrip(),
+            'parse_mode': 'Markdown'
+        }, context={'digest': record.quiz_key, 'number': number}, not_before=send_at):
+            logger.info(f"Queued answer Q{number} for the digest of {record.quiz_key}")
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start command handler"""
@@ -190,7 +409,8 @@ class AnswerBot:
             await update.message.reply_text(
                 f'✅ **Answer Bot Status: Healthy**\n\n'
                 f'🕒 Current Time (IST): {ist_time.strftime("%Y-%m-%d %H:%M:%S")}\n'
-                f'📊 Questions in Database: {len(self.question_database)}\n'
+                f'📊 Questions in Database: {await self.question_count()}\n'
+                f'📨 Answers Waiting: {len(self.outbox)}\n'
                 f'🔍 Monitoring: Poll messages'
             )
         except Exception as e:
@@ -203,31 +423,70 @@ class AnswerBot:
                 await update.message.reply_text("❌ Admin only command!")
                 return
             
+            if not ANSWER_BOT_TEXT_MATCHING:
+                # Entries are read by question id, only the cached ones can be stale
+                self.answer_entries.clear()
+                await update.message.reply_text(
+                    "ℹ️ **Text matching is off**\n\n"
+                    "Questions are read by poll id when a poll comes in, cached answers were dropped.\n"
+                    f"📊 Total Questions: {await self.question_count()}"
+                )
+                return
+            
             await update.message.reply_text("🔄 Reloading questions database...")
-            await self.load_questions_database()
+            await self.load_questions_database(force=True)
             
             await update.message.reply_text(
                 f"✅ **Questions Database Reloaded!**\n\n"
-                f"📊 Total Questions: {len(self.question_database)}"
+                f"📊 Total Questions: {await self.question_count()}"
             )
             
         except Exception as e:
             logger.error(f"Error reloading questions: {e}")
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
+    async def start_bot(self):
+        """Initialize and start receiving updates"""
+        # Question cache listeners run on database threads and hand their work to this loop
+        self.loop = asyncio.get_running_loop()
+        await self.initialize()
+        
+        # Start the bot
+        await self.application.initialize()
+        await self.application.start()
+        await start_receiving_updates(
+            self.application, self.ALLOWED_UPDATES, ANSWER_BOT_WEBHOOK_PORT, 'answer_bot'
+        )
+        await self.outbox.start(self.application.bot)
+        self.refresh_task = asyncio.create_task(self.refresh_questions())
+        self.close_watch_task = asyncio.create_task(self.watch_poll_closures())
+        
+        logger.info("Answer bot started successfully!")
+    
+    async def stop_bot(self):
+        """Stop the bot"""
+        for task in (self.refresh_task, self.close_watch_task):
+            if task:
+                task.cancel()
+        self.refresh_task = self.close_watch_task = None
+        
+        # Unsent outbox messages are resumed on the next start
+        await self.outbox.stop()
+        if self.application:
+            if self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            await self.application.shutdown()
+        
+        # Finish database writes still queued
+        if self.owns_db:
+            self.db.close()
+    
     async def run(self):
         """Run the bot"""
         try:
-            await self.initialize()
-            
-            # Start the bot
-            await self.application.initialize()
-            await self.application.start()
-            await self.application.updater.start_polling(
-                allowed_updates=Update.ALL_TYPES
-            )
-            
-            logger.info("Answer bot started successfully!")
+            await self.start_bot()
             
             # Keep running
             while True:
@@ -236,11 +495,7 @@ class AnswerBot:
         except Exception as e:
             logger.error(f"Error running answer bot: {e}")
         finally:
-            # Cleanup
-            if self.application:
-                await self.application.updater.stop()
-                await self.application.stop()
-                await self.application.shutdown()
+            await self.stop_bot()
 
 # Signal handler for graceful shutdown
 def signal_handler(sig, frame):
@@ -265,4 +520,4 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-    
\ No newline at end of file
+    
\ No newline at end of file
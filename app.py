@@ -9,9 +9,11 @@ import pytz
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import asyncio
+import functools
 import threading
-from models import init_db, Channel, Question, Schedule, get_db_connection
+from models import init_db, Channel, Question, QuestionDeck, Schedule, get_db_connection
 from utils import load_questions_from_json, save_questions_to_json, validate_question_format
+from leaderboard import PERIODS, period_keys
 import subprocess
 import sys
 
@@ -49,6 +51,7 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def requires_auth(f):
+    @functools.wraps(f)
     def decorated_function(*args, **kwargs):
         if 'authenticated' not in session:
             return redirect(url_for('login'))
@@ -242,6 +245,7 @@ def delete_channel(channel_id):
         # Delete channel and related data
         conn.execute('DELETE FROM questions WHERE channel_id = ?', (channel_id,))
         conn.execute('DELETE FROM schedules WHERE channel_id = ?', (channel_id,))
+        QuestionDeck.delete(conn, channel_id)
         conn.execute('DELETE FROM channels WHERE id = ?', (channel_id,))
         
         conn.commit()
@@ -287,24 +291,20 @@ def upload_questions():
                     conn.close()
                     return jsonify({'error': 'Channel not found'}), 404
                 
-                # Insert questions
-                questions_added = 0
-                for question in questions_data:
-                    conn.execute('''
-                        INSERT INTO questions (channel_id, question_text, option_a, option_b, option_c, option_d, correct_option, explanation, reason)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        channel_id,
-                        question['question'],
-                        question['options'][0],
-                        question['options'][1],
-                        question['options'][2],
-                        question['options'][3],
-                        question['correct_answer'],
-                        question['explanation'],
-                        question.get('reason', '')
-                    ))
-                    questions_added += 1
+                # Insert questions in one executemany
+                questions_added = Question.bulk_insert(conn, (
+                    Question(
+                        channel_id=channel_id,
+                        question_text=question['question'],
+                        option_a=question['options'][0],
+                        option_b=question['options'][1],
+                        option_c=question['options'][2],
+                        option_d=question['options'][3],
+                        correct_option=question['correct_answer'],
+                        explanation=question['explanation'],
+                        reason=question.get('reason', '')
+                    ) for question in questions_data
+                ))
                 
                 conn.commit()
                 conn.close()
@@ -361,16 +361,66 @@ def send_quiz():
         logger.error(f"Send quiz API error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/leaderboard/<int:channel_id>', methods=['GET'])
+@requires_auth
+def get_leaderboard(channel_id):
+    try:
+        period = request.args.get('period', 'day')
+        limit = min(int(request.args.get('limit', 10)), 100)
+        if period not in PERIODS:
+            return jsonify({'error': 'Period must be day, week or all'}), 400
+        
+        # Served from the rollup table through its (channel_id, period, period_key, score) index
+        period_key = period_keys(datetime.datetime.now(IST).timestamp())[period]
+        conn = get_db_connection()
+        rows = conn.execute('''
+            SELECT s.user_id, u.user_name, s.score, s.answers
+            FROM leaderboard_scores s
+            LEFT JOIN leaderboard_users u ON u.user_id = s.user_id
+            WHERE s.channel_id = ? AND s.period = ? AND s.period_key = ?
+            ORDER BY s.score DESC
+            LIMIT ?
+        ''', (channel_id, period, period_key, limit)).fetchall()
+        conn.close()
+        
+        leaderboard = []
+        for rank, row in enumerate(rows, 1):
+            leaderboard.append({
+                'rank': rank,
+                'user_id': row[0],
+                'user_name': row[1],
+                'score': row[2],
+                'answers': row[3]
+            })
+        
+        return jsonify({'channel_id': channel_id, 'period': period, 'period_key': period_key,
+                        'leaderboard': leaderboard})
+    except Exception as e:
+        logger.error(f"Get leaderboard API error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/bot-control', methods=['POST'])
 @requires_auth
 def bot_control():
     try:
         data = request.get_json()
         action = data.get('action')
-        bot_type = data.get('bot_type')  # 'quiz' or 'answer'
+        bot_type = data.get('bot_type')  # 'quiz', 'answer' or 'all' (both in one process)
         
         if action == 'start':
-            if bot_type == 'quiz':
+            if bot_type == 'all':
+                # Start both bots in the single-process runtime
+                if not bot_processes:
+                    process = subprocess.Popen([sys.executable, 'runtime.py'])
+                    bot_processes['runtime'] = process
+                    return jsonify({'message': 'Bot runtime started successfully'})
+                else:
+                    return jsonify({'message': 'Bots are already running'})
+            
+            elif 'runtime' in bot_processes:
+                return jsonify({'message': 'Bots are already running in the shared runtime'})
+            
+            elif bot_type == 'quiz':
                 # Start quiz bot
                 if 'quiz_bot' not in bot_processes:
                     process = subprocess.Popen([sys.executable, 'quiz_bot.py'])
@@ -389,7 +439,12 @@ def bot_control():
                     return jsonify({'message': 'Answer bot is already running'})
         
         elif action == 'stop':
-            if bot_type == 'quiz' and 'quiz_bot' in bot_processes:
+            if bot_type == 'all' and 'runtime' in bot_processes:
+                bot_processes['runtime'].terminate()
+                del bot_processes['runtime']
+                return jsonify({'message': 'Bot runtime stopped successfully'})
+            
+            elif bot_type == 'quiz' and 'quiz_bot' in bot_processes:
                 bot_processes['quiz_bot'].terminate()
                 del bot_processes['quiz_bot']
                 return jsonify({'message': 'Quiz bot stopped successfully'})
@@ -400,9 +455,11 @@ def bot_control():
                 return jsonify({'message': 'Answer bot stopped successfully'})
         
         elif action == 'status':
+            runtime_running = 'runtime' in bot_processes
             status = {
-                'quiz_bot': 'running' if 'quiz_bot' in bot_processes else 'stopped',
-                'answer_bot': 'running' if 'answer_bot' in bot_processes else 'stopped'
+                'quiz_bot': 'running' if 'quiz_bot' in bot_processes or runtime_running else 'stopped',
+                'answer_bot': 'running' if 'answer_bot' in bot_processes or runtime_running else 'stopped',
+                'runtime': 'running' if runtime_running else 'stopped'
             }
             return jsonify(status)
         
@@ -10,8 +10,24 @@ ANSWER_BOT_TOKEN = os.getenv('ANSWER_BOT_TOKEN', '6233735663:AAF6ULU2C0XAcyaKhXU
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID', '1352855793')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', '1230R@j')
 
+# Update Delivery Configuration
+USE_WEBHOOK = os.getenv('USE_WEBHOOK', 'False').lower() == 'true'  # False = long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Public base URL Telegram posts updates to
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')  # Local address of the update receiver
+QUIZ_BOT_WEBHOOK_PORT = int(os.getenv('QUIZ_BOT_WEBHOOK_PORT', 8443))
+ANSWER_BOT_WEBHOOK_PORT = int(os.getenv('ANSWER_BOT_WEBHOOK_PORT', 8444))
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN') or None
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org')  # Or a self-hosted Bot API server
+
 # Database Configuration
 DATABASE_URL = os.getenv('DATABASE_URL', 'database.db')
+DB_POOL_SIZE = 8  # Idle SQLite connections kept for reuse
+DB_BUSY_TIMEOUT = 10  # Seconds a write waits for another writer before "database is locked"
+DB_CACHE_SIZE_KB = 16384  # Page cache of each connection
+DB_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file read through a memory map
+DB_STATEMENT_CACHE_SIZE = 256  # Prepared statements kept by each connection
+DB_READ_THREADS = 4  # Threads running the bots' database reads, writes have a thread of their own
+CHANNEL_CACHE_CHECK_INTERVAL = 1.0  # Seconds cached channel records are used before checking for edits
 
 # Flask Configuration
 SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -29,8 +45,62 @@ TIMEZONE = 'Asia/Kolkata'
 
 # Quiz Configuration
 DEFAULT_QUESTIONS_PER_QUIZ = 10
-DEFAULT_POLL_DURATION = 300  # 5 minutes in seconds
+DEFAULT_POLL_DURATION = 300  # 5 minutes in seconds, open_period of quiz polls
+POLL_CLOSE_GRACE = 20  # Seconds past the close time before answers go out without a close update
+POLL_CLOSE_CHECK_INTERVAL = 2  # Seconds between answer bot checks for closed polls
 QUIZ_INTERVAL_SECONDS = 10  # Interval between questions
+TIMER_WHEEL_TICK = 0.5  # Seconds per tick of the quiz session timer wheel
+QUIZ_SESSION_RESUME_WINDOW = 1800  # Interrupted quizzes older than this are not resumed
+QUIZ_SESSION_RETENTION = 86400  # Seconds ended session checkpoints are kept
+QUIZ_WARMUP_MINUTES = int(os.getenv('QUIZ_WARMUP_MINUTES', 5))  # Prepare polls this long before a trigger
+SCHEDULE_SYNC_INTERVAL = 15  # Seconds between checks for schedule changes made in the web panel
+MAX_CONCURRENT_QUIZZES = int(os.getenv('MAX_CONCURRENT_QUIZZES', 50))  # Channel sessions running at once
+USAGE_FLUSH_INTERVAL = 30  # Seconds between writes of buffered question usage counts
+USAGE_SPOOL_FILE = 'data/usage_buffer.json'  # Pending usage counts kept across restarts
+POLL_REGISTRY_GRACE_PERIOD = 600  # Seconds a closed poll stays in memory
+POLL_REGISTRY_MAX_ENTRIES = 10000  # Upper bound on polls kept in memory
+POLL_REGISTRY_RETENTION = 86400  # Seconds a closed poll stays in the poll_registry table
+POLL_ANSWER_BATCH_SIZE = 500  # Poll answers written per executemany
+POLL_ANSWER_FLUSH_INTERVAL = 1.0  # Max seconds an answer waits before its batch is written
+POLL_ANSWER_QUEUE_SIZE = 100000  # Answers buffered before new ones are dropped
+
+# Answer Bot Question Matching
+# Polls sent by the quiz bot are looked up by poll id, text matching is only
+# needed for polls posted some other way and keeps every question in memory
+ANSWER_BOT_TEXT_MATCHING = os.getenv('ANSWER_BOT_TEXT_MATCHING', 'False').lower() == 'true'
+QUESTION_MATCH_THRESHOLD = 0.6  # Minimum trigram similarity of a fuzzy question match
+QUESTION_REFRESH_INTERVAL = 5  # Seconds between checks for question uploads and edits
+ANSWER_ENTRY_CACHE_SIZE = 512  # Questions whose answer data the answer bot keeps between polls
+# Post the explanations of a quiz together once its last poll closes instead of one message per poll
+ANSWER_DIGEST_MODE = os.getenv('ANSWER_DIGEST_MODE', 'False').lower() == 'true'
+ANSWER_DIGEST_MAX_WAIT = 1800  # Seconds a digest waits for its last poll after it should have closed
+
+# Telegram Poll and Message Limits
+POLL_QUESTION_MAX_LENGTH = 300
+POLL_OPTION_MAX_LENGTH = 100
+POLL_EXPLANATION_MAX_LENGTH = 200
+MESSAGE_MAX_LENGTH = 4096
+
+# Telegram Rate Limits
+TELEGRAM_GLOBAL_RATE = 30  # Messages per second for the whole bot
+TELEGRAM_GROUP_RATE = 20 / 60  # Messages per second to one group or channel
+TELEGRAM_GROUP_BURST = 3
+TELEGRAM_PRIVATE_RATE = 1  # Messages per second to one private chat
+TELEGRAM_PRIVATE_BURST = 1
+TELEGRAM_MAX_RETRIES = 2  # Retries after a RetryAfter flood error
+
+# Shared HTTP Connection Pool (single-process runtime)
+HTTP_POOL_SIZE = 32  # Connections shared by both bots
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 10.0
+HTTP_WRITE_TIMEOUT = 10.0
+HTTP_POOL_TIMEOUT = 5.0  # Seconds to wait for a free connection
+
+# Outbound Message Outbox
+OUTBOX_MAX_ATTEMPTS = 8  # Send attempts before a message is marked failed
+OUTBOX_BASE_DELAY = 1.0  # Seconds before the first retry, doubled on every attempt
+OUTBOX_MAX_DELAY = 300.0  # Upper bound of the retry backoff
+OUTBOX_RETENTION = 86400  # Seconds sent and failed messages are kept
 
 # Logging Configuration
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
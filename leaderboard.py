@@ -0,0 +1,238 @@
+import bisect
+import datetime
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+
+import pytz
+
+from models import get_db_connection, PollAnswer
+
+logger = logging.getLogger(__name__)
+
+IST = pytz.timezone('Asia/Kolkata')
+IST_OFFSET_SECONDS = 19800  # Asia/Kolkata has no DST, used for period keys inside SQLite
+
+PERIODS = ('day', 'week', 'all')
+
+
+def period_keys(timestamp):
+    """Return the day, week and all-time keys for a unix timestamp in IST"""
+    dt = datetime.datetime.fromtimestamp(timestamp, IST)
+    return {
+        'day': dt.strftime('%Y-%m-%d'),
+        # ISO week, so the days of one week around New Year share a key
+        'week': dt.strftime('%G-W%V'),
+        'all': 'all'
+    }
+
+
+def iso_week_sql(date_sql):
+    """SQL for the '%G-W%V' key of a date, SQLite before 3.46 has no %G/%V.
+    The ISO week and year are those of the Thursday of the date's week"""
+    thursday = f"date({date_sql}, printf('%+d days', 3 - (CAST(strftime('%w', {date_sql}) AS INTEGER) + 6) % 7))"
+    return (f"strftime('%Y', {thursday}) || '-W' || "
+            f"printf('%02d', (CAST(strftime('%j', {thursday}) AS INTEGER) - 1) / 7 + 1)")
+
+
+class RankedScores:
+    """Scores of one leaderboard kept sorted for O(k) top-k reads. An update finds its
+    place by binary search, then moves the list tail, O(n) in the worst case"""
+
+    def __init__(self):
+        self.scores = {}  # user id -> score
+        self.ranking = []  # sorted (-score, user_id)
+
+    @classmethod
+    def from_sorted(cls, rows):
+        """Build a board from (user_id, score) rows ordered by score DESC, user_id"""
+        board = cls()
+        for user_id, score in rows:
+            board.scores[user_id] = score
+            board.ranking.append((-score, user_id))
+        return board
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self, user_id, delta):
+        old = self.scores.get(user_id)
+        if old is not None:
+            del self.ranking[bisect.bisect_left(self.ranking, (-old, user_id))]
+        new = (old or 0) + delta
+        self.scores[user_id] = new
+        bisect.insort(self.ranking, (-new, user_id))
+
+    def top(self, limit):
+        return [(user_id, -score) for score, user_id in self.ranking[:limit]]
+
+
+class Leaderboards:
+    """Per-channel day, week and all-time leaderboards.
+
+    Scores are updated from every batch of poll answers: the answers and the
+    leaderboard_scores rollup rows are written in one transaction, then the
+    in-memory RankedScores are adjusted. Reads never touch the answers table.
+    On startup the current boards are loaded from the rollup table, which is
+    rebuilt from poll_answers first if it is empty. Day and week rollups of
+    past periods are purged.
+    """
+
+    def __init__(self, poll_cache_size=2000):
+        self.lock = threading.Lock()
+        self.boards = {}  # (channel_id, period, period_key) -> RankedScores
+        self.user_names = {}
+        self.poll_cache = OrderedDict()  # poll id -> (channel_id, correct_option)
+        self.poll_cache_size = poll_cache_size
+
+    def load(self):
+        """Load the current day, week and all-time boards from the rollup table"""
+        with get_db_connection() as conn:
+            has_scores = conn.execute('SELECT 1 FROM leaderboard_scores LIMIT 1').fetchone()
+            has_answers = conn.execute(
+                'SELECT 1 FROM poll_answers WHERE channel_id IS NOT NULL LIMIT 1'
+            ).fetchone()
+        if not has_scores and has_answers:
+            self.rebuild()
+
+        keys = period_keys(datetime.datetime.now(IST).timestamp())
+        boards = {}
+        with get_db_connection() as conn:
+            for period in PERIODS:
+                rows = conn.execute('''
+                    SELECT channel_id, user_id, score FROM leaderboard_scores
+                    WHERE period = ? AND period_key = ?
+                    ORDER BY channel_id, score DESC, user_id
+                ''', (period, keys[period]))
+                # Rows come in ranking order, so each board is built without sorting
+                for channel_id, channel_rows in itertools.groupby(rows, key=lambda row: row[0]):
+                    boards[(channel_id, period, keys[period])] = RankedScores.from_sorted(
+                        (user_id, score) for _, user_id, score in channel_rows)
+            user_names = dict(conn.execute('SELECT user_id, user_name FROM leaderboard_users').fetchall())
+
+        with self.lock:
+            self.boards = boards
+            self.user_names = user_names
+        logger.info(f"Loaded {len(boards)} leaderboards")
+
+    def rebuild(self):
+        """Recompute the rollup table from poll_answers"""
+        day_expr = f"strftime('%Y-%m-%d', answered_at + {IST_OFFSET_SECONDS}, 'unixepoch')"
+        week_expr = iso_week_sql(f"datetime(answered_at + {IST_OFFSET_SECONDS}, 'unixepoch')")
+        with get_db_connection() as conn:
+            conn.execute('DELETE FROM leaderboard_scores')
+            for period, key_expr in (('day', day_expr), ('week', week_expr), ('all', "'all'")):
+                conn.execute(f'''
+                    INSERT INTO leaderboard_scores (channel_id, period, period_key, user_id, score, answers)
+                    SELECT channel_id, '{period}', {key_expr}, user_id, SUM(is_correct), COUNT(*)
+                    FROM poll_answers WHERE channel_id IS NOT NULL AND is_correct IS NOT NULL
+                    GROUP BY channel_id, {key_expr}, user_id
+                ''')
+            conn.commit()
+        logger.info("Rebuilt leaderboard rollups from poll answers")
+
+    def purge(self):
+        """Delete day and week rollups of past periods, runs on the writer thread.
+        rebuild() can recompute them from poll_answers"""
+        keys = period_keys(datetime.datetime.now(IST).timestamp())
+        with get_db_connection() as conn:
+            deleted = 0
+            for period in ('day', 'week'):
+                deleted += conn.execute('''
+                    DELETE FROM leaderboard_scores WHERE period = ? AND period_key < ?
+                ''', (period, keys[period])).rowcount
+            conn.commit()
+        return deleted
+
+    def _resolve_polls(self, conn, poll_ids):
+        """Map poll ids to (channel_id, correct_option), querying only unknown polls"""
+        with self.lock:
+            resolved = {poll_id: self.poll_cache[poll_id] for poll_id in poll_ids
+                        if poll_id in self.poll_cache}
+        unknown = [poll_id for poll_id in poll_ids if poll_id not in resolved]
+
+        if unknown:
+            placeholders = ','.join('?' * len(unknown))
+            rows = conn.execute(f'''
+                SELECT pr.poll_id, q.channel_id, q.correct_option
+                FROM poll_registry pr JOIN questions q ON q.id = pr.question_id
+                WHERE pr.poll_id IN ({placeholders})
+            ''', unknown).fetchall()
+            with self.lock:
+                for poll_id, channel_id, correct_option in rows:
+                    resolved[poll_id] = self.poll_cache[poll_id] = (channel_id, correct_option)
+                while len(self.poll_cache) > self.poll_cache_size:
+                    self.poll_cache.popitem(last=False)
+        return resolved
+
+    def record_answers(self, batch):
+        """Store a batch of (poll_id, user_id, option_id, answered_at, user_name) answers and
+        update the leaderboards, runs in a worker thread.
+        
+        Answers already stored are not scored again, so a batch retried after an
+        error that came after the commit changes nothing."""
+        deltas = {}  # (channel_id, period, period_key, user_id) -> [score, answers]
+        names = {}
+        with get_db_connection() as conn:
+            # Write lock first, bulk_insert tells new rows apart by their ids
+            conn.execute('BEGIN IMMEDIATE')
+            polls = self._resolve_polls(conn, {answer[0] for answer in batch})
+
+            rows = []
+            for poll_id, user_id, option_id, answered_at, user_name in batch:
+                channel_id, correct_option = polls.get(poll_id, (None, None))
+                is_correct = None
+                if channel_id is not None and option_id is not None:
+                    is_correct = int(option_id == correct_option)
+                    if user_name:
+                        names[user_id] = user_name
+                rows.append((poll_id, user_id, option_id, answered_at, channel_id, is_correct))
+
+            # Roll up only the answers that were new
+            for poll_id, user_id, option_id, answered_at, channel_id, is_correct in PollAnswer.bulk_insert(conn, rows):
+                if is_correct is None:
+                    continue
+                for period, key in period_keys(answered_at).items():
+                    delta = deltas.setdefault((channel_id, period, key, user_id), [0, 0])
+                    delta[0] += is_correct
+                    delta[1] += 1
+            conn.executemany('''
+                INSERT INTO leaderboard_scores (channel_id, period, period_key, user_id, score, answers)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (channel_id, period, period_key, user_id)
+                DO UPDATE SET score = score + excluded.score, answers = answers + excluded.answers
+            ''', [(*key, score, answers) for key, (score, answers) in deltas.items()])
+            conn.executemany('''
+                INSERT INTO leaderboard_users (user_id, user_name) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET user_name = excluded.user_name
+            ''', list(names.items()))
+            conn.commit()
+
+        current = period_keys(datetime.datetime.now(IST).timestamp())
+        with self.lock:
+            self.user_names.update(names)
+            for (channel_id, period, key, user_id), (score, _) in deltas.items():
+                if key != current[period]:
+                    continue
+                board = self.boards.get((channel_id, period, key))
+                if board is None:
+                    board = self.boards[(channel_id, period, key)] = RankedScores()
+                    self._drop_stale_boards(period, key)
+                board.add(user_id, score)
+
+    def _drop_stale_boards(self, period, current_key):
+        stale = [board_key for board_key in self.boards
+                 if board_key[1] == period and board_key[2] != current_key]
+        for board_key in stale:
+            del self.boards[board_key]
+
+    def top(self, channel_id, period='day', limit=10):
+        """Return [(user_id, user_name, score)] of a channel's current leaderboard"""
+        key = period_keys(datetime.datetime.now(IST).timestamp())[period]
+        with self.lock:
+            board = self.boards.get((channel_id, period, key))
+            if not board:
+                return []
+            return [(user_id, self.user_names.get(user_id), score)
+                    for user_id, score in board.top(limit)]
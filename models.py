@@ -1,15 +1,114 @@
 import sqlite3
 import datetime
+import json
+import logging
+import os
+import threading
+import time
 import pytz
+from collections import OrderedDict, namedtuple
 from contextlib import contextmanager
 
+from config import (DB_POOL_SIZE, DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_MMAP_SIZE,
+                    DB_STATEMENT_CACHE_SIZE, CHANNEL_CACHE_CHECK_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
 IST = pytz.timezone('Asia/Kolkata')
 DATABASE = 'database.db'
 
+class PooledConnection(sqlite3.Connection):
+    """Connection handed out by the pool, close() and the end of a with block return it"""
+    
+    def __exit__(self, *exc_info):
+        try:
+            return super().__exit__(*exc_info)
+        finally:
+            _pool.release(self)
+    
+    def close(self):
+        _pool.release(self)
+
+class ConnectionPool:
+    """Idle SQLite connections reused by every thread and task of the process.
+    
+    A connection is set up once when opened: WAL journal, synchronous=NORMAL,
+    busy timeout, page cache, memory map and a larger prepared statement
+    cache. A checked out connection belongs to its caller alone, so Flask
+    request threads and bot tasks never share one, and goes back to the pool
+    on close() or at the end of its with block. Uncommitted work is rolled
+    back on return, as closing the connection used to do.
+    """
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = []
+    
+    def acquire(self):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None or conn.database != DATABASE:
+            conn = self._connect()
+        conn.checked_out = True
+        return conn
+    
+    def release(self, conn):
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding database connection: {e}")
+            sqlite3.Connection.close(conn)
+            return
+        
+        with self.lock:
+            if len(self.idle) < self.max_idle and conn.database == DATABASE:
+                self.idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+    
+    def _connect(self):
+        conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE_SIZE, factory=PooledConnection)
+        conn.database = DATABASE
+        conn.checked_out = False
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        return conn
+
+_pool = ConnectionPool(DB_POOL_SIZE)
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Check out a pooled connection, return it with close() or a with block"""
+    return _pool.acquire()
+
+# Tables whose changes bump their data_versions counter, with the columns that count
+# for updates (None = any column). last_quiz_sent writes do not bump the channels version.
+VERSIONED_TABLES = {
+    'schedules': None,
+    'channels': ['channel_name', 'channel_id', 'discussion_group_id', 'category',
+                 'questions_per_batch', 'active']
+}
+
+# Question columns whose changes are picked up by QuestionCache, used_count writes are not
+QUESTION_CONTENT_COLUMNS = ['channel_id', 'question_text', 'option_a', 'option_b', 'option_c',
+                            'option_d', 'correct_option', 'explanation', 'reason']
+
+def get_data_versions():
+    """Return {table: version} of the versioned tables, a cheap change check"""
+    with get_db_connection() as conn:
+        return dict(conn.execute('SELECT name, version FROM data_versions').fetchall())
+
+def _add_column_if_missing(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
 
 @contextmanager
 def get_db():
@@ -19,72 +118,317 @@ def get_db():
     finally:
         conn.close()
 
+def _create_base_schema(conn):
+    """Tables, columns and triggers of the schema before migrations were versioned"""
+    # Create channels table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_name TEXT NOT NULL,
+            channel_id TEXT NOT NULL UNIQUE,
+            discussion_group_id TEXT,
+            category TEXT NOT NULL,
+            questions_per_batch INTEGER DEFAULT 10,
+            active BOOLEAN DEFAULT 1,
+            last_quiz_sent DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create questions table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER,
+            question_text TEXT NOT NULL,
+            option_a TEXT NOT NULL,
+            option_b TEXT NOT NULL,
+            option_c TEXT NOT NULL,
+            option_d TEXT NOT NULL,
+            correct_option INTEGER NOT NULL,
+            explanation TEXT,
+            reason TEXT,
+            used_count INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (channel_id) REFERENCES channels (id)
+        )
+    ''')
+    
+    # Create schedules table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER,
+            schedule_time TEXT NOT NULL,
+            days_of_week TEXT NOT NULL,
+            interval_type TEXT NOT NULL,
+            active BOOLEAN DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (channel_id) REFERENCES channels (id)
+        )
+    ''')
+    
+    # Create quiz_history table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER,
+            questions_sent INTEGER,
+            sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (channel_id) REFERENCES channels (id)
+        )
+    ''')
+    
+    # Create question rotation deck tables
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS question_decks (
+            channel_id INTEGER PRIMARY KEY,
+            cursor REAL NOT NULL DEFAULT -1,
+            max_question_id INTEGER NOT NULL DEFAULT 0,
+            round INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (channel_id) REFERENCES channels (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS question_deck_cards (
+            channel_id INTEGER NOT NULL,
+            sort_key REAL NOT NULL,
+            question_id INTEGER NOT NULL,
+            PRIMARY KEY (channel_id, sort_key, question_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Create poll registry table (poll id -> question, shared with the answer bot)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS poll_registry (
+            poll_id TEXT PRIMARY KEY,
+            question_id INTEGER NOT NULL,
+            chat_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            close_time REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_poll_registry_close_time ON poll_registry (close_time)')
+    _add_column_if_missing(conn, 'poll_registry', 'closed_at', 'REAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_poll_registry_closed_at ON poll_registry (closed_at)')
+    # Quiz the poll belongs to and its place in it, for answer digests
+    _add_column_if_missing(conn, 'poll_registry', 'quiz_key', 'TEXT')
+    _add_column_if_missing(conn, 'poll_registry', 'poll_number', 'INTEGER')
+    _add_column_if_missing(conn, 'poll_registry', 'poll_count', 'INTEGER')
+    
+    # Create poll answers table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS poll_answers (
+            id INTEGER PRIMARY KEY,
+            poll_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            option_id INTEGER,
+            answered_at REAL NOT NULL
+        )
+    ''')
+    _add_column_if_missing(conn, 'poll_answers', 'channel_id', 'INTEGER')
+    _add_column_if_missing(conn, 'poll_answers', 'is_correct', 'INTEGER')
+    
+    # Create leaderboard rollup tables, kept up to date with every answer batch
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_scores (
+            channel_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            period_key TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            score INTEGER NOT NULL DEFAULT 0,
+            answers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (channel_id, period, period_key, user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_scores_top
+        ON leaderboard_scores (channel_id, period, period_key, score DESC)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_users (
+            user_id INTEGER PRIMARY KEY,
+            user_name TEXT
+        )
+    ''')
+    
+    # Create outbox table for outbound bot messages
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            chat_id TEXT NOT NULL,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            context TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            message_id INTEGER,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_sender_status ON outbox (sender, status, id)')
+    
+    # Create quiz session checkpoints, written after every step so quizzes resume after a restart
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            quiz_key TEXT NOT NULL UNIQUE,
+            steps TEXT NOT NULL,
+            next_index INTEGER NOT NULL DEFAULT 0,
+            state TEXT NOT NULL DEFAULT 'running',
+            next_at REAL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_quiz_sessions_state ON quiz_sessions (state, updated_at)')
+    
+    # Create data version counters, bumped by triggers on every change
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table, columns in VERSIONED_TABLES.items():
+        conn.execute('INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            if event == 'UPDATE' and columns:
+                event_clause = f"UPDATE OF {', '.join(columns)}"
+            else:
+                event_clause = event
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event_clause} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+    
+    
+    # Stamp changed questions with the new questions version and keep tombstones of deleted
+    # ones, so QuestionCache can fetch only what changed since the version it has
+    _add_column_if_missing(conn, 'questions', 'row_version', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_questions_row_version ON questions (row_version)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS deleted_questions (
+            question_id INTEGER PRIMARY KEY,
+            row_version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('questions', 0)")
+    for event in ('insert', 'update', 'delete'):
+        # Replaced by the row version triggers below
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_questions_{event}_version')
+    for event, event_clause in (('insert', 'INSERT'),
+                                ('update', f"UPDATE OF {', '.join(QUESTION_CONTENT_COLUMNS)}")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_questions_{event}_row_version
+            AFTER {event_clause} ON questions
+            BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'questions';
+                UPDATE questions SET row_version = (SELECT version FROM data_versions WHERE name = 'questions')
+                WHERE id = NEW.id;
+                DELETE FROM deleted_questions WHERE question_id = NEW.id;
+            END
+        ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_questions_delete_row_version
+        AFTER DELETE ON questions
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'questions';
+            INSERT OR REPLACE INTO deleted_questions (question_id, row_version)
+            VALUES (OLD.id, (SELECT version FROM data_versions WHERE name = 'questions'));
+        END
+    ''')
+
+def _add_hot_path_indexes(conn):
+    """Indexes for questions by channel, active schedules and the dashboard's recent activity"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_questions_channel_used ON questions (channel_id, used_count)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_schedules_active_channel ON schedules (active, channel_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_channels_last_quiz_sent ON channels (last_quiz_sent)')
+
+def _stamp_bulk_inserts(conn):
+    """Skip the per-row insert trigger for rows Question.bulk_insert stamped with a version"""
+    conn.execute('DROP TRIGGER IF EXISTS trg_questions_insert_row_version')
+    conn.execute('''
+        CREATE TRIGGER trg_questions_insert_row_version
+        AFTER INSERT ON questions
+        WHEN NEW.row_version = 0
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'questions';
+            UPDATE questions SET row_version = (SELECT version FROM data_versions WHERE name = 'questions')
+            WHERE id = NEW.id;
+            DELETE FROM deleted_questions WHERE question_id = NEW.id;
+        END
+    ''')
+
+def _unique_poll_answers(conn):
+    """One answer per user and poll, so a retried answer batch is not scored twice"""
+    conn.execute('''
+        DELETE FROM poll_answers WHERE id NOT IN (
+            SELECT MIN(id) FROM poll_answers GROUP BY poll_id, user_id
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_poll_answers_poll_user ON poll_answers (poll_id, user_id)')
+    # Leaderboards.load rebuilds the rollups from the remaining answers, with ISO week keys
+    conn.execute('DELETE FROM leaderboard_scores')
+
+# Schema migrations in order, the database's PRAGMA user_version is the number applied.
+# Only ever append: a released migration has already run on existing databases.
+MIGRATIONS = [
+    _create_base_schema,
+    _add_hot_path_indexes,
+    _stamp_bulk_inserts,
+    _unique_poll_answers,
+]
+
 def init_db():
+    """Apply the migrations the database has not seen yet, each in its own transaction"""
     with get_db_connection() as conn:
-        # Create channels table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_name TEXT NOT NULL,
-                channel_id TEXT NOT NULL UNIQUE,
-                discussion_group_id TEXT,
-                category TEXT NOT NULL,
-                questions_per_batch INTEGER DEFAULT 10,
-                active BOOLEAN DEFAULT 1,
-                last_quiz_sent DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create questions table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS questions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER,
-                question_text TEXT NOT NULL,
-                option_a TEXT NOT NULL,
-                option_b TEXT NOT NULL,
-                option_c TEXT NOT NULL,
-                option_d TEXT NOT NULL,
-                correct_option INTEGER NOT NULL,
-                explanation TEXT,
-                reason TEXT,
-                used_count INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (channel_id) REFERENCES channels (id)
-            )
-        ''')
-        
-        # Create schedules table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS schedules (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER,
-                schedule_time TEXT NOT NULL,
-                days_of_week TEXT NOT NULL,
-                interval_type TEXT NOT NULL,
-                active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (channel_id) REFERENCES channels (id)
-            )
-        ''')
-        
-        # Create quiz_history table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS quiz_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER,
-                questions_sent INTEGER,
-                sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (channel_id) REFERENCES channels (id)
-            )
-        ''')
-        
-        conn.commit()
+        while True:
+            # The write lock is taken before reading the version, so processes starting
+            # together apply every migration once
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                break
+            
+            migration = MIGRATIONS[version]
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+            logger.info(f"Applied database migration {version + 1}: {migration.__name__}")
+
+# Ids per IN (...) query, well below SQLite's limit on query parameters
+IN_BATCH_SIZE = 500
+
+def fetch_in_batches(query, values, batch_size=IN_BATCH_SIZE):
+    """Run a query ending in "IN ({})" once per batch of values, returns the rows of all batches"""
+    values = list(values)
+    rows = []
+    with get_db_connection() as conn:
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            rows.extend(conn.execute(query.format(','.join('?' * len(batch))), batch).fetchall())
+    return rows
 
 class Channel:
+    __slots__ = ('id', 'channel_name', 'channel_id', 'discussion_group_id', 'category',
+                 'questions_per_batch', 'active', 'last_quiz_sent', 'created_at')
+    # Select list in constructor order, so rows are built with cls(*row)
+    COLUMNS = ', '.join(__slots__)
+    
     def __init__(self, id=None, channel_name=None, channel_id=None, discussion_group_id=None, 
-                 category=None, questions_per_batch=10, active=True):
+                 category=None, questions_per_batch=10, active=True, last_quiz_sent=None,
+                 created_at=None):
         self.id = id
         self.channel_name = channel_name
         self.channel_id = channel_id
@@ -92,6 +436,8 @@ class Channel:
         self.category = category
         self.questions_per_batch = questions_per_batch
         self.active = active
+        self.last_quiz_sent = last_quiz_sent
+        self.created_at = created_at
     
     def save(self):
         with get_db_connection() as conn:
@@ -118,25 +464,115 @@ class Channel:
     @classmethod
     def get_all(cls):
         with get_db_connection() as conn:
-            rows = conn.execute('SELECT * FROM channels ORDER BY channel_name').fetchall()
-            return [cls(**dict(row)) for row in rows]
+            rows = conn.execute(f'SELECT {cls.COLUMNS} FROM channels ORDER BY channel_name').fetchall()
+            return [cls(*row) for row in rows]
     
     @classmethod
     def get_by_id(cls, channel_id):
         with get_db_connection() as conn:
-            row = conn.execute('SELECT * FROM channels WHERE id = ?', (channel_id,)).fetchone()
-            return cls(**dict(row)) if row else None
+            row = conn.execute(f'SELECT {cls.COLUMNS} FROM channels WHERE id = ?', (channel_id,)).fetchone()
+            return cls(*row) if row else None
     
     @classmethod
     def get_by_channel_id(cls, channel_id):
         with get_db_connection() as conn:
-            row = conn.execute('SELECT * FROM channels WHERE channel_id = ?', (channel_id,)).fetchone()
-            return cls(**dict(row)) if row else None
+            row = conn.execute(f'SELECT {cls.COLUMNS} FROM channels WHERE channel_id = ?', (channel_id,)).fetchone()
+            return cls(*row) if row else None
+    
+    @classmethod
+    def get_many(cls, ids):
+        """Return the channels with the given row ids, unknown ids are skipped"""
+        rows = fetch_in_batches(f'SELECT {cls.COLUMNS} FROM channels WHERE id IN ({{}})', ids)
+        return [cls(*row) for row in rows]
+
+class ChannelCache:
+    """Read-through cache of channel records by row id and by Telegram channel id.
+    
+    A channel read once is served from memory. Lookups check the channels
+    data version at most once per check_interval seconds and drop every
+    cached record when it moved, so edits made in the admin panel show up
+    within that interval. last_quiz_sent writes do not move the version,
+    record_quiz_sent() keeps the cached value current instead.
+    """
+    def __init__(self, check_interval=CHANNEL_CACHE_CHECK_INTERVAL):
+        self.lock = threading.Lock()
+        self.check_interval = check_interval
+        self.by_id = {}  # channel row id -> Channel
+        self.by_channel_id = {}  # Telegram channel id -> Channel
+        self.version = None  # channels data version of the cached records
+        self.checked_at = None  # monotonic time of the last version check
+    
+    def __len__(self):
+        return len(self.by_id)
+    
+    def get_by_id(self, channel_id):
+        """Same as Channel.get_by_id"""
+        return self._get(self.by_id, Channel.get_by_id, channel_id)
+    
+    def get_by_channel_id(self, channel_id):
+        """Same as Channel.get_by_channel_id"""
+        return self._get(self.by_channel_id, Channel.get_by_channel_id, channel_id)
+    
+    def cached_by_id(self, channel_id):
+        """Return the cached channel if it is known to be current, without any database access"""
+        return self._peek(self.by_id, channel_id)
+    
+    def cached_by_channel_id(self, channel_id):
+        """Return the cached channel if it is known to be current, without any database access"""
+        return self._peek(self.by_channel_id, channel_id)
+    
+    def record_quiz_sent(self, channel_id, sent_at):
+        """Update last_quiz_sent of a cached channel, same value as UsageBuffer writes"""
+        with self.lock:
+            channel = self.by_id.get(channel_id)
+            if channel:
+                channel.last_quiz_sent = str(sent_at)
+    
+    def _peek(self, index, key):
+        with self.lock:
+            if self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval:
+                return None
+            return index.get(key)
+    
+    def _get(self, index, load, key):
+        self._check_version()
+        with self.lock:
+            channel = index.get(key)
+            version = self.version
+        if channel:
+            return channel
+        
+        channel = load(key)
+        with self.lock:
+            # The version moved while reading, the record may predate the edit
+            if channel and self.version == version:
+                self.by_id[channel.id] = channel
+                self.by_channel_id[channel.channel_id] = channel
+        return channel
+    
+    def _check_version(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return
+        
+        version = get_data_versions().get('channels')
+        with self.lock:
+            if version != self.version:
+                self.by_id.clear()
+                self.by_channel_id.clear()
+                self.version = version
+            self.checked_at = now
 
 class Question:
+    __slots__ = ('id', 'channel_id', 'question_text', 'option_a', 'option_b', 'option_c', 'option_d',
+                 'correct_option', 'explanation', 'reason', 'used_count', 'created_at', 'row_version')
+    # Select list in constructor order, so rows are built with cls(*row)
+    COLUMNS = ', '.join(__slots__)
+    
     def __init__(self, id=None, channel_id=None, question_text=None, option_a=None, 
                  option_b=None, option_c=None, option_d=None, correct_option=None,
-                 explanation=None, reason=None, used_count=0):
+                 explanation=None, reason=None, used_count=0, created_at=None, row_version=0):
         self.id = id
         self.channel_id = channel_id
         self.question_text = question_text
@@ -148,6 +584,8 @@ class Question:
         self.explanation = explanation
         self.reason = reason
         self.used_count = used_count
+        self.created_at = created_at
+        self.row_version = row_version
     
     def save(self):
         with get_db_connection() as conn:
@@ -173,35 +611,407 @@ class Question:
             conn.commit()
     
     @classmethod
-    def get_by_channel(cls, channel_id, limit=None):
+    def get_by_channel(cls, channel_id):
+        """Return all questions of a channel, least used first. Quizzes deal theirs from
+        QuestionDeck.deal_questions"""
+        with get_db_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {cls.COLUMNS} FROM questions WHERE channel_id = ? 
+                ORDER BY used_count ASC
+            ''', (channel_id,)).fetchall()
+            return [cls(*row) for row in rows]
+    
+    @classmethod
+    def count(cls):
         with get_db_connection() as conn:
-            if limit:
-                rows = conn.execute('''
-                    SELECT * FROM questions WHERE channel_id = ? 
-                    ORDER BY used_count ASC, RANDOM() LIMIT ?
-                ''', (channel_id, limit)).fetchall()
-            else:
-                rows = conn.execute('''
-                    SELECT * FROM questions WHERE channel_id = ? 
-                    ORDER BY used_count ASC
-                ''', (channel_id,)).fetchall()
-            return [cls(**dict(row)) for row in rows]
+            return conn.execute('SELECT COUNT(*) FROM questions').fetchone()[0]
     
     @classmethod
     def get_by_id(cls, question_id):
         with get_db_connection() as conn:
-            row = conn.execute('SELECT * FROM questions WHERE id = ?', (question_id,)).fetchone()
-            return cls(**dict(row)) if row else None
+            row = conn.execute(f'SELECT {cls.COLUMNS} FROM questions WHERE id = ?', (question_id,)).fetchone()
+            return cls(*row) if row else None
+    
+    @classmethod
+    def get_many(cls, question_ids):
+        """Return the questions with the given ids, unknown ids are skipped"""
+        if not question_ids:
+            return []
+        rows = fetch_in_batches(f'SELECT {cls.COLUMNS} FROM questions WHERE id IN ({{}})', question_ids)
+        return [cls(*row) for row in rows]
+    
+    @classmethod
+    def bulk_insert(cls, conn, questions):
+        """Insert new questions with one executemany, the caller commits. Their ids are not
+        set, returns the number inserted"""
+        questions = list(questions)
+        if not questions:
+            return 0
+        
+        # One questions version for the whole batch, the insert trigger skips rows stamped here
+        conn.execute("UPDATE data_versions SET version = version + 1 WHERE name = 'questions'")
+        version = conn.execute("SELECT version FROM data_versions WHERE name = 'questions'").fetchone()[0]
+        conn.executemany('''
+            INSERT INTO questions (channel_id, question_text, option_a, option_b, option_c,
+                                 option_d, correct_option, explanation, reason, row_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(question.channel_id, question.question_text, question.option_a, question.option_b,
+               question.option_c, question.option_d, question.correct_option, question.explanation,
+               question.reason, version) for question in questions])
+        # Ids of deleted questions can be reused, their tombstones must not hide the new rows
+        conn.execute('''
+            DELETE FROM deleted_questions
+            WHERE question_id IN (SELECT id FROM questions WHERE row_version = ?)
+        ''', (version,))
+        return len(questions)
+    
+    @classmethod
+    def bulk_update_usage(cls, conn, counts):
+        """Add {question id: times used} to used_count with one executemany, the caller commits"""
+        conn.executemany(
+            'UPDATE questions SET used_count = used_count + ? WHERE id = ?',
+            [(count, question_id) for question_id, count in counts.items()]
+        )
+
+# Random fraction in [0, 1) used to shuffle deck cards inside SQLite
+RANDOM_FRACTION_SQL = '((abs(random()) % 1000000000) / 1000000000.0)'
+
+class QuestionDeck:
+    """Per-channel rotation deck of question ids.
+
+    Every card has a sort key of used_count plus a random fraction, so dealing
+    in key order hands out the least-used questions first in shuffled order.
+    The deck keeps a cursor on the last dealt key; dealing reads the next k
+    cards from the (channel_id, sort_key) primary key. The deck is reshuffled
+    only when it runs out, and questions added since the last deal are
+    inserted just after the cursor.
+    """
+    
+    @classmethod
+    def deal(cls, channel_id, count):
+        """Return the next question ids for a channel and advance the cursor"""
+        with get_db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            deck = conn.execute(
+                'SELECT cursor, max_question_id FROM question_decks WHERE channel_id = ?',
+                (channel_id,)
+            ).fetchone()
+            
+            if deck:
+                cursor = deck['cursor']
+                cls._add_new_questions(conn, channel_id, cursor, deck['max_question_id'])
+            else:
+                cursor = -1
+                cls._build(conn, channel_id)
+            
+            cards = conn.execute('''
+                SELECT sort_key, question_id FROM question_deck_cards
+                WHERE channel_id = ? AND sort_key > ?
+                ORDER BY sort_key LIMIT ?
+            ''', (channel_id, cursor, count)).fetchall()
+            question_ids = [card['question_id'] for card in cards]
+            
+            if len(question_ids) < count:
+                # Deck exhausted, start a new round and deal the rest from it
+                cls._reshuffle(conn, channel_id)
+                dealt = set(question_ids)
+                cards = conn.execute('''
+                    SELECT sort_key, question_id FROM question_deck_cards
+                    WHERE channel_id = ? ORDER BY sort_key LIMIT ?
+                ''', (channel_id, count)).fetchall()
+                cards = [card for card in cards if card['question_id'] not in dealt]
+                cards = cards[:count - len(question_ids)]
+                question_ids.extend(card['question_id'] for card in cards)
+            
+            if cards:
+                conn.execute(
+                    'UPDATE question_decks SET cursor = ? WHERE channel_id = ?',
+                    (cards[-1]['sort_key'], channel_id)
+                )
+            conn.commit()
+            return question_ids
+    
+    @classmethod
+    def peek(cls, channel_id, count):
+        """Return up to count question ids deal() would hand out next, without dealing them.
+        Questions added since the last deal are not seen"""
+        with get_db_connection() as conn:
+            deck = conn.execute('SELECT cursor FROM question_decks WHERE channel_id = ?', (channel_id,)).fetchone()
+            if not deck:
+                return []
+            rows = conn.execute('''
+                SELECT question_id FROM question_deck_cards
+                WHERE channel_id = ? AND sort_key > ?
+                ORDER BY sort_key LIMIT ?
+            ''', (channel_id, deck['cursor'], count)).fetchall()
+            return [row[0] for row in rows]
+    
+    @classmethod
+    def deal_questions(cls, channel_id, count, source=None):
+        """Deal the next questions of a channel, dropping cards of deleted questions.
+        source is anything with get_many(ids), e.g. a QuestionCache, by default the database"""
+        source = source if source is not None else Question
+        questions = []
+        for _ in range(3):
+            question_ids = cls.deal(channel_id, count - len(questions))
+            if not question_ids:
+                break
+            
+            found = {question.id: question for question in source.get_many(question_ids)}
+            missing = [question_id for question_id in question_ids if question_id not in found]
+            questions.extend(found[question_id] for question_id in question_ids if question_id in found)
+            
+            if not missing:
+                break
+            cls.discard(channel_id, missing)
+        return questions
+    
+    @classmethod
+    def discard(cls, channel_id, question_ids):
+        """Remove cards of questions that no longer exist"""
+        with get_db_connection() as conn:
+            conn.executemany(
+                'DELETE FROM question_deck_cards WHERE channel_id = ? AND question_id = ?',
+                [(channel_id, question_id) for question_id in question_ids]
+            )
+            conn.commit()
+    
+    @classmethod
+    def delete(cls, conn, channel_id):
+        """Drop a channel's deck, used when the channel is deleted"""
+        conn.execute('DELETE FROM question_deck_cards WHERE channel_id = ?', (channel_id,))
+        conn.execute('DELETE FROM question_decks WHERE channel_id = ?', (channel_id,))
+    
+    @classmethod
+    def _build(cls, conn, channel_id):
+        conn.execute(f'''
+            INSERT INTO question_deck_cards (channel_id, sort_key, question_id)
+            SELECT channel_id, used_count + {RANDOM_FRACTION_SQL}, id
+            FROM questions WHERE channel_id = ?
+        ''', (channel_id,))
+        conn.execute('''
+            INSERT INTO question_decks (channel_id, cursor, max_question_id)
+            VALUES (?, -1, (SELECT COALESCE(MAX(id), 0) FROM questions))
+        ''', (channel_id,))
+    
+    @classmethod
+    def _reshuffle(cls, conn, channel_id):
+        conn.execute(f'''
+            UPDATE question_deck_cards
+            SET sort_key = COALESCE((SELECT used_count FROM questions WHERE id = question_id), 0)
+                           + {RANDOM_FRACTION_SQL}
+            WHERE channel_id = ?
+        ''', (channel_id,))
+        conn.execute(
+            'UPDATE question_decks SET cursor = -1, round = round + 1 WHERE channel_id = ?',
+            (channel_id,)
+        )
+    
+    @classmethod
+    def _add_new_questions(cls, conn, channel_id, cursor, max_question_id):
+        # Only rows above the last seen id are scanned, so uploads cost O(new rows)
+        conn.execute(f'''
+            INSERT OR IGNORE INTO question_deck_cards (channel_id, sort_key, question_id)
+            SELECT channel_id, ? + {RANDOM_FRACTION_SQL}, id
+            FROM questions WHERE id > ? AND channel_id = ?
+        ''', (max(cursor, 0), max_question_id, channel_id))
+        conn.execute('''
+            UPDATE question_decks SET max_question_id = (SELECT COALESCE(MAX(id), 0) FROM questions)
+            WHERE channel_id = ?
+        ''', (channel_id,))
+
+# What a texts-only QuestionCache keeps of a question
+QuestionText = namedtuple('QuestionText', ['id', 'channel_id', 'question_text', 'row_version'])
+
+# Changes applied by a QuestionCache refresh: full reload, or the question ids updated and deleted
+CacheChanges = namedtuple('CacheChanges', ['full', 'updated', 'deleted'])
+
+class QuestionCache:
+    """Questions of active channels held in memory, one instance can serve both bots.
+    
+    refresh() does nothing unless the questions or channels data version
+    changed, so calling it before every use costs one small query. Question
+    changes are applied incrementally: rows whose row_version is newer than
+    the loaded copy, and tombstones from deleted_questions. Channel changes
+    reload everything, and so does a copy older than the purged tombstones.
+    Listeners get the CacheChanges of every refresh.
+    
+    With texts_only the cache holds QuestionTexts instead of Questions, for
+    text matching. get_many and get_with_channel then read the questions
+    from the database. restrict() limits the cache to some channels, the
+    others are read from the database the same way.
+    
+    Refreshes run one at a time, listeners included, so listeners see the
+    changes in the order they were applied.
+    """
+    def __init__(self, texts_only=False):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # Held for a whole refresh, listeners included
+        self.texts_only = texts_only
+        self.record = QuestionText if texts_only else Question
+        self.columns = ', '.join(QuestionText._fields) if texts_only else Question.COLUMNS
+        self.questions = {}  # question id -> Question or QuestionText
+        self.channels = {}  # channel row id -> Channel
+        self.versions = None  # (questions, channels) data versions of the loaded copy
+        self.channel_ids = None  # Channel row ids to load, None for every active channel
+        self.loaded_channel_ids = None  # channel_ids of the loaded copy
+        self.listeners = []  # Called with CacheChanges after each refresh that changed something
+    
+    def __len__(self):
+        return len(self.questions)
+    
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+    
+    def restrict(self, channel_ids):
+        """Only hold questions of these channels (row ids), None for every active channel.
+        The next refresh reloads if the set changed"""
+        self.channel_ids = None if channel_ids is None else frozenset(channel_ids)
+    
+    def refresh(self, force=False):
+        """Pick up changes since the last refresh, returns CacheChanges or None if unchanged"""
+        with self.refresh_lock:
+            return self._refresh(force)
+    
+    def _refresh(self, force):
+        with get_db_connection() as conn:
+            # One read transaction, so the versions match the rows read
+            conn.execute('BEGIN')
+            data_versions = dict(conn.execute('SELECT name, version FROM data_versions').fetchall())
+            versions = (data_versions.get('questions'), data_versions.get('channels'))
+            channel_ids = self.channel_ids
+            if not force and versions == self.versions and channel_ids == self.loaded_channel_ids:
+                conn.commit()
+                return None
+            
+            # Tombstones up to questions_purged are gone, an older copy cannot catch up
+            if (force or not self.versions or versions[1] != self.versions[1]
+                    or channel_ids != self.loaded_channel_ids
+                    or self.versions[0] < data_versions.get('questions_purged', 0)):
+                changes = self._reload(conn, channel_ids)
+            else:
+                changes = self._apply_changes(conn, self.versions[0])
+            conn.commit()
+        
+        with self.lock:
+            self.versions = versions
+        for listener in self.listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"Error in question cache listener: {e}")
+        return changes
+    
+    def _reload(self, conn, channel_ids):
+        channel_filter = 'active = 1'
+        if channel_ids is not None:
+            channel_filter += f" AND id IN ({','.join(str(int(channel_id)) for channel_id in channel_ids)})"
+        channel_rows = conn.execute(f'SELECT {Channel.COLUMNS} FROM channels WHERE {channel_filter}').fetchall()
+        question_rows = conn.execute(f'''
+            SELECT {self.columns} FROM questions WHERE channel_id IN (SELECT id FROM channels WHERE {channel_filter})
+        ''').fetchall()
+        # Both select lists start with the id
+        channels = {row[0]: Channel(*row) for row in channel_rows}
+        questions = {row[0]: self.record(*row) for row in question_rows}
+        
+        with self.lock:
+            self.channels = channels
+            self.questions = questions
+            self.loaded_channel_ids = channel_ids
+        logger.info(f"Loaded {len(questions)} questions of {len(channels)} active channels")
+        return CacheChanges(True, list(questions), [])
+    
+    def _apply_changes(self, conn, since_version):
+        rows = conn.execute(f'SELECT {self.columns} FROM questions WHERE row_version > ?',
+                            (since_version,)).fetchall()
+        deleted = [row[0] for row in conn.execute(
+            'SELECT question_id FROM deleted_questions WHERE row_version > ?', (since_version,)
+        )]
+        
+        updated = []
+        with self.lock:
+            for row in rows:
+                question = self.record(*row)
+                if question.channel_id in self.channels:
+                    self.questions[question.id] = question
+                    updated.append(question.id)
+                elif self.questions.pop(question.id, None):
+                    # Moved to a channel that is not active
+                    deleted.append(question.id)
+            for question_id in deleted:
+                self.questions.pop(question_id, None)
+        logger.info(f"Question cache: {len(updated)} updated, {len(deleted)} deleted")
+        return CacheChanges(False, updated, deleted)
+    
+    def purge_tombstones(self):
+        """Delete tombstones this copy has applied, returns how many.
+        Caches older than them reload in full on their next refresh"""
+        if not self.versions:
+            return 0
+        with get_db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            purged = conn.execute('SELECT MAX(row_version) FROM deleted_questions WHERE row_version <= ?',
+                                  (self.versions[0],)).fetchone()[0]
+            if purged is None:
+                conn.commit()
+                return 0
+            cursor = conn.execute('DELETE FROM deleted_questions WHERE row_version <= ?', (purged,))
+            conn.execute('''
+                INSERT INTO data_versions (name, version) VALUES ('questions_purged', ?)
+                ON CONFLICT (name) DO UPDATE SET version = MAX(version, excluded.version)
+            ''', (purged,))
+            conn.commit()
+            return cursor.rowcount
+    
+    def get_many(self, question_ids):
+        """Same as Question.get_many, questions not cached are read from the database"""
+        if self.texts_only:
+            return Question.get_many(question_ids)
+        with self.lock:
+            found = [self.questions[question_id] for question_id in question_ids
+                     if question_id in self.questions]
+        if len(found) < len(question_ids):
+            cached = {question.id for question in found}
+            found.extend(Question.get_many([question_id for question_id in question_ids
+                                            if question_id not in cached]))
+        return found
+    
+    def get(self, question_id):
+        """Return the cached Question, or None"""
+        with self.lock:
+            return self.questions.get(question_id)
+    
+    def get_with_channel(self, question_id):
+        """Return (Question, Channel) of a question, read from the database if not cached"""
+        with self.lock:
+            question = None if self.texts_only else self.questions.get(question_id)
+            channel = self.channels.get(question.channel_id) if question else None
+        if not channel:
+            question = Question.get_by_id(question_id)
+            channel = Channel.get_by_id(question.channel_id) if question else None
+        return (question, channel) if channel else None
+    
+    def items(self):
+        """Return [(Question, Channel)] of all cached questions"""
+        with self.lock:
+            return [(question, self.channels[question.channel_id])
+                    for question in self.questions.values()]
 
 class Schedule:
+    __slots__ = ('id', 'channel_id', 'schedule_time', 'days_of_week', 'interval_type', 'active',
+                 'created_at')
+    # Select list in constructor order, so rows are built with cls(*row)
+    COLUMNS = ', '.join(__slots__)
+    
     def __init__(self, id=None, channel_id=None, schedule_time=None, days_of_week=None,
-                 interval_type=None, active=True):
+                 interval_type=None, active=True, created_at=None):
         self.id = id
         self.channel_id = channel_id
         self.schedule_time = schedule_time
         self.days_of_week = days_of_week
         self.interval_type = interval_type
         self.active = active
+        self.created_at = created_at
     
     def save(self):
         with get_db_connection() as conn:
@@ -228,12 +1038,452 @@ class Schedule:
     @classmethod
     def get_by_channel(cls, channel_id):
         with get_db_connection() as conn:
-            rows = conn.execute('SELECT * FROM schedules WHERE channel_id = ?', (channel_id,)).fetchall()
-            return [cls(**dict(row)) for row in rows]
+            rows = conn.execute(f'SELECT {cls.COLUMNS} FROM schedules WHERE channel_id = ?', (channel_id,)).fetchall()
+            return [cls(*row) for row in rows]
     
     @classmethod
     def get_active_schedules(cls):
         with get_db_connection() as conn:
-            rows = conn.execute('SELECT * FROM schedules WHERE active = 1').fetchall()
-            return [cls(**dict(row)) for row in rows]
-    
\ No newline at end of file
+            rows = conn.execute(f'SELECT {cls.COLUMNS} FROM schedules WHERE active = 1').fetchall()
+            return [cls(*row) for row in rows]
+    
+    @classmethod
+    def get_active_with_channels(cls):
+        """Return [(schedule, channel)] for all active schedules in one query"""
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT s.id, s.channel_id, s.schedule_time, s.days_of_week, s.interval_type,
+                       s.active, s.created_at,
+                       c.id, c.channel_name, c.channel_id, c.discussion_group_id, c.category,
+                       c.questions_per_batch, c.active, c.last_quiz_sent, c.created_at
+                FROM schedules s
+                JOIN channels c ON c.id = s.channel_id
+                WHERE s.active = 1
+            ''').fetchall()
+            return [(cls(*row[:7]), Channel(*row[7:])) for row in rows]
+    
+
+class UsageBuffer:
+    """Write-behind buffer for question usage counts and channel last-sent times.
+
+    Increments are collected in memory and written in one transaction by
+    flush(). Whatever is still pending at shutdown is spooled to a JSON file
+    and replayed on the next start, so no increment is lost.
+    """
+    def __init__(self, spool_path):
+        self.spool_path = spool_path
+        self.lock = threading.Lock()
+        self.question_counts = {}  # question id -> pending used_count increment
+        self.channel_last_sent = {}  # channel id -> last_quiz_sent value
+        self.spool_replayed = False  # Spool file contents are merged into memory
+    
+    def record_question_used(self, question_id, count=1):
+        with self.lock:
+            self.question_counts[question_id] = self.question_counts.get(question_id, 0) + count
+    
+    def record_quiz_sent(self, channel_id, sent_at):
+        with self.lock:
+            self.channel_last_sent[channel_id] = str(sent_at)
+    
+    def pending(self):
+        with self.lock:
+            return len(self.question_counts) + len(self.channel_last_sent)
+    
+    def _merge(self, question_counts, channel_last_sent):
+        with self.lock:
+            for question_id, count in question_counts.items():
+                self.question_counts[question_id] = self.question_counts.get(question_id, 0) + count
+            for channel_id, sent_at in channel_last_sent.items():
+                self.channel_last_sent.setdefault(channel_id, sent_at)
+    
+    def flush(self):
+        """Write all pending updates in a single transaction"""
+        with self.lock:
+            question_counts, self.question_counts = self.question_counts, {}
+            channel_last_sent, self.channel_last_sent = self.channel_last_sent, {}
+        
+        if not question_counts and not channel_last_sent:
+            return 0
+        
+        try:
+            with get_db_connection() as conn:
+                Question.bulk_update_usage(conn, question_counts)
+                conn.executemany(
+                    'UPDATE channels SET last_quiz_sent = ? WHERE id = ?',
+                    [(sent_at, channel_id) for channel_id, sent_at in channel_last_sent.items()]
+                )
+                conn.commit()
+        except Exception:
+            # Keep the updates for the next flush
+            self._merge(question_counts, channel_last_sent)
+            raise
+        
+        # Replayed updates are in the database now, the spool file is obsolete
+        if self.spool_replayed:
+            os.remove(self.spool_path)
+            self.spool_replayed = False
+        
+        return len(question_counts) + len(channel_last_sent)
+    
+    def persist(self):
+        """Spool pending updates to disk, used at shutdown when flushing is not possible"""
+        with self.lock:
+            if not self.question_counts and not self.channel_last_sent:
+                return
+            data = {
+                'question_counts': {str(k): v for k, v in self.question_counts.items()},
+                'channel_last_sent': {str(k): v for k, v in self.channel_last_sent.items()}
+            }
+        
+        tmp_path = f"{self.spool_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.spool_path)
+        self.spool_replayed = True
+    
+    def replay(self):
+        """Load updates spooled by a previous run and write them to the database"""
+        if not os.path.exists(self.spool_path):
+            return 0
+        
+        with open(self.spool_path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        
+        self._merge(
+            {int(k): v for k, v in data.get('question_counts', {}).items()},
+            {int(k): v for k, v in data.get('channel_last_sent', {}).items()}
+        )
+        self.spool_replayed = True
+        return self.flush()
+    
+    def close(self):
+        """Flush pending updates, spooling them to disk if the flush fails"""
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing usage buffer, spooling to disk: {e}")
+            self.persist()
+
+
+class PollAnswer:
+    @classmethod
+    def bulk_insert(cls, conn, answers):
+        """Insert (poll_id, user_id, option_id, answered_at, channel_id, is_correct) rows, skipping
+        answers of a user to a poll already stored. Returns the rows inserted, the caller holds
+        the write lock and commits"""
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM poll_answers').fetchone()[0]
+        conn.executemany('''
+            INSERT OR IGNORE INTO poll_answers (poll_id, user_id, option_id, answered_at, channel_id, is_correct)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', answers)
+        return conn.execute('''
+            SELECT poll_id, user_id, option_id, answered_at, channel_id, is_correct
+            FROM poll_answers WHERE id > ? ORDER BY id
+        ''', (last_id,)).fetchall()
+
+# close_time is when the poll is due to close, closed_at when Telegram reported it closed,
+# poll_number of poll_count is its place in the quiz quiz_key
+PollRecord = namedtuple('PollRecord', ['question_id', 'chat_id', 'message_id', 'close_time', 'closed_at',
+                                       'quiz_key', 'poll_number', 'poll_count'],
+                        defaults=(None, None, None, None))
+
+class PollRegistry:
+    """Bounded registry of sent polls: poll_id -> (question_id, chat_id, message_id, close_time).
+
+    Entries are written through to the poll_registry table so they survive
+    restarts and other processes can look them up. The in-memory copy drops
+    an entry once its poll has been closed for longer than the grace period,
+    and never holds more than max_entries polls.
+    """
+    def __init__(self, grace_period=600, max_entries=10000, retention=86400):
+        self.grace_period = grace_period
+        self.max_entries = max_entries
+        self.retention = retention  # Seconds after closing before rows are purged from the table
+        self.entries = OrderedDict()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def register(self, poll_id, question_id, chat_id, message_id, close_time, quiz_key=None,
+                 poll_number=None, poll_count=None):
+        record = PollRecord(question_id, str(chat_id), message_id, close_time, None, quiz_key,
+                            poll_number, poll_count)
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO poll_registry (poll_id, question_id, chat_id, message_id, close_time,
+                                                      closed_at, quiz_key, poll_number, poll_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (poll_id, *record))
+            conn.commit()
+        
+        self.entries[poll_id] = record
+        self.entries.move_to_end(poll_id)
+        self.evict()
+        return record
+    
+    def get(self, poll_id):
+        record = self.entries.get(poll_id)
+        if record:
+            return record
+        
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                SELECT question_id, chat_id, message_id, close_time, closed_at, quiz_key, poll_number, poll_count
+                FROM poll_registry WHERE poll_id = ?
+            ''', (poll_id,)).fetchone()
+        return PollRecord(*row) if row else None
+    
+    def mark_closed(self, poll_id, closed_at=None):
+        """Record that Telegram closed a poll, possibly before its close time"""
+        closed_at = closed_at or time.time()
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE poll_registry SET closed_at = ?, close_time = MIN(close_time, ?)
+                WHERE poll_id = ? AND closed_at IS NULL
+            ''', (closed_at, closed_at, poll_id))
+            conn.commit()
+        
+        record = self.entries.get(poll_id)
+        if record and record.closed_at is None:
+            self.entries[poll_id] = record._replace(close_time=min(record.close_time, closed_at),
+                                                    closed_at=closed_at)
+    
+    def get_closed_since(self, since):
+        """Return [(poll_id, closed_at)] of polls reported closed after a timestamp"""
+        with get_db_connection() as conn:
+            return [tuple(row) for row in conn.execute(
+                'SELECT poll_id, closed_at FROM poll_registry WHERE closed_at > ? ORDER BY closed_at', (since,)
+            )]
+    
+    def evict(self, now=None):
+        """Drop closed polls past their grace period and trim to max_entries"""
+        now = now or time.time()
+        evicted = 0
+        # Entries are kept in send order, so expired polls sit at the front
+        while self.entries:
+            poll_id, record = next(iter(self.entries.items()))
+            if record.close_time + self.grace_period >= now and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[poll_id]
+            evicted += 1
+        return evicted
+    
+    def purge(self, now=None):
+        """Delete table rows of polls closed longer than the retention period"""
+        now = now or time.time()
+        with get_db_connection() as conn:
+            cursor = conn.execute('DELETE FROM poll_registry WHERE close_time < ?', (now - self.retention,))
+            conn.commit()
+            return cursor.rowcount
+
+class OutboxMessage:
+    """Outbound bot message persisted until it has been sent"""
+    def __init__(self, id=None, sender=None, idempotency_key=None, chat_id=None, method=None,
+                 payload=None, context=None, status='pending', attempts=0, next_attempt_at=None,
+                 last_error=None, message_id=None, created_at=None, sent_at=None):
+        self.id = id
+        self.sender = sender
+        self.idempotency_key = idempotency_key
+        self.chat_id = chat_id
+        self.method = method
+        self.payload = payload
+        self.context = context
+        self.status = status
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at
+        self.last_error = last_error
+        self.message_id = message_id
+        self.created_at = created_at
+        self.sent_at = sent_at
+    
+    @classmethod
+    def enqueue(cls, sender, idempotency_key, chat_id, method, payload, context=None, not_before=None):
+        """Insert a pending message, returns None if the idempotency key was already used"""
+        now = time.time()
+        message = cls(sender=sender, idempotency_key=idempotency_key, chat_id=str(chat_id),
+                      method=method, payload=payload, context=context or {},
+                      next_attempt_at=not_before or now, created_at=now)
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO outbox (sender, idempotency_key, chat_id, method, payload,
+                                              context, status, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+            ''', (sender, idempotency_key, message.chat_id, method, json.dumps(payload),
+                  json.dumps(message.context), message.next_attempt_at, now))
+            conn.commit()
+            if not cursor.rowcount:
+                return None
+            message.id = cursor.lastrowid
+        return message
+    
+    @classmethod
+    def get_pending(cls, sender):
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT * FROM outbox WHERE sender = ? AND status = 'pending' ORDER BY id
+            ''', (sender,)).fetchall()
+        messages = []
+        for row in rows:
+            message = cls(**dict(row))
+            message.payload = json.loads(message.payload)
+            message.context = json.loads(message.context) if message.context else {}
+            messages.append(message)
+        return messages
+    
+    @classmethod
+    def abandon_interrupted(cls, sender):
+        """Fail messages whose send was cut off by a crash, they may already be delivered"""
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                UPDATE outbox SET status = 'failed', last_error = 'interrupted while sending'
+                WHERE sender = ? AND status = 'sending'
+            ''', (sender,))
+            conn.commit()
+            return cursor.rowcount
+    
+    @classmethod
+    def expire_pending(cls, sender, due_before):
+        """Fail pending messages that were due before a timestamp, too late to send now"""
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                UPDATE outbox SET status = 'failed', last_error = 'expired before it was sent'
+                WHERE sender = ? AND status = 'pending' AND next_attempt_at < ?
+            ''', (sender, due_before))
+            conn.commit()
+            return cursor.rowcount
+    
+    def mark_sending(self):
+        self.status = 'sending'
+        self.attempts += 1
+        with get_db_connection() as conn:
+            conn.execute('UPDATE outbox SET status = ?, attempts = ? WHERE id = ?',
+                         (self.status, self.attempts, self.id))
+            conn.commit()
+    
+    def mark_sent(self, message_id=None):
+        self.status = 'sent'
+        self.message_id = message_id
+        self.sent_at = time.time()
+        with get_db_connection() as conn:
+            conn.execute('UPDATE outbox SET status = ?, message_id = ?, sent_at = ?, last_error = NULL WHERE id = ?',
+                         (self.status, self.message_id, self.sent_at, self.id))
+            conn.commit()
+    
+    def mark_retry(self, next_attempt_at, error):
+        self.status = 'pending'
+        self.next_attempt_at = next_attempt_at
+        self.last_error = error
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?
+            ''', (self.status, self.attempts, self.next_attempt_at, self.last_error, self.id))
+            conn.commit()
+    
+    @classmethod
+    def merge(cls, sender, messages, idempotency_key, chat_id, method, payloads):
+        """Replace pending messages with new ones, one per payload, in a single transaction.
+        The replaced messages are marked merged and never sent"""
+        now = time.time()
+        merged = []
+        with get_db_connection() as conn:
+            for part, payload in enumerate(payloads, 1):
+                message = cls(sender=sender, idempotency_key=f"{idempotency_key}:{part}", chat_id=str(chat_id),
+                              method=method, payload=payload, context={}, next_attempt_at=now, created_at=now)
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO outbox (sender, idempotency_key, chat_id, method, payload,
+                                                  context, status, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?, ?, '{}', 'pending', ?, ?)
+                ''', (sender, message.idempotency_key, message.chat_id, method, json.dumps(payload), now, now))
+                if cursor.rowcount:
+                    message.id = cursor.lastrowid
+                    merged.append(message)
+            conn.executemany("UPDATE outbox SET status = 'merged' WHERE id = ?",
+                             [(message.id,) for message in messages])
+            conn.commit()
+        for message in messages:
+            message.status = 'merged'
+        return merged
+    
+    def reschedule(self, next_attempt_at):
+        self.next_attempt_at = next_attempt_at
+        with get_db_connection() as conn:
+            conn.execute('UPDATE outbox SET next_attempt_at = ? WHERE id = ?', (self.next_attempt_at, self.id))
+            conn.commit()
+    
+    def mark_failed(self, error):
+        self.status = 'failed'
+        self.last_error = error
+        with get_db_connection() as conn:
+            conn.execute('UPDATE outbox SET status = ?, last_error = ? WHERE id = ?',
+                         (self.status, self.last_error, self.id))
+            conn.commit()
+    
+    @classmethod
+    def purge(cls, sender, before):
+        """Delete sent, failed and merged messages created before a timestamp"""
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                DELETE FROM outbox WHERE sender = ? AND status IN ('sent', 'failed', 'merged') AND created_at < ?
+            ''', (sender, before))
+            conn.commit()
+            return cursor.rowcount
+
+class QuizSessionRecord:
+    """Checkpoint of a quiz session: its steps and how far it got"""
+    
+    @classmethod
+    def create(cls, chat_id, quiz_key, steps, next_at):
+        """Insert a running session, returns its id or None if the quiz key was already used"""
+        now = time.time()
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO quiz_sessions (chat_id, quiz_key, steps, next_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (str(chat_id), quiz_key, json.dumps([list(step) for step in steps]), next_at, now, now))
+            conn.commit()
+            return cursor.lastrowid if cursor.rowcount else None
+    
+    @classmethod
+    def exists(cls, quiz_key):
+        with get_db_connection() as conn:
+            return conn.execute('SELECT 1 FROM quiz_sessions WHERE quiz_key = ?', (quiz_key,)).fetchone() is not None
+    
+    @classmethod
+    def checkpoint(cls, session_id, next_index, state, next_at):
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE quiz_sessions SET next_index = ?, state = ?, next_at = ?, updated_at = ? WHERE id = ?
+            ''', (next_index, state, next_at, time.time(), session_id))
+            conn.commit()
+    
+    @classmethod
+    def get_unfinished(cls, updated_after):
+        """Return running, paused and queued session rows checkpointed after a timestamp, older
+        ones are marked expired"""
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE quiz_sessions SET state = 'expired'
+                WHERE state IN ('running', 'paused', 'queued') AND updated_at < ?
+            ''', (updated_after,))
+            conn.commit()
+            rows = conn.execute('''
+                SELECT * FROM quiz_sessions WHERE state IN ('running', 'paused', 'queued') ORDER BY id
+            ''').fetchall()
+        sessions = []
+        for row in rows:
+            session = dict(row)
+            session['steps'] = json.loads(session['steps'])
+            sessions.append(session)
+        return sessions
+    
+    @classmethod
+    def purge(cls, before):
+        """Delete finished, cancelled and expired sessions last updated before a timestamp"""
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                DELETE FROM quiz_sessions WHERE state NOT IN ('running', 'paused', 'queued') AND updated_at < ?
+            ''', (before,))
+            conn.commit()
+            return cursor.rowcount
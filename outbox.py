@@ -0,0 +1,361 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import deque
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, InvalidToken, RetryAfter
+
+from models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Errors that will not go away by retrying the same request
+PERMANENT_ERRORS = (BadRequest, Forbidden, ChatMigrated, InvalidToken)
+
+
+class Outbox:
+    """Durable outbound message queue with one sending lane per chat.
+
+    enqueue() writes the message to the outbox table before anything is sent,
+    keyed by an idempotency key, so re-running the same step never queues it
+    twice. Each chat has its own lane task that sends its messages in order.
+    A RetryAfter or a network error only delays that lane (flood wait or
+    exponential backoff with jitter), the other chats keep sending.
+
+    Messages queued with a not_before time wait in one heap ordered by due
+    time, which a single scheduler task drains onto the lanes. The outbox
+    table mirrors the heap and pending messages are picked up again after a
+    restart, unless they were due longer than resume_window ago. A 'pace' of [group, seconds] in a message's context holds it
+    until that long after the group's previous send, messages with a 'digest'
+    key are merged into as few messages as digest_limit allows once the first
+    of them is due.
+
+    With a Repository, outbox writes run as short writes on its writer thread
+    instead of the event loop.
+    """
+
+    def __init__(self, sender, on_sent=None, max_attempts=8, base_delay=1.0, max_delay=300.0,
+                 retention=86400, digest_limit=4096, db=None, resume_window=None):
+        self.sender = sender  # Name of the bot owning these messages
+        self.db = db  # Repository for database writes, None to write on the event loop
+        self.on_sent = on_sent  # Called with (OutboxMessage, sent Telegram message)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retention = retention  # Seconds sent/failed rows are kept
+        self.digest_limit = digest_limit  # Maximum characters of a merged digest message
+        self.resume_window = resume_window  # Seconds overdue a pending message is still sent after a restart
+        self.bot = None
+        self.lanes = {}  # chat id -> deque of pending OutboxMessage
+        self.lane_tasks = {}  # chat id -> task draining the lane
+        self.delayed = []  # heap of [due time, message id, OutboxMessage or None once removed]
+        self.delayed_entries = {}  # idempotency key -> heap entry of a delayed message
+        self.delayed_changed = asyncio.Event()  # Set when the earliest due time may have moved
+        self.paced = {}  # pace group -> time its last message was sent
+        self.callbacks = set()  # on_sent tasks still running
+        self.scheduler_task = None
+
+    def __len__(self):
+        return len(self.delayed_entries) + sum(len(lane) for lane in self.lanes.values())
+
+    async def start(self, bot):
+        """Start sending, resuming messages left pending by a previous run"""
+        self.bot = bot
+        self.scheduler_task = asyncio.create_task(self._run_scheduler())
+
+        interrupted = OutboxMessage.abandon_interrupted(self.sender)
+        if interrupted:
+            logger.warning(f"{interrupted} outbox messages were interrupted mid-send and will not be resent")
+        if self.resume_window is not None:
+            expired = OutboxMessage.expire_pending(self.sender, time.time() - self.resume_window)
+            if expired:
+                logger.warning(f"{expired} pending outbox messages are older than the resume window "
+                               f"and will not be sent")
+        OutboxMessage.purge(self.sender, time.time() - self.retention)
+
+        pending = OutboxMessage.get_pending(self.sender)
+        for message in pending:
+            self._add_to_lane(message)
+        if pending:
+            logger.info(f"Resumed {len(pending)} pending outbox messages")
+
+    async def stop(self):
+        """Stop the lanes, unsent messages stay pending in the database"""
+        tasks = list(self.lane_tasks.values())
+        if self.scheduler_task:
+            tasks.append(self.scheduler_task)
+            self.scheduler_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Messages already sent still get their callbacks
+        await asyncio.gather(*self.callbacks, return_exceptions=True)
+        self.lane_tasks.clear()
+        self.lanes.clear()
+        self.delayed.clear()
+        self.delayed_entries.clear()
+        self.bot = None
+
+    def enqueue(self, idempotency_key, chat_id, method, payload, context=None, not_before=None):
+        """Persist a message and queue it on its chat's lane, returns False if already queued"""
+        message = OutboxMessage.enqueue(self.sender, idempotency_key, chat_id, method, payload,
+                                        context, not_before)
+        if not message:
+            logger.info(f"Skipping duplicate outbox message {idempotency_key}")
+            return False
+        self._add_to_lane(message)
+        return True
+
+    async def enqueue_async(self, idempotency_key, chat_id, method, payload, context=None, not_before=None):
+        """Same as enqueue, with the insert off the event loop"""
+        message = await self._write(OutboxMessage.enqueue, self.sender, idempotency_key, chat_id, method,
+                                    payload, context, not_before)
+        if not message:
+            logger.info(f"Skipping duplicate outbox message {idempotency_key}")
+            return False
+        self._add_to_lane(message)
+        return True
+
+    async def expedite(self, idempotency_key):
+        """Send a delayed message now instead of at its not_before time, returns False if
+        there is no such delayed message"""
+        message = self._take_delayed(idempotency_key)
+        if not message:
+            return False
+
+        message.next_attempt_at = time.time()
+        self._add_to_lane(message)
+        await self._write(message.reschedule, message.next_attempt_at)
+        return True
+
+    def purge(self):
+        """Delete sent, failed and merged messages past the retention period"""
+        return OutboxMessage.purge(self.sender, time.time() - self.retention)
+
+    def prune_paced(self):
+        """Forget pace groups last sent before the retention period, the lanes use paced
+        on the event loop so this must run there too"""
+        cutoff = time.time() - self.retention
+        for group in [group for group, sent_at in self.paced.items() if sent_at < cutoff]:
+            del self.paced[group]
+
+    async def _write(self, function, *args):
+        if self.db:
+            return await self.db.short_write(function, *args)
+        return function(*args)
+
+    def _submit(self, function, *args):
+        """Write without awaiting, queued behind the writes before it"""
+        if self.db:
+            self.db.submit_short_write(function, *args)
+        else:
+            function(*args)
+
+    def _requeue_cancelled(self, message):
+        """Put a message whose send was cancelled back to pending, without awaiting"""
+        message.attempts = max(0, message.attempts - 1)
+        # Queued behind mark_sending, the short writer applies them in order
+        self._submit(message.mark_retry, time.time(), 'cancelled')
+
+    def _add_to_lane(self, message):
+        # Digest messages always pass the heap, the scheduler merges them once due
+        if message.next_attempt_at > time.time() or message.context.get('digest'):
+            first = self._first_delayed()
+            if not first or message.next_attempt_at < first[0]:
+                self.delayed_changed.set()
+            entry = [message.next_attempt_at, message.id, message]
+            self.delayed_entries[message.idempotency_key] = entry
+            heapq.heappush(self.delayed, entry)
+            return
+        self._append_to_lane(message)
+
+    def _first_delayed(self):
+        """Return the earliest live heap entry, dropping removed ones from the top, or None"""
+        while self.delayed and self.delayed[0][2] is None:
+            heapq.heappop(self.delayed)
+        return self.delayed[0] if self.delayed else None
+
+    def _take_delayed(self, idempotency_key):
+        """Remove a delayed message from the heap and return it, or None if it is not delayed"""
+        entry = self.delayed_entries.pop(idempotency_key, None)
+        if not entry:
+            return None
+        message, entry[2] = entry[2], None
+        return message
+
+    def _append_to_lane(self, message):
+        chat_id = message.chat_id
+        self.lanes.setdefault(chat_id, deque()).append(message)
+
+        if self.bot and chat_id not in self.lane_tasks:
+            self.lane_tasks[chat_id] = asyncio.create_task(self._run_lane(chat_id))
+
+    async def _run_scheduler(self):
+        """Move delayed messages onto their lanes once they are due"""
+        while True:
+            self.delayed_changed.clear()
+            now = time.time()
+            while True:
+                first = self._first_delayed()
+                if not first or first[0] > now:
+                    break
+                message = self._take_delayed(first[2].idempotency_key)
+                heapq.heappop(self.delayed)
+                if message.context.get('digest'):
+                    await self._flush_digest(message)
+                else:
+                    self._append_to_lane(message)
+
+            timeout = first[0] - now if first else None
+            try:
+                await asyncio.wait_for(self.delayed_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _flush_digest(self, message):
+        """Merge a due digest message with the delayed messages of its digest and queue the result"""
+        digest = message.context['digest']
+        members = [message]
+        for entry in list(self.delayed_entries.values()):
+            other = entry[2]
+            if other.chat_id == message.chat_id and other.context.get('digest') == digest:
+                members.append(self._take_delayed(other.idempotency_key))
+
+        if len(members) == 1:
+            self._append_to_lane(message)
+            return
+
+        members.sort(key=lambda member: (member.context.get('number', 0), member.id))
+
+        payloads = []
+        for text in self._split_digest([member.payload['text'] for member in members]):
+            payload = dict(members[0].payload)
+            payload['text'] = text
+            payloads.append(payload)
+        try:
+            merged = await self._write(OutboxMessage.merge, self.sender, members,
+                                       f"digest:{digest}:{members[0].id}", message.chat_id,
+                                       members[0].method, payloads)
+        except Exception as e:
+            # Nothing was merged, send the messages one by one instead
+            logger.error(f"Error merging digest {digest}: {e}")
+            merged = members
+
+        for digest_message in merged:
+            self._append_to_lane(digest_message)
+        logger.info(f"Merged {len(members)} messages of digest {digest} into {len(merged)}")
+
+    def _split_digest(self, texts, separator='\n\n'):
+        """Join texts into as few parts of at most digest_limit characters as possible,
+        a text is only split from its neighbours unless it is too long on its own"""
+        parts = []
+        for text in texts:
+            for piece in self._cut(text):
+                if parts and len(parts[-1]) + len(separator) + len(piece) <= self.digest_limit:
+                    parts[-1] += separator + piece
+                else:
+                    parts.append(piece)
+        return parts
+
+    def _cut(self, text):
+        """Cut a text into pieces of at most digest_limit characters, at the last line
+        break, else the last space, that fits"""
+        pieces = []
+        while len(text) > self.digest_limit:
+            head = text[:self.digest_limit + 1]
+            cut = head.rfind('\n')
+            if cut <= 0:
+                cut = head.rfind(' ')
+            if cut <= 0:
+                cut = self.digest_limit
+            pieces.append(text[:cut].rstrip())
+            text = text[cut:].lstrip()
+        pieces.append(text)
+        return pieces
+
+    async def _run_lane(self, chat_id):
+        lane = self.lanes[chat_id]
+        try:
+            while lane:
+                message = lane[0]
+                delay = self._due(message) - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                try:
+                    if await self._send(message):
+                        lane.popleft()
+                except Exception as e:
+                    # Database trouble, keep the message and try again shortly
+                    logger.error(f"Outbox error for chat {chat_id}: {e}")
+                    await asyncio.sleep(self.base_delay)
+        finally:
+            self.lane_tasks.pop(chat_id, None)
+            if not lane:
+                self.lanes.pop(chat_id, None)
+
+    def _due(self, message):
+        """Time a message may be sent: its next attempt time, and no earlier than its pace
+        after the last send of its pace group"""
+        due = message.next_attempt_at
+        pace = message.context.get('pace')
+        if pace and pace[0] in self.paced:
+            due = max(due, self.paced[pace[0]] + pace[1])
+        return due
+
+    async def _send(self, message):
+        """Try to send a message, returns True once it is done (sent or given up)"""
+        try:
+            await self._write(message.mark_sending)
+        except asyncio.CancelledError:
+            self._requeue_cancelled(message)
+            raise
+
+        try:
+            sent = await getattr(self.bot, message.method)(chat_id=message.chat_id, **message.payload)
+        except asyncio.CancelledError:
+            # Stopped while waiting on the rate limiter or the request, send it again next start
+            self._requeue_cancelled(message)
+            raise
+        except RetryAfter as e:
+            # Flood wait does not count as a failed attempt
+            message.attempts -= 1
+            await self._write(message.mark_retry, time.time() + e.retry_after + 0.1, f"RetryAfter {e.retry_after}s")
+            logger.warning(f"Flood control for chat {message.chat_id}, retrying in {e.retry_after}s")
+            return False
+        except PERMANENT_ERRORS as e:
+            await self._write(message.mark_failed, str(e))
+            logger.error(f"Dropping outbox message {message.idempotency_key}: {e}")
+            return True
+        except Exception as e:
+            if message.attempts >= self.max_attempts:
+                await self._write(message.mark_failed, str(e))
+                logger.error(f"Giving up on outbox message {message.idempotency_key} "
+                             f"after {message.attempts} attempts: {e}")
+                return True
+
+            delay = min(self.max_delay, self.base_delay * 2 ** (message.attempts - 1))
+            delay *= random.uniform(0.5, 1.5)
+            await self._write(message.mark_retry, time.time() + delay, str(e))
+            logger.warning(f"Error sending {message.idempotency_key}, retry {message.attempts} in {delay:.1f}s: {e}")
+            return False
+
+        pace = message.context.get('pace')
+        if pace:
+            self.paced[pace[0]] = time.time()
+        self._submit(message.mark_sent, getattr(sent, 'message_id', None))
+        if self.on_sent:
+            # A cancelled lane leaves the callback running, the message will not be sent again
+            callback = asyncio.ensure_future(self._run_on_sent(message, sent))
+            self.callbacks.add(callback)
+            callback.add_done_callback(self.callbacks.discard)
+            await asyncio.shield(callback)
+        return True
+
+    async def _run_on_sent(self, message, sent):
+        try:
+            await self.on_sent(message, sent)
+        except Exception as e:
+            logger.error(f"Error in outbox sent callback for {message.idempotency_key}: {e}")
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PollAnswerWriter:
+    """Asyncio queue of poll answers drained by a background bulk writer.
+
+    Handlers call submit(), which only enqueues and returns. The consumer task
+    collects up to batch_size answers (or whatever arrived within
+    flush_interval) and hands them to store() in a worker thread, which writes
+    them with one executemany, so the event loop never waits on SQLite.
+    """
+
+    def __init__(self, store, batch_size=500, flush_interval=1.0, max_queue_size=100000, executor=None):
+        self.store = store  # Called with a list of (poll_id, user_id, option_id, answered_at, user_name)
+        self.executor = executor  # Runs store(), the loop's default executor if None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.task = None
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the background consumer"""
+        if not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    def submit(self, poll_id, user_id, option_id, user_name=None, answered_at=None):
+        """Queue an answer for writing, never blocks"""
+        try:
+            self.queue.put_nowait((poll_id, user_id, option_id, answered_at or time.time(), user_name))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Poll answer queue full, dropped answer of user {user_id} to poll {poll_id}")
+
+    async def _collect_batch(self):
+        """Collect the next batch, returns (batch, stop requested)"""
+        batch = []
+        deadline = None
+
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                item = await self.queue.get()
+                deadline = time.monotonic() + self.flush_interval
+            elif not self.queue.empty():
+                item = self.queue.get_nowait()
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _write(self, batch):
+        loop = asyncio.get_running_loop()
+        for attempt in range(3):
+            try:
+                await loop.run_in_executor(self.executor, self.store, batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                logger.error(f"Error writing {len(batch)} poll answers (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(1 + attempt)
+        logger.error(f"Dropped {len(batch)} poll answers after repeated write errors")
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect_batch()
+            if batch:
+                await self._write(batch)
+
+    async def stop(self):
+        """Write everything still queued, then stop the consumer"""
+        if self.task:
+            # The sentinel is queued behind pending answers, so they are written first
+            await self.queue.put(None)
+            await self.task
+            self.task = None
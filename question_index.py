@@ -0,0 +1,152 @@
+import re
+from array import array
+from collections import Counter
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_question_text(text):
+    """Normalize question text for matching"""
+    # Remove extra whitespace, convert to lowercase, remove special characters
+    normalized = _PUNCTUATION.sub('', text.lower().strip())
+    return _WHITESPACE.sub(' ', normalized)
+
+
+def trigrams(normalized):
+    """Set of character trigrams of normalized text, padded so short words count"""
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def encode_number(posting, delta):
+    """Append a number to a bytearray as a varint, 7 bits per byte, high bit = more follow"""
+    while delta >= 0x80:
+        posting.append(delta & 0x7f | 0x80)
+        delta >>= 7
+    posting.append(delta)
+
+
+def decode_posting(posting):
+    """Entry numbers of a delta coded posting"""
+    numbers = []
+    number = delta = shift = 0
+    for byte in posting:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            number += delta
+            numbers.append(number)
+            delta = shift = 0
+    return numbers
+
+
+class QuestionIndex:
+    """Lookup of questions by poll text.
+
+    The fast path is a dict keyed by normalized text. Otherwise candidates
+    are gathered from an inverted trigram index using only the query's
+    rarest trigrams, then ranked by Dice similarity of their trigram sets.
+    The best candidate at or above the threshold wins, not the first one.
+
+    Only question ids are kept, in arrays rather than lists of int objects.
+    Entry numbers only grow, so each posting stores the gaps between them
+    as varints, mostly one byte per entry. Removed entries give up their
+    text but stay in the postings until they outnumber the live ones, then
+    the index is compacted.
+    """
+
+    def __init__(self, threshold=0.6, probe_trigrams=8, max_candidates=20, compact_after=1000):
+        self.threshold = threshold  # Minimum similarity of a fuzzy match
+        self.probe_trigrams = probe_trigrams  # Rarest query trigrams used to find candidates
+        self.max_candidates = max_candidates  # Candidates scored per lookup
+        self.compact_after = compact_after  # Removed entries always tolerated before compacting
+        self.exact = {}  # normalized text -> entry number
+        self.postings = {}  # trigram -> bytearray of delta coded entry numbers containing it
+        self.last_numbers = {}  # trigram -> last entry number in its posting
+        self.texts = []  # entry number -> normalized text, None once removed
+        self.ids = array('q')  # entry number -> question id, 0 once removed
+        self.numbers = {}  # question id -> entry number
+        self.removed = 0  # Removed entries still in the postings
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def add(self, question_text, question_id):
+        """Index a question, replacing an earlier version of it"""
+        self.remove(question_id)
+        normalized = normalize_question_text(question_text)
+        number = self.exact.get(normalized)
+        if number is not None:
+            # Same text as another question, the later question replaces the earlier one
+            del self.numbers[self.ids[number]]
+            self.ids[number] = question_id
+            self.numbers[question_id] = number
+            return
+        self._append(normalized, question_id)
+
+    def _append(self, normalized, question_id):
+        number = len(self.ids)
+        self.exact[normalized] = number
+        self.texts.append(normalized)
+        self.ids.append(question_id)
+        self.numbers[question_id] = number
+        for trigram in trigrams(normalized):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = bytearray()
+            encode_number(posting, number - self.last_numbers.get(trigram, 0))
+            self.last_numbers[trigram] = number
+
+    def remove(self, question_id):
+        """Drop a question, its postings stay behind and are skipped by lookups"""
+        number = self.numbers.pop(question_id, None)
+        if number is not None:
+            self.ids[number] = 0
+            del self.exact[self.texts[number]]
+            self.texts[number] = None
+            self.removed += 1
+            if self.removed > max(self.compact_after, len(self.numbers)):
+                self.compact()
+
+    def compact(self):
+        """Rebuild the entries and postings without the removed questions"""
+        live = sorted((number, question_id) for question_id, number in self.numbers.items())
+        texts = self.texts
+        self.exact, self.postings, self.last_numbers = {}, {}, {}
+        self.texts, self.ids, self.numbers = [], array('q'), {}
+        self.removed = 0
+        for number, question_id in live:
+            self._append(texts[number], question_id)
+
+    def lookup(self, question_text):
+        """Return the id of the question best matching the text, or None"""
+        normalized = normalize_question_text(question_text)
+        number = self.exact.get(normalized)
+        if number is not None:
+            return self.ids[number]
+
+        query = trigrams(normalized)
+        postings = sorted((self.postings[trigram] for trigram in query if trigram in self.postings), key=len)
+        if not postings:
+            return None
+
+        probes = postings[:self.probe_trigrams]
+        hits = Counter()
+        for posting in probes:
+            hits.update(decode_posting(posting))
+
+        # A candidate similar enough shares a good part of the probed trigrams too
+        min_hits = max(1, int(len(probes) * self.threshold / 2))
+        best, best_score = None, 0
+        for number, count in hits.most_common(self.max_candidates):
+            if count < min_hits:
+                break
+            if not self.ids[number]:
+                continue
+            candidate = trigrams(self.texts[number])
+            score = 2 * len(query & candidate) / (len(query) + len(candidate))
+            if score >= self.threshold and score > best_score:
+                best, best_score = number, score
+        return self.ids[best] if best is not None else None
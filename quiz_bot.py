@@ -6,10 +6,31 @@ import datetime
 import signal
 import pytz
 import sys
+import time
+from collections import namedtuple
 from telegram import Bot, Update
-from telegram.ext import Application, CommandHandler, ContextTypes, PollAnswerHandler
+from telegram.ext import CommandHandler, ContextTypes, PollAnswerHandler, PollHandler
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from models import get_db_connection, Channel, Question, Schedule
+from models import init_db, get_data_versions, QuestionCache, UsageBuffer, PollRegistry
+from rate_limit import TokenBucketRateLimiter
+from poll_answers import PollAnswerWriter
+from leaderboard import Leaderboards, PERIODS
+from webhook import application_builder, start_receiving_updates
+from outbox import Outbox
+from repository import Repository
+from timer_wheel import TimerWheel
+from quiz_sessions import QuizSessions, SessionStep
+from utils import check_poll_limits
+from config import (MAX_CONCURRENT_QUIZZES, QUIZ_INTERVAL_SECONDS, SCHEDULE_SYNC_INTERVAL,
+                    QUIZ_WARMUP_MINUTES, POLL_EXPLANATION_MAX_LENGTH, USAGE_FLUSH_INTERVAL,
+                    USAGE_SPOOL_FILE, POLL_REGISTRY_GRACE_PERIOD, POLL_REGISTRY_MAX_ENTRIES,
+                    POLL_REGISTRY_RETENTION, POLL_ANSWER_BATCH_SIZE, POLL_ANSWER_FLUSH_INTERVAL,
+                    POLL_ANSWER_QUEUE_SIZE, TELEGRAM_GLOBAL_RATE,
+                    TELEGRAM_GROUP_RATE, TELEGRAM_GROUP_BURST, TELEGRAM_PRIVATE_RATE,
+                    TELEGRAM_PRIVATE_BURST, TELEGRAM_MAX_RETRIES, QUIZ_BOT_WEBHOOK_PORT,
+                    OUTBOX_MAX_ATTEMPTS, OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_RETENTION,
+                    TIMER_WHEEL_TICK, QUIZ_SESSION_RESUME_WINDOW, QUIZ_SESSION_RETENTION,
+                    DEFAULT_POLL_DURATION, DB_READ_THREADS)
 
 # Configure logging
 logging.basicConfig(
@@ -29,15 +50,74 @@ ADMIN_CHAT_ID = '1352855793'
 # Set timezone for India
 IST = pytz.timezone('Asia/Kolkata')
 
+# Quiz with questions selected and poll payloads built, ready for the network sends.
+# question_ids are the deck cards the quiz is built from, in dealing order
+PreparedQuiz = namedtuple('PreparedQuiz', ['channel', 'polls', 'prepared_at', 'question_ids'])
+
 class QuizBot:
-    def __init__(self):
+    # Update types with a registered handler, nothing else is delivered
+    ALLOWED_UPDATES = [Update.MESSAGE, Update.POLL, Update.POLL_ANSWER]
+    
+    def __init__(self, request=None, question_cache=None, db=None, restrict_question_cache=False):
         self.application = None
+        self.request = request  # HTTP pool shared with the answer bot in the single-process runtime
+        # On its own the bot only holds questions of the channels it schedules, a shared
+        # cache too when its other users read the rest from the database
+        self.restricts_question_cache = question_cache is None or restrict_question_cache
+        self.question_cache = question_cache if question_cache is not None else QuestionCache()
+        self.owns_db = db is None
+        self.db = db if db is not None else Repository(DB_READ_THREADS)  # Runs SQLite work off the event loop
         self.scheduler = AsyncIOScheduler(timezone=IST)
-        self.poll_storage = {}  # Store poll information for answer bot
+        self.poll_registry = PollRegistry(  # Sent polls, shared with the answer bot through SQLite
+            grace_period=POLL_REGISTRY_GRACE_PERIOD,
+            max_entries=POLL_REGISTRY_MAX_ENTRIES,
+            retention=POLL_REGISTRY_RETENTION
+        )
+        self.leaderboards = Leaderboards()  # Per-channel scores updated with every answer batch
+        self.answer_writer = PollAnswerWriter(  # Bulk-inserts poll answers in the background
+            self.leaderboards.record_answers,
+            batch_size=POLL_ANSWER_BATCH_SIZE,
+            flush_interval=POLL_ANSWER_FLUSH_INTERVAL,
+            max_queue_size=POLL_ANSWER_QUEUE_SIZE,
+            executor=self.db.writer
+        )
+        self.quiz_slots = asyncio.Semaphore(MAX_CONCURRENT_QUIZZES)  # Bound quizzes being prepared at once
+        self.active_quizzes = set()  # Channels with a quiz being prepared
+        self.usage_buffer = UsageBuffer(USAGE_SPOOL_FILE)  # Batched used_count/last_quiz_sent writes
+        self.schedule_versions = None  # data_versions seen by the last schedule sync
+        self.schedule_jobs = {}  # job id -> schedule_signature() of the job currently scheduled
+        self.warm_quizzes = {}  # channel id -> PreparedQuiz for an upcoming cron trigger
+        self.outbox = Outbox(  # Durable queue for every outbound message
+            'quiz_bot',
+            on_sent=self.on_message_sent,
+            max_attempts=OUTBOX_MAX_ATTEMPTS,
+            base_delay=OUTBOX_BASE_DELAY,
+            max_delay=OUTBOX_MAX_DELAY,
+            retention=OUTBOX_RETENTION,
+            db=self.db,
+            resume_window=QUIZ_SESSION_RESUME_WINDOW  # Messages of quizzes too old to resume are dropped too
+        )
+        self.timer_wheel = TimerWheel(tick=TIMER_WHEEL_TICK)  # Drives all quiz sessions
+        self.sessions = QuizSessions(  # Running quizzes, one timer each, at most MAX_CONCURRENT_QUIZZES
+            self.outbox,
+            self.timer_wheel,
+            QUIZ_INTERVAL_SECONDS,
+            on_finished=self.on_quiz_finished,
+            db=self.db,
+            max_running=MAX_CONCURRENT_QUIZZES
+        )
         
     async def initialize(self):
         """Initialize the bot application"""
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        rate_limiter = TokenBucketRateLimiter(
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            group_rate=TELEGRAM_GROUP_RATE,
+            group_burst=TELEGRAM_GROUP_BURST,
+            private_rate=TELEGRAM_PRIVATE_RATE,
+            private_burst=TELEGRAM_PRIVATE_BURST,
+            max_retries=TELEGRAM_MAX_RETRIES
+        )
+        self.application = application_builder(BOT_TOKEN, self.request).rate_limiter(rate_limiter).build()
         
         # Add command handlers
         self.application.add_handler(CommandHandler("start", self.start))
@@ -47,30 +127,110 @@ class QuizBot:
         self.application.add_handler(CommandHandler("add_channel", self.add_channel_command))
         self.application.add_handler(CommandHandler("list_channels", self.list_channels))
         self.application.add_handler(CommandHandler("schedule_quiz", self.schedule_quiz_command))
+        self.application.add_handler(CommandHandler("leaderboard", self.leaderboard_command))
+        self.application.add_handler(CommandHandler("quizzes", self.list_quizzes))
+        self.application.add_handler(CommandHandler("pause_quiz", self.pause_quiz_command))
+        self.application.add_handler(CommandHandler("resume_quiz", self.resume_quiz_command))
+        self.application.add_handler(CommandHandler("cancel_quiz", self.cancel_quiz_command))
         self.application.add_handler(PollAnswerHandler(self.handle_poll_answer))
+        self.application.add_handler(PollHandler(self.handle_poll_update))
+        
+        # Make sure tables added since the last deploy exist
+        init_db()
+        
+        # Load leaderboards, rebuilding the rollups from answers if needed
+        try:
+            self.leaderboards.load()
+        except Exception as e:
+            logger.error(f"Error loading leaderboards: {e}")
+        
+        # Write usage counts left over from the previous run
+        try:
+            replayed = self.usage_buffer.replay()
+            if replayed:
+                logger.info(f"Replayed {replayed} buffered usage updates")
+        except Exception as e:
+            logger.error(f"Error replaying usage buffer: {e}")
         
         # Initialize and start scheduler
         self.scheduler.start()
+        self.scheduler.add_job(
+            func=self.flush_usage,
+            trigger='interval',
+            seconds=USAGE_FLUSH_INTERVAL,
+            id='flush_usage',
+            replace_existing=True
+        )
+        self.scheduler.add_job(
+            func=self.evict_polls,
+            trigger='interval',
+            seconds=60,
+            id='evict_polls',
+            replace_existing=True
+        )
         
-        # Load existing schedules
+        # Load existing schedules and keep picking up changes
         await self.load_schedules()
+        self.scheduler.add_job(
+            func=self.sync_schedules,
+            trigger='interval',
+            seconds=SCHEDULE_SYNC_INTERVAL,
+            id='sync_schedules',
+            replace_existing=True
+        )
+        self.scheduler.add_job(
+            func=self.warm_upcoming_quizzes,
+            trigger='interval',
+            seconds=60,
+            id='warm_upcoming_quizzes',
+            replace_existing=True
+        )
         
         logger.info("Quiz bot initialized successfully")
     
     async def load_schedules(self):
         """Load existing schedules from database"""
+        await self.sync_schedules(force=True)
+        logger.info(f"Loaded {len(self.schedule_jobs)} active schedules")
+    
+    async def sync_schedules(self, force=False):
+        """Add, update or remove quiz jobs for schedules changed since the last sync"""
         try:
-            schedules = Schedule.get_active_schedules()
-            for schedule in schedules:
-                await self.add_schedule_job(schedule)
-            logger.info(f"Loaded {len(schedules)} active schedules")
+            versions = await self.db.read(get_data_versions)
+            if not force and versions == self.schedule_versions:
+                return
+            
+            wanted = {}
+            for schedule, channel in await self.db.schedules.get_active_with_channels():
+                wanted[f"quiz_{schedule.id}"] = (schedule, channel)
+            if self.restricts_question_cache:
+                self.question_cache.restrict({channel.id for _, channel in wanted.values()})
+            
+            # Remove jobs of deleted or deactivated schedules
+            for job_id in list(self.schedule_jobs):
+                if job_id not in wanted:
+                    if self.scheduler.get_job(job_id):
+                        self.scheduler.remove_job(job_id)
+                    del self.schedule_jobs[job_id]
+                    logger.info(f"Removed schedule job {job_id}")
+            
+            # Add new jobs and replace changed ones
+            for job_id, (schedule, channel) in wanted.items():
+                if self.schedule_jobs.get(job_id) != self.schedule_signature(schedule, channel):
+                    await self.add_schedule_job(schedule, channel)
+            
+            self.schedule_versions = versions
         except Exception as e:
-            logger.error(f"Error loading schedules: {e}")
+            logger.error(f"Error syncing schedules: {e}")
     
-    async def add_schedule_job(self, schedule):
+    def schedule_signature(self, schedule, channel):
+        """What a quiz job depends on, used to detect changed schedules"""
+        return (channel.channel_id, schedule.schedule_time, schedule.days_of_week)
+    
+    async def add_schedule_job(self, schedule, channel=None):
         """Add a scheduled job for a channel"""
         try:
-            channel = Channel.get_by_id(schedule.channel_id)
+            channel = channel or await self.db.channels.get_by_id(schedule.channel_id)
             if not channel:
                 logger.error(f"Channel not found for schedule {schedule.id}")
                 return
@@ -92,6 +252,7 @@ class QuizBot:
                 id=f"quiz_{schedule.id}",
                 replace_existing=True
             )
+            self.schedule_jobs[f"quiz_{schedule.id}"] = self.schedule_signature(schedule, channel)
             
             logger.info(f"Added schedule job for channel {channel.channel_name}")
         except Exception as e:
@@ -101,113 +262,256 @@ class QuizBot:
         """Send scheduled quiz to a channel"""
         try:
             logger.info(f"Sending scheduled quiz to channel {channel_id}")
-            await self.send_quiz_to_channel(channel_id)
+            await self.dispatch_quiz(channel_id)
         except Exception as e:
             logger.error(f"Error sending scheduled quiz: {e}")
     
+    async def dispatch_quiz(self, channel_id):
+        """Prepare a channel quiz and start its session. Preparing waits for a free quiz slot,
+        the session waits in QuizSessions while MAX_CONCURRENT_QUIZZES others run"""
+        if channel_id in self.active_quizzes or self.sessions.get_by_chat(channel_id):
+            logger.warning(f"Quiz already queued or running for channel {channel_id}, skipping")
+            return
+        
+        self.active_quizzes.add(channel_id)
+        try:
+            async with self.quiz_slots:
+                await self.send_quiz_to_channel(channel_id)
+        finally:
+            self.active_quizzes.discard(channel_id)
+    
+    async def flush_usage(self):
+        """Write buffered question usage counts to the database"""
+        try:
+            await self.db.write(self.usage_buffer.flush)
+        except Exception as e:
+            logger.error(f"Error flushing usage buffer: {e}")
+    
+    async def evict_polls(self):
+        """Drop closed polls from the registry, old messages from the outbox, ended sessions,
+        question tombstones the cache has applied and past day and week leaderboards"""
+        try:
+            # Registry entries are only changed on the writer thread
+            await self.db.write(self.poll_registry.evict)
+            await self.db.write(self.poll_registry.purge)
+            self.outbox.prune_paced()
+            await self.db.write(self.outbox.purge)
+            await self.db.write(self.sessions.purge, QUIZ_SESSION_RETENTION)
+            await self.db.write(self.question_cache.purge_tombstones)
+            await self.db.write(self.leaderboards.purge)
+        except Exception as e:
+            logger.error(f"Error evicting polls: {e}")
+    
+    def build_poll_payload(self, question, number):
+        """Build send_poll arguments for a question, or None if it breaks Telegram limits"""
+        question_text = f"Q{number}: {question.question_text}"
+        options = [
+            question.option_a,
+            question.option_b,
+            question.option_c,
+            question.option_d
+        ]
+        explanation = question.explanation or "Check discussion group for detailed explanation."
+        
+        errors = check_poll_limits(question_text, options)
+        if errors:
+            logger.warning(f"Skipping question {question.id}: {'; '.join(errors)}")
+            return None
+        
+        if len(explanation) > POLL_EXPLANATION_MAX_LENGTH:
+            # The full explanation is posted in the discussion group
+            explanation = "Check discussion group for detailed explanation."
+        
+        return {
+            'question': question_text,
+            'options': options,
+            'type': "quiz",
+            'correct_option_id': question.correct_option,
+            'is_anonymous': False,
+            'explanation': explanation,
+            'open_period': DEFAULT_POLL_DURATION
+        }
+    
+    async def prepare_quiz(self, channel_id, peek=False, question_ids=None):
+        """Select a channel's questions and build ready-to-send poll payloads.
+        
+        By default the questions are dealt from the channel's deck. With peek the
+        next cards are only looked at, None if the deck cannot fill a quiz without
+        a deal. With question_ids the quiz uses those already dealt cards.
+        """
+        channel = await self.db.channels.get_by_channel_id(channel_id)
+        if not channel:
+            return None
+        
+        try:
+            await self.db.read(self.question_cache.refresh)
+        except Exception as e:
+            logger.error(f"Error refreshing question cache: {e}")
+        
+        if peek:
+            question_ids = await self.db.decks.peek(channel.id, channel.questions_per_batch)
+            questions = await self.db.read(self.question_cache.get_many, question_ids)
+            if len(question_ids) < channel.questions_per_batch or len(questions) < len(question_ids):
+                return None
+        elif question_ids is not None:
+            questions = await self.db.read(self.question_cache.get_many, question_ids)
+            missing = set(question_ids) - {question.id for question in questions}
+            if missing:
+                await self.db.decks.discard(channel.id, list(missing))
+        else:
+            questions = await self.db.decks.deal_questions(channel.id, channel.questions_per_batch,
+                                                           self.question_cache)
+            question_ids = [question.id for question in questions]
+        
+        # get_many does not keep the order of the ids
+        order = {question_id: position for position, question_id in enumerate(question_ids)}
+        questions = sorted(questions, key=lambda question: order[question.id])
+        
+        polls = []
+        for question in questions:
+            payload = self.build_poll_payload(question, len(polls) + 1)
+            if payload:
+                polls.append((question.id, payload))
+        
+        return PreparedQuiz(channel, polls, time.time(), question_ids)
+    
+    async def warm_upcoming_quizzes(self):
+        """Prepare quizzes whose cron trigger fires within the warm-up window. Nothing is dealt
+        here, a warm quiz that is dropped or never sent leaves the deck as it was"""
+        try:
+            horizon = datetime.datetime.now(IST) + datetime.timedelta(minutes=QUIZ_WARMUP_MINUTES)
+            for job in self.scheduler.get_jobs():
+                if not job.id.startswith('quiz_') or not job.next_run_time or job.next_run_time > horizon:
+                    continue
+                
+                channel_id = job.args[0]
+                if (channel_id in self.warm_quizzes or channel_id in self.active_quizzes
+                        or self.sessions.get_by_chat(channel_id)):
+                    continue
+                
+                quiz = await self.prepare_quiz(channel_id, peek=True)
+                if quiz:
+                    self.warm_quizzes[channel_id] = quiz
+                    logger.info(f"Prepared {len(quiz.polls)} polls for {channel_id} ahead of {job.next_run_time}")
+        except Exception as e:
+            logger.error(f"Error warming up quizzes: {e}")
+    
+    def quiz_key(self, channel):
+        """Key of a channel's quiz, unique per channel and minute so a re-fired trigger
+        queues nothing twice"""
+        return f"quiz:{channel.id}:{datetime.datetime.now(IST).strftime('%Y%m%d%H%M')}"
+    
     async def send_quiz_to_channel(self, channel_id):
         """Send quiz to a specific channel"""
         try:
-            # Get channel information
-            channel = Channel.get_by_channel_id(channel_id)
+            channel = await self.db.channels.get_by_channel_id(channel_id)
             if not channel:
                 logger.error(f"Channel {channel_id} not found")
                 return
             
-            # Get questions for this channel
-            questions = Question.get_by_channel(channel.id, limit=channel.questions_per_batch)
-            
-            if not questions:
-                logger.warning(f"No questions available for channel {channel_id}")
-                await self.application.bot.send_message(
-                    chat_id=channel_id,
-                    text="❌ No questions available for today's quiz."
-                )
+            # Checked before any cards are dealt, so they stay in the deck for the next quiz
+            quiz_key = self.quiz_key(channel)
+            if await self.sessions.has_run(quiz_key):
+                logger.warning(f"Quiz {quiz_key} already started this minute, skipping")
                 return
             
-            # Send start message
-            await self.application.bot.send_message(
-                chat_id=channel_id,
-                text=f"🎓 **Quiz Time!** 📚\n\n"
-                     f"Get ready for {len(questions)} questions!\n"
-                     f"Category: {channel.category}\n\n"
-                     f"Good luck! 🍀"
-            )
-            
-            # Send each question as a poll
-            for i, question in enumerate(questions, 1):
-                try:
-                    # Prepare options
-                    options = [
-                        question.option_a,
-                        question.option_b,
-                        question.option_c,
-                        question.option_d
-                    ]
-                    
-                    # Send poll
-                    poll_message = await self.application.bot.send_poll(
-                        chat_id=channel_id,
-                        question=f"Q{i}: {question.question_text}",
-                        options=options,
-                        type="quiz",
-                        correct_option_id=question.correct_option,
-                        is_anonymous=False,
-                        explanation=question.explanation or "Check discussion group for detailed explanation.",
-                        open_period=300  # 5 minutes
-                    )
-                    
-                    # Store poll information for answer bot
-                    self.poll_storage[poll_message.poll.id] = {
-                        'question': question,
-                        'channel_id': channel_id,
-                        'discussion_group_id': channel.discussion_group_id,
-                        'poll_message': poll_message
-                    }
-                    
-                    # Update question usage count
-                    question.used_count += 1
-                    question.save()
-                    
-                    logger.info(f"Sent poll Q{i} to {channel_id}")
-                    
-                    # Wait between questions
-                    await asyncio.sleep(10)
-                    
-                except Exception as e:
-                    logger.error(f"Error sending poll Q{i}: {e}")
-                    continue
-            
-            # Send completion message
-            await self.application.bot.send_message(
-                chat_id=channel_id,
-                text="🎉 **Quiz Complete!** 🎉\n\n"
-                     "Thank you for participating!\n"
-                     "Detailed answers will be posted in the discussion group."
-            )
+            # Use the payloads prepared during warm-up if the deck deals the cards they were
+            # built from, or prepare them now
+            quiz = self.warm_quizzes.pop(channel_id, None)
+            if quiz and time.time() - quiz.prepared_at <= (QUIZ_WARMUP_MINUTES + 5) * 60:
+                dealt = await self.db.decks.deal(quiz.channel.id, len(quiz.question_ids))
+                if dealt != quiz.question_ids:
+                    # Questions added or dealt since the warm-up
+                    quiz = await self.prepare_quiz(channel_id, question_ids=dealt)
+            else:
+                quiz = await self.prepare_quiz(channel_id)
+            
+            if not quiz:
+                logger.error(f"Channel {channel_id} not found")
+                return
             
-            # Update channel last quiz sent
-            with get_db_connection() as conn:
-                conn.execute(
-                    'UPDATE channels SET last_quiz_sent = ? WHERE id = ?',
-                    (datetime.datetime.now(IST), channel.id)
-                )
-                conn.commit()
+            channel = quiz.channel
+            if not quiz.polls:
+                logger.warning(f"No questions available for channel {channel_id}")
+                await self.outbox.enqueue_async(f"{quiz_key}:empty", channel_id, 'send_message', {
+                    'text': "❌ No questions available for today's quiz."
+                })
+                return
             
-            logger.info(f"Quiz completed for channel {channel_id}")
+            # The session queues the start message, the polls spaced by the quiz interval,
+            # then the completion message. The outbox keeps that spacing between the actual
+            # sends of the quiz's polls, whatever delays them
+            steps = [SessionStep('start', 'send_message', {
+                'text': f"🎓 **Quiz Time!** 📚\n\n"
+                        f"Get ready for {len(quiz.polls)} questions!\n"
+                        f"Category: {channel.category}\n\n"
+                        f"Good luck! 🍀"
+            }, None)]
+            for i, (question_id, payload) in enumerate(quiz.polls, 1):
+                steps.append(SessionStep(f"poll:{i}", 'send_poll', payload, {
+                    'question_id': question_id, 'number': i, 'count': len(quiz.polls), 'quiz': quiz_key,
+                    'pace': [quiz_key, QUIZ_INTERVAL_SECONDS if i > 1 else 0]
+                }))
+            steps.append(SessionStep('complete', 'send_message', {
+                'text': "🎉 **Quiz Complete!** 🎉\n\n"
+                        "Thank you for participating!\n"
+                        "Detailed answers will be posted in the discussion group."
+            }, {'channel': channel.id, 'pace': [quiz_key, QUIZ_INTERVAL_SECONDS]}))
+            
+            session = await self.sessions.start(channel_id, quiz_key, steps)
+            if session:
+                logger.info(f"Quiz session {session.id} started for channel {channel_id}")
             
         except Exception as e:
             logger.error(f"Error sending quiz to channel {channel_id}: {e}")
     
+    def on_quiz_finished(self, session):
+        """Record the quiz once its completion message is queued"""
+        channel_row_id = session.steps[-1].context['channel']
+        # Update channel last quiz sent, written in batch by flush_usage
+        sent_at = datetime.datetime.now(IST)
+        self.usage_buffer.record_quiz_sent(channel_row_id, sent_at)
+        self.db.channel_cache.record_quiz_sent(channel_row_id, sent_at)
+    
+    async def on_message_sent(self, message, sent):
+        """Register a sent poll for the answer bot and count the question as used"""
+        if message.method != 'send_poll':
+            return
+        
+        question_id = message.context['question_id']
+        poll = sent.poll
+        close_time = poll.close_date.timestamp() if poll.close_date else time.time() + DEFAULT_POLL_DURATION
+        # A short write, the answer bot waits for the registration
+        await self.db.short_write(self.poll_registry.register, poll.id, question_id, sent.chat_id, sent.message_id,
+                                  close_time, message.context.get('quiz'), message.context['number'],
+                                  message.context.get('count'))
+        
+        # Update question usage count, written in batch by flush_usage
+        self.usage_buffer.record_question_used(question_id)
+        logger.info(f"Sent poll Q{message.context['number']} to {message.chat_id}")
+    
+    async def handle_poll_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Record polls closing, the answer bot posts explanations once they have"""
+        try:
+            poll = update.poll
+            if poll.is_closed:
+                await self.db.write(self.poll_registry.mark_closed, poll.id)
+                logger.info(f"Poll {poll.id} closed")
+        except Exception as e:
+            logger.error(f"Error handling poll update: {e}")
+    
     async def handle_poll_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle poll answers"""
         try:
             poll_answer = update.poll_answer
             user = poll_answer.user
             poll_id = poll_answer.poll_id
+            option_id = poll_answer.option_ids[0] if poll_answer.option_ids else None
+            
+            # Queue for the background writer, this handler must return immediately
+            self.answer_writer.submit(poll_id, user.id, option_id, user.username or user.first_name)
             
-            # Log poll answer
-            logger.info(f"User {user.username or user.first_name} answered poll {poll_id}")
+            logger.debug(f"User {user.username or user.first_name} answered poll {poll_id}")
             
         except Exception as e:
             logger.error(f"Error handling poll answer: {e}")
@@ -224,6 +528,9 @@ class QuizBot:
                 '• /add_channel - Add new channel\n'
                 '• /list_channels - List all channels\n'
                 '• /schedule_quiz - Schedule quiz\n'
+                '• /leaderboard - Show channel leaderboard\n'
+                '• /quizzes - List running quizzes\n'
+                '• /pause_quiz, /resume_quiz, /cancel_quiz  - Control a quiz\n'
                 '• /health - Check bot status'
             )
         except Exception as e:
@@ -237,7 +544,8 @@ class QuizBot:
                 f'✅ **Bot Status: Healthy**\n\n'
                 f'🕒 Current Time (IST): {ist_time.strftime("%Y-%m-%d %H:%M:%S")}\n'
                 f'🔄 Scheduler Status: {"Running" if self.scheduler.running else "Stopped"}\n'
-                f'📊 Active Jobs: {len(self.scheduler.get_jobs())}'
+                f'📊 Active Jobs: {len(self.scheduler.get_jobs())}\n'
+                f'🎯 Running Quizzes: {len(self.sessions)}'
             )
         except Exception as e:
             logger.error(f"Error in health check: {e}")
@@ -257,9 +565,17 @@ class QuizBot:
                 return
             
             channel_id = context.args[0]
+            channel = await self.db.channels.get_by_channel_id(channel_id)
+            if channel and await self.sessions.has_run(self.quiz_key(channel)):
+                await update.message.reply_text(
+                    f"⏳ A quiz for {channel_id} already started this minute, try again in a minute."
+                )
+                return
             
             await update.message.reply_text(f"🚀 Starting quiz for {channel_id}...")
-            await self.send_quiz_to_channel(channel_id)
+            
+            # Run in the background so the handler does not block other updates
+            self.application.create_task(self.dispatch_quiz(channel_id))
             
         except Exception as e:
             logger.error(f"Error in send quiz command: {e}")
@@ -280,13 +596,13 @@ class QuizBot:
                 return
             
             channel_id = context.args[0]
-            channel = Channel.get_by_channel_id(channel_id)
+            channel = await self.db.channels.get_by_channel_id(channel_id)
             
             if not channel:
                 await update.message.reply_text(f"❌ Channel {channel_id} not found!")
                 return
             
-            questions = Question.get_by_channel(channel.id)
+            questions = await self.db.questions.get_by_channel(channel.id)
             
             await update.message.reply_text(
                 f"📊 **Channel: {channel.channel_name}**\n\n"
@@ -300,6 +616,43 @@ class QuizBot:
             logger.error(f"Error in check questions: {e}")
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
+    async def leaderboard_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Leaderboard command handler"""
+        try:
+            if not context.args:
+                await update.message.reply_text(
+                    "📝 **Usage:** /leaderboard @channel [day|week|all]\n\n"
+                    "Example: /leaderboard @mychannel week"
+                )
+                return
+            
+            channel_id = context.args[0]
+            period = context.args[1].lower() if len(context.args) > 1 else 'day'
+            if period not in PERIODS:
+                await update.message.reply_text("❌ Period must be day, week or all")
+                return
+            
+            channel = await self.db.channels.get_by_channel_id(channel_id)
+            if not channel:
+                await update.message.reply_text(f"❌ Channel {channel_id} not found!")
+                return
+            
+            top = self.leaderboards.top(channel.id, period, limit=10)
+            if not top:
+                await update.message.reply_text(f"🏆 No scores yet for {channel.channel_name} ({period}).")
+                return
+            
+            titles = {'day': "Today's", 'week': "This Week's", 'all': 'All-Time'}
+            message = f"🏆 **{titles[period]} Leaderboard - {channel.channel_name}**\n\n"
+            for rank, (user_id, user_name, score) in enumerate(top, 1):
+                message += f"{rank}. {user_name or user_id} - {score} pts\n"
+            
+            await update.message.reply_text(message)
+            
+        except Exception as e:
+            logger.error(f"Error in leaderboard command: {e}")
+            await update.message.reply_text(f"❌ Error: {str(e)}")
+    
     async def add_channel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Add channel command handler"""
         try:
@@ -323,7 +676,7 @@ class QuizBot:
                 await update.message.reply_text("❌ Admin only command!")
                 return
             
-            channels = Channel.get_all()
+            channels = await self.db.channels.get_all()
             
             if not channels:
                 await update.message.reply_text("📋 No channels configured yet.")
@@ -359,19 +712,118 @@ class QuizBot:
         except Exception as e:
             logger.error(f"Error in schedule quiz command: {e}")
     
-    async def run(self):
-        """Run the bot"""
+    async def list_quizzes(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """List running quiz sessions"""
         try:
-            await self.initialize()
+            if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+                await update.message.reply_text("❌ Admin only command!")
+                return
             
-            # Start the bot
-            await self.application.initialize()
-            await self.application.start()
-            await self.application.updater.start_polling(
-                allowed_updates=Update.ALL_TYPES
-            )
+            sessions = self.sessions.all()
+            if not sessions:
+                await update.message.reply_text("📭 No quizzes running.")
+                return
             
-            logger.info("Quiz bot started successfully!")
+            message = "🎯 **Running Quizzes:**\n\n"
+            for session in sessions:
+                message += (f"#{session.id} {session.chat_id} - {session.state}, "
+                            f"{session.polls_sent}/{session.poll_count} polls sent\n")
+            await update.message.reply_text(message)
+            
+        except Exception as e:
+            logger.error(f"Error in list quizzes: {e}")
+            await update.message.reply_text(f"❌ Error: {str(e)}")
+    
+    async def pause_quiz_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Pause quiz command handler"""
+        await self.control_quiz(update, context, 'pause')
+    
+    async def resume_quiz_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Resume quiz command handler"""
+        await self.control_quiz(update, context, 'resume')
+    
+    async def cancel_quiz_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Cancel quiz command handler"""
+        await self.control_quiz(update, context, 'cancel')
+    
+    async def control_quiz(self, update: Update, context: ContextTypes.DEFAULT_TYPE, action):
+        """Pause, resume or cancel a quiz session by id"""
+        try:
+            if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+                await update.message.reply_text("❌ Admin only command!")
+                return
+            
+            if not context.args or not context.args[0].lstrip('#').isdigit():
+                await update.message.reply_text(
+                    f"📝 **Usage:** /{action}_quiz <session id>\n\n"
+                    f"Example: /{action}_quiz 3 (see /quizzes)"
+                )
+                return
+            
+            session_id = int(context.args[0].lstrip('#'))
+            if getattr(self.sessions, action)(session_id):
+                await update.message.reply_text(f"✅ Quiz #{session_id}: {action} done")
+            else:
+                await update.message.reply_text(f"❌ Cannot {action} quiz #{session_id}")
+            
+        except Exception as e:
+            logger.error(f"Error in {action} quiz command: {e}")
+            await update.message.reply_text(f"❌ Error: {str(e)}")
+    
+    async def start_bot(self):
+        """Initialize and start receiving updates"""
+        await self.initialize()
+        
+        # Start the bot
+        await self.application.initialize()
+        await self.application.start()
+        await start_receiving_updates(
+            self.application, self.ALLOWED_UPDATES, QUIZ_BOT_WEBHOOK_PORT, 'quiz_bot'
+        )
+        self.answer_writer.start()
+        await self.outbox.start(self.application.bot)
+        self.timer_wheel.start()
+        
+        # Continue quizzes a restart interrupted
+        try:
+            restored = self.sessions.restore(QUIZ_SESSION_RESUME_WINDOW)
+            if restored:
+                logger.info(f"Resumed {restored} quiz sessions")
+        except Exception as e:
+            logger.error(f"Error resuming quiz sessions: {e}")
+        
+        logger.info("Quiz bot started successfully!")
+    
+    async def stop_bot(self):
+        """Stop the bot, writing out everything still buffered"""
+        # Running quiz sessions and unsent outbox messages are resumed on the next start
+        await self.timer_wheel.stop()
+        await self.sessions.stop()
+        await self.outbox.stop()
+        if self.application:
+            if self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            await self.application.shutdown()
+        
+        # Write poll answers still queued
+        await self.answer_writer.stop()
+        
+        if self.scheduler.running:
+            self.scheduler.shutdown()
+        
+        # Persist usage counts that were not flushed yet
+        self.usage_buffer.close()
+        
+        # Finish database writes still queued
+        if self.owns_db:
+            self.db.close()
+    
+    async def run(self):
+        """Run the bot"""
+        try:
+            await self.start_bot()
             
             # Keep running
             while True:
@@ -380,14 +832,7 @@ class QuizBot:
         except Exception as e:
             logger.error(f"Error running quiz bot: {e}")
         finally:
-            # Cleanup
-            if self.application:
-                await self.application.updater.stop()
-                await self.application.stop()
-                await self.application.shutdown()
-            
-            if self.scheduler.running:
-                self.scheduler.shutdown()
+            await self.stop_bot()
 
 # Signal handler for graceful shutdown
 def signal_handler(sig, frame):
@@ -412,4 +857,4 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-    
\ No newline at end of file
+    
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import time
+from collections import deque, namedtuple
+
+from models import QuizSessionRecord
+
+logger = logging.getLogger(__name__)
+
+# One outbox message of a session: idempotency key suffix, bot method, arguments, context
+SessionStep = namedtuple('SessionStep', ['key', 'method', 'payload', 'context'])
+
+
+class QuizSession:
+    """Progress of one quiz being posted to a channel"""
+    __slots__ = ('id', 'chat_id', 'quiz_key', 'steps', 'index', 'next_at', 'state', 'timer', 'queuing')
+
+    def __init__(self, id, chat_id, quiz_key, steps):
+        self.id = id
+        self.chat_id = chat_id
+        self.quiz_key = quiz_key  # Prefix of the outbox idempotency keys
+        self.steps = steps  # SessionSteps: start message, polls, completion message
+        self.index = 0  # Next step to queue
+        self.next_at = None  # Unix time the next step is due, remaining seconds while paused
+        self.state = 'running'
+        self.timer = None
+        self.queuing = False  # Whether a step is being written to the outbox
+
+    @property
+    def polls_sent(self):
+        return sum(1 for step in self.steps[:self.index] if step.method == 'send_poll')
+
+    @property
+    def poll_count(self):
+        return sum(1 for step in self.steps if step.method == 'send_poll')
+
+
+class QuizSessions:
+    """Quiz sessions advanced by one timer wheel instead of a coroutine each.
+
+    Every step queues one message in the outbox and, after a poll, schedules
+    the next step interval seconds later on the wheel. A running quiz is a
+    QuizSession record and one timer, which admins can pause, resume or
+    cancel by session id.
+
+    At most max_running sessions run (or are paused) at once, sessions
+    started beyond that wait in a queue and start as others end.
+
+    Sessions are checkpointed to the quiz_sessions table after every step, so
+    restore() picks unfinished ones up after a restart. A step queued right
+    before a crash is queued again under the same outbox key and ignored.
+    With a Repository, sessions are created and steps queued as short writes
+    on its writer thread, checkpoints are written behind them.
+    """
+
+    def __init__(self, outbox, wheel, interval, on_finished=None, db=None, max_running=None):
+        self.outbox = outbox
+        self.wheel = wheel
+        self.interval = interval  # Seconds between polls
+        self.on_finished = on_finished  # Called with the session once its last step is queued
+        self.db = db  # Repository for checkpoint writes, None to write on the event loop
+        self.max_running = max_running  # Sessions running or paused at once, None for no limit
+        self.sessions = {}  # session id -> QuizSession
+        self.waiting = deque()  # queued sessions in start order
+        self.tasks = set()  # steps being queued in the outbox
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def get_by_chat(self, chat_id):
+        """Return the unfinished session of a chat, or None"""
+        for session in self.sessions.values():
+            if session.chat_id == chat_id:
+                return session
+        return None
+
+    def all(self):
+        return list(self.sessions.values())
+
+    async def start(self, chat_id, quiz_key, steps):
+        """Start a session, its first step is queued right away unless max_running sessions
+        are running, then it waits its turn. Returns None if a session with the same quiz
+        key already ran"""
+        session_id = await self._write(QuizSessionRecord.create, chat_id, quiz_key, steps, time.time())
+        if not session_id:
+            logger.info(f"Quiz session {quiz_key} already exists, not starting it again")
+            return None
+        
+        session = QuizSession(session_id, str(chat_id), quiz_key, steps)
+        has_room = self._has_room()
+        self.sessions[session.id] = session
+        if not has_room:
+            session.state = 'queued'
+            self.waiting.append(session)
+            self._checkpoint(session)
+            logger.info(f"Queued quiz session {session.id} for {chat_id}, {self.max_running} already running")
+            return session
+        
+        self._schedule(session, 0)
+        logger.info(f"Started quiz session {session.id} for {chat_id} with {len(steps)} steps")
+        return session
+    
+    async def has_run(self, quiz_key):
+        """Whether a session with this quiz key was started already, start() would skip it"""
+        if self.db:
+            return await self.db.read(QuizSessionRecord.exists, quiz_key)
+        return QuizSessionRecord.exists(quiz_key)
+    
+    def restore(self, max_age):
+        """Resume sessions checkpointed within the last max_age seconds, returns how many
+        were restored"""
+        now = time.time()
+        restored = 0
+        for row in QuizSessionRecord.get_unfinished(now - max_age):
+            if row['id'] in self.sessions:
+                continue
+            
+            steps = [SessionStep(*step) for step in row['steps']]
+            session = QuizSession(row['id'], row['chat_id'], row['quiz_key'], steps)
+            session.index = row['next_index']
+            session.state = row['state']
+            self.sessions[session.id] = session
+            restored += 1
+            
+            if session.state == 'queued':
+                self.waiting.append(session)
+            elif session.state == 'paused':
+                session.next_at = row['next_at']
+            else:
+                self._schedule(session, max(0, row['next_at'] - now))
+            logger.info(f"Restored quiz session {session.id} for {session.chat_id} "
+                        f"at step {session.index}/{len(steps)} ({session.state})")
+        self._start_waiting()
+        return restored
+    
+    async def stop(self):
+        """Wait for steps being queued, call after stopping the wheel"""
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def purge(self, retention):
+        """Delete checkpoints of sessions that ended more than retention seconds ago"""
+        return QuizSessionRecord.purge(time.time() - retention)
+
+    def pause(self, session_id):
+        """Stop a running session before its next step, returns False if not running"""
+        session = self.sessions.get(session_id)
+        if not session or session.state != 'running':
+            return False
+        if session.timer:
+            session.timer.cancel()
+            session.timer = None
+        # A step being queued sets next_at once it is written
+        session.next_at = max(0, session.next_at - time.time())
+        session.state = 'paused'
+        self._checkpoint(session)
+        logger.info(f"Paused quiz session {session_id} at step {session.index}")
+        return True
+
+    def resume(self, session_id):
+        """Continue a paused session, returns False if not paused"""
+        session = self.sessions.get(session_id)
+        if not session or session.state != 'paused':
+            return False
+        session.state = 'running'
+        if not session.queuing:
+            self._schedule(session, session.next_at)
+        self._checkpoint(session)
+        logger.info(f"Resumed quiz session {session_id} at step {session.index}")
+        return True
+
+    def cancel(self, session_id):
+        """Drop a session, steps not queued yet are never sent"""
+        session = self.sessions.pop(session_id, None)
+        if not session:
+            return False
+        if session.timer:
+            session.timer.cancel()
+            session.timer = None
+        if session.state == 'queued':
+            self.waiting.remove(session)
+        session.state = 'cancelled'
+        self._checkpoint(session)
+        logger.info(f"Cancelled quiz session {session_id} at step {session.index}")
+        self._start_waiting()
+        return True
+
+    def _has_room(self):
+        """Whether fewer than max_running sessions are running or paused"""
+        if self.max_running is None:
+            return True
+        return len(self.sessions) - len(self.waiting) < self.max_running
+
+    def _start_waiting(self):
+        """Start queued sessions while there is room"""
+        while self.waiting and self._has_room():
+            session = self.waiting.popleft()
+            session.state = 'running'
+            self._schedule(session, 0)
+            self._checkpoint(session)
+            logger.info(f"Started queued quiz session {session.id} for {session.chat_id}")
+
+    async def _write(self, function, *args):
+        if self.db:
+            return await self.db.short_write(function, *args)
+        return function(*args)
+
+    def _checkpoint(self, session):
+        args = (session.id, session.index, session.state, session.next_at)
+        if self.db:
+            # Timer callbacks cannot wait for the write, the writer thread keeps checkpoints in order
+            self.db.submit_write(QuizSessionRecord.checkpoint, *args)
+            return
+        try:
+            QuizSessionRecord.checkpoint(*args)
+        except Exception as e:
+            logger.error(f"Error checkpointing quiz session {session.id}: {e}")
+    
+    def _schedule(self, session, delay):
+        session.next_at = time.time() + delay
+        session.timer = self.wheel.schedule(delay, self._step, session)
+
+    def _step(self, session):
+        session.timer = None
+        if session.state != 'running':
+            return
+        # Timer callbacks cannot wait for the outbox write
+        session.queuing = True
+        task = asyncio.ensure_future(self._queue_step(session))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _continue(self, session, delay):
+        """Schedule the next step of a session whose step was just queued, paused sessions
+        wait delay seconds once resumed"""
+        if session.state == 'running':
+            self._schedule(session, delay)
+        elif session.state == 'paused':
+            session.next_at = delay
+
+    async def _queue_step(self, session):
+        step = session.steps[session.index]
+        try:
+            await self.outbox.enqueue_async(f"{session.quiz_key}:{step.key}", session.chat_id, step.method,
+                                            step.payload, context=step.context)
+        except Exception as e:
+            logger.error(f"Error queuing step {session.index} of quiz session {session.id}: {e}")
+            self._continue(session, self.interval)
+            return
+        finally:
+            session.queuing = False
+
+        session.index += 1
+        if session.state == 'cancelled':
+            return
+        if session.index < len(session.steps):
+            # Polls are spaced by the interval, plain messages are followed right away
+            self._continue(session, self.interval if step.method == 'send_poll' else 0)
+            self._checkpoint(session)
+            return
+
+        session.state = 'finished'
+        self._checkpoint(session)
+        self.sessions.pop(session.id, None)
+        logger.info(f"Quiz session {session.id} for {session.chat_id} finished")
+        if self.on_finished:
+            try:
+                self.on_finished(session)
+            except Exception as e:
+                logger.error(f"Error finishing quiz session {session.id}: {e}")
+        self._start_waiting()
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a fixed rate (tokens per second)"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self.blocked_until - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        """Stop handing out tokens for the given number of seconds"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self):
+        """True when the bucket is full and not blocked, so it can be dropped"""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """Rate limiter enforcing Telegram's global limit and each chat's own limit.
+
+    Every request takes a token from the bucket of its chat and then from the
+    global bucket. Groups and channels (negative ids and @usernames) share the
+    group limit, private chats get the private limit. A RetryAfter only blocks
+    the chat that triggered it, other chats keep sending.
+    """
+
+    MAX_IDLE_BUCKETS = 1024
+
+    def __init__(self, global_rate=30, group_rate=20 / 60, group_burst=3, private_rate=1,
+                 private_burst=1, max_retries=2):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.max_retries = max_retries
+        self.chat_buckets = {}  # chat id -> TokenBucket
+
+    async def initialize(self):
+        """Nothing to set up"""
+
+    async def shutdown(self):
+        """Nothing to clean up"""
+
+    def get_chat_bucket(self, chat_id):
+        """Get or create the token bucket of a chat"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                for key, idle in list(self.chat_buckets.items()):
+                    if idle.is_idle():
+                        del self.chat_buckets[key]
+
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """Wait for chat and global tokens, then run the request"""
+        max_retries = rate_limit_args if rate_limit_args is not None else self.max_retries
+
+        chat_id = data.get('chat_id')
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        chat_bucket = self.get_chat_bucket(chat_id) if chat_id is not None else None
+
+        for attempt in range(max_retries + 1):
+            if chat_bucket:
+                await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                logger.warning(f"Flood control on {endpoint} for chat {chat_id}, "
+                               f"retry after {retry_after}s")
+                (chat_bucket or self.global_bucket).block(retry_after + 0.1)
+
+                if attempt == max_retries:
+                    raise
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+from models import Channel, ChannelCache, Question, QuestionDeck, Schedule
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncModel:
+    """Awaitable mirror of a model class: repository.channels.get_by_id(1) runs
+    Channel.get_by_id(1) on a database thread. Methods named in writes run on
+    the writer thread, everything else on the readers"""
+
+    def __init__(self, repository, model, writes=()):
+        self.repository = repository
+        self.model = model
+        self.writes = set(writes)
+
+    def __getattr__(self, name):
+        method = getattr(self.model, name)
+        run = self.repository.write if name in self.writes else self.repository.read
+        return functools.partial(run, method)
+
+
+class CachedChannels(AsyncModel):
+    """AsyncModel of Channel whose id lookups go through a ChannelCache. A channel
+    cached and checked within the last interval is returned without leaving the
+    event loop"""
+
+    def __init__(self, repository, cache):
+        super().__init__(repository, Channel, writes=('save',))
+        self.cache = cache
+
+    async def get_by_id(self, channel_id):
+        channel = self.cache.cached_by_id(channel_id)
+        return channel or await self.repository.read(self.cache.get_by_id, channel_id)
+
+    async def get_by_channel_id(self, channel_id):
+        channel = self.cache.cached_by_channel_id(channel_id)
+        return channel or await self.repository.read(self.cache.get_by_channel_id, channel_id)
+
+
+class WriterThread(Executor):
+    """One thread applying writes one at a time. submit() queues a write behind the
+    others, submit_short() ahead of every queued submit() write but behind the
+    short ones queued before it. A running write is never interrupted"""
+
+    SHORT, BULK, STOP = range(3)
+
+    def __init__(self, name):
+        self.queue = queue.PriorityQueue()  # (priority, sequence, Future, call)
+        self.sequence = itertools.count()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        return self._put(self.BULK, functools.partial(function, *args, **kwargs))
+
+    def submit_short(self, function, *args, **kwargs):
+        return self._put(self.SHORT, functools.partial(function, *args, **kwargs))
+
+    def _put(self, priority, call):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('cannot schedule new writes after shutdown')
+            self.queue.put((priority, next(self.sequence), future, call))
+        return future
+
+    def _run(self):
+        while True:
+            priority, _, future, call = self.queue.get()
+            if priority == self.STOP:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = call()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Stop after every write queued so far"""
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put((self.STOP, next(self.sequence), None, None))
+        if wait:
+            self.thread.join()
+
+
+class Repository:
+    """Async database access for the bots.
+
+    SQLite work runs off the event loop: reads on a small thread pool, writes
+    on one dedicated writer thread, so the bots' writes never wait on each
+    other for SQLite's write lock. Writes are applied in the order they were
+    submitted, except that short single-row writes (outbox and quiz session
+    rows) go ahead of queued bulk work. They still wait for the write that is
+    running. Other processes such as app.py uploads can hold the lock too,
+    which delays the writer but not update handling. channels, questions,
+    schedules and decks mirror the model classes, read() and write() run any
+    other function. Channel lookups by id are served from a ChannelCache.
+    """
+
+    def __init__(self, readers=4):
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix='db-read')
+        self.writer = WriterThread('db-write')
+        self.channel_cache = ChannelCache()
+        self.channels = CachedChannels(self, self.channel_cache)
+        self.questions = AsyncModel(self, Question, writes=('save',))
+        self.schedules = AsyncModel(self, Schedule, writes=('save',))
+        self.decks = AsyncModel(self, QuestionDeck, writes=('deal', 'deal_questions', 'discard', 'delete'))
+
+    async def read(self, function, *args, **kwargs):
+        """Run a read on a reader thread and return its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, functools.partial(function, *args, **kwargs))
+
+    async def write(self, function, *args, **kwargs):
+        """Run a write on the writer thread and return its result"""
+        return await asyncio.wrap_future(self.writer.submit(function, *args, **kwargs))
+
+    def submit_write(self, function, *args, **kwargs):
+        """Queue a write from code that cannot await, errors are only logged"""
+        future = self.writer.submit(function, *args, **kwargs)
+        future.add_done_callback(self._log_error)
+        return future
+
+    async def short_write(self, function, *args, **kwargs):
+        """Run a short write on the writer thread ahead of queued bulk writes and return its result"""
+        return await asyncio.wrap_future(self.writer.submit_short(function, *args, **kwargs))
+
+    def submit_short_write(self, function, *args, **kwargs):
+        """Queue a short write without awaiting it, errors are only logged"""
+        future = self.writer.submit_short(function, *args, **kwargs)
+        future.add_done_callback(self._log_error)
+        return future
+
+    def _log_error(self, future):
+        if not future.cancelled() and future.exception():
+            logger.error(f"Error in queued database write: {future.exception()}")
+
+    def close(self):
+        """Finish queued writes and stop the database threads"""
+        self.writer.shutdown(wait=True)
+        self.readers.shutdown(wait=True)
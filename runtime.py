@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import signal
+
+from telegram.request import HTTPXRequest
+
+from config import (HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT,
+                    HTTP_POOL_TIMEOUT, DB_READ_THREADS, ANSWER_BOT_TEXT_MATCHING)
+
+# Configure logging before the bot modules, both bots log to one file in this mode
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+    handlers=[
+        logging.FileHandler('logs/runtime.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+from models import init_db, QuestionCache
+from quiz_bot import QuizBot
+from answer_bot import AnswerBot
+from repository import Repository
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest used by several bots, only close() shuts the connection pool down"""
+
+    async def shutdown(self):
+        # Called by every Bot on shutdown, the pool must outlive the first one
+        pass
+
+    async def close(self):
+        await super().shutdown()
+
+
+class BotRuntime:
+    """Runs the quiz bot and the answer bot on one event loop.
+
+    Both Applications send through one HTTPXRequest connection pool, read
+    questions from one QuestionCache and share the quiz bot's PollRegistry
+    and one Repository, whose one writer thread applies both bots' database
+    writes. Long polling keeps its own getUpdates connection per bot.
+    Without text matching the answer bot reads questions by id, so the
+    cache only holds the scheduled channels, as the quiz bot's own does.
+    quiz_bot.py and answer_bot.py still run on their own.
+    """
+
+    def __init__(self):
+        self.request = SharedHTTPXRequest(
+            connection_pool_size=HTTP_POOL_SIZE,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            read_timeout=HTTP_READ_TIMEOUT,
+            write_timeout=HTTP_WRITE_TIMEOUT,
+            pool_timeout=HTTP_POOL_TIMEOUT
+        )
+        self.question_cache = QuestionCache()
+        self.db = Repository(DB_READ_THREADS)
+        quiz_bot = QuizBot(request=self.request, question_cache=self.question_cache, db=self.db,
+                           restrict_question_cache=not ANSWER_BOT_TEXT_MATCHING)
+        answer_bot = AnswerBot(request=self.request, question_cache=self.question_cache,
+                               poll_registry=quiz_bot.poll_registry, db=self.db)
+        self.bots = [quiz_bot, answer_bot]
+        self.started = []
+
+    async def start(self):
+        """Load shared data once, then start both bots"""
+        init_db()
+        if ANSWER_BOT_TEXT_MATCHING:
+            # Every channel is matched, otherwise the quiz bot loads its channels once its schedules are synced
+            self.question_cache.refresh(force=True)
+
+        for bot in self.bots:
+            await bot.start_bot()
+            self.started.append(bot)
+
+        logger.info("Bot runtime started successfully!")
+
+    async def stop(self):
+        """Stop the bots in reverse order, then close the shared connection pool and database threads"""
+        while self.started:
+            bot = self.started.pop()
+            try:
+                await bot.stop_bot()
+            except Exception as e:
+                logger.error(f"Error stopping {type(bot).__name__}: {e}")
+        await self.request.close()
+        self.db.close()
+
+    async def run(self):
+        """Run both bots"""
+        try:
+            await self.start()
+
+            # Keep running
+            while True:
+                await asyncio.sleep(1)
+
+        except Exception as e:
+            logger.error(f"Error running bot runtime: {e}")
+        finally:
+            await self.stop()
+
+# Signal handler for graceful shutdown
+def signal_handler(sig, frame):
+    logger.info("Received signal to terminate bot runtime.")
+    raise KeyboardInterrupt
+
+async def main():
+    """Main function"""
+    try:
+        # Set up signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        # Create and run both bots
+        runtime = BotRuntime()
+        await runtime.run()
+
+    except KeyboardInterrupt:
+        logger.info("Bot runtime stopping...")
+    except Exception as e:
+        logger.error(f"Fatal error in bot runtime: {e}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The bot modules log to logs/ under the working directory
+os.makedirs('logs', exist_ok=True)
+
+import models
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh database for one test, with one channel (row id 1) that has a discussion group"""
+    monkeypatch.setattr(models, 'DATABASE', str(tmp_path / 'test.db'))
+    models.init_db()
+    with models.get_db_connection() as conn:
+        conn.execute('''
+            INSERT INTO channels (channel_name, channel_id, discussion_group_id, category)
+            VALUES ('Test', '@test', '-100', 'GK')
+        ''')
+        conn.commit()
+    return models
+
+
+def add_question(text, channel_id=1):
+    """Insert a question and return its id"""
+    with models.get_db_connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO questions (channel_id, question_text, option_a, option_b, option_c, option_d,
+                                   correct_option, explanation)
+            VALUES (?, ?, 'a', 'b', 'c', 'd', 0, 'because')
+        ''', (channel_id, text))
+        conn.commit()
+        return cursor.lastrowid
+
+
+async def wait_for(condition, timeout=2):
+    """Wait until condition() is true, failing the test after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import answer_bot
+from answer_bot import AnswerBot
+from conftest import add_question, wait_for
+from models import PollRegistry
+
+
+def test_question_count_without_text_matching_comes_from_the_database(database, monkeypatch):
+    for number in range(3):
+        add_question(f'Question {number}')
+
+    async def run():
+        bot = AnswerBot()
+        try:
+            monkeypatch.setattr(answer_bot, 'ANSWER_BOT_TEXT_MATCHING', False)
+            await bot.load_questions_database(force=True)
+            without = await bot.question_count()
+            monkeypatch.setattr(answer_bot, 'ANSWER_BOT_TEXT_MATCHING', True)
+            await bot.load_questions_database(force=True)
+            with_matching = await bot.question_count()
+        finally:
+            bot.db.close()
+        return without, with_matching, len(bot.question_index)
+
+    assert asyncio.run(run()) == (3, 3, 3)
+
+
+def test_find_question_waits_for_a_late_registration(database, monkeypatch):
+    question_id = add_question('Which planet is red?')
+    monkeypatch.setattr(answer_bot, 'ANSWER_BOT_TEXT_MATCHING', False)
+    close_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+    poll = SimpleNamespace(id='late-poll', question='Which planet is red?', close_date=close_date,
+                           is_closed=False)
+
+    async def run():
+        bot = AnswerBot()
+        try:
+            async def register_late():
+                await asyncio.sleep(1.5)
+                await bot.db.short_write(PollRegistry().register, poll.id, question_id, 1, 7,
+                                         close_date.timestamp())
+            registering = asyncio.ensure_future(register_late())
+            entry, close_time, closed, record = await bot.find_question(poll)
+            await registering
+        finally:
+            bot.db.close()
+        return entry, closed, record
+
+    entry, closed, record = asyncio.run(run())
+    assert entry is not None and not closed
+    assert record.message_id == 7
+
+
+def test_find_question_gives_up_once_the_poll_is_closed(database, monkeypatch):
+    monkeypatch.setattr(answer_bot, 'ANSWER_BOT_TEXT_MATCHING', False)
+    poll = SimpleNamespace(id='unknown-poll', question='Unknown', close_date=None, is_closed=True)
+
+    async def run():
+        bot = AnswerBot()
+        try:
+            return await bot.find_question(poll)
+        finally:
+            bot.db.close()
+
+    assert asyncio.run(run()) == (None, None, False, None)
+
+
+def test_explanation_is_sent_as_soon_as_its_poll_is_reported_closed(database, monkeypatch):
+    question_id = add_question('Which planet is red?')
+    monkeypatch.setattr(answer_bot, 'ANSWER_BOT_TEXT_MATCHING', False)
+    monkeypatch.setattr(answer_bot, 'ANSWER_DIGEST_MODE', False)
+    monkeypatch.setattr(answer_bot, 'POLL_CLOSE_CHECK_INTERVAL', 0.05)
+    close_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=300)
+    poll = SimpleNamespace(id='poll', question='Q1: Which planet is red?', close_date=close_date,
+                           is_closed=False)
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(sent), chat_id=chat_id)
+
+    async def run():
+        bot = AnswerBot()
+        await bot.outbox.start(SimpleNamespace(send_message=send_message))
+        watch = asyncio.ensure_future(bot.watch_poll_closures())
+        try:
+            bot.poll_registry.register(poll.id, question_id, '@test', 7, close_date.timestamp())
+            await bot.answer_poll(poll)
+            # Queued for the close time plus grace, minutes away
+            assert len(bot.outbox) == 1 and not sent
+
+            bot.poll_registry.mark_closed(poll.id)
+            await wait_for(lambda: sent)
+        finally:
+            watch.cancel()
+            await bot.outbox.stop()
+            bot.db.close()
+
+    asyncio.run(run())
+    assert sent[0][0] == '-100'
+    assert 'Which planet is red?' in sent[0][1]
@@ -0,0 +1,99 @@
+import asyncio
+
+import answer_bot
+from answer_bot import AnswerBot
+from conftest import add_question
+from models import get_db_connection
+
+
+def make_bot():
+    bot = AnswerBot()
+    bot.question_cache.refresh()
+    return bot
+
+
+def test_entries_are_cached_least_recently_used_first_out(database, monkeypatch):
+    monkeypatch.setattr(answer_bot, 'ANSWER_ENTRY_CACHE_SIZE', 2)
+    first, second, third = (add_question(f'Question {number}') for number in range(3))
+
+    async def run():
+        bot = make_bot()
+        try:
+            assert (await bot.get_answer_entry(first))['question_text'] == 'Question 0'
+            await bot.get_answer_entry(second)
+            await bot.get_answer_entry(first)
+            await bot.get_answer_entry(third)
+            assert list(bot.answer_entries) == [first, third]
+            assert await bot.get_answer_entry(12345) is None
+        finally:
+            bot.db.close()
+
+    asyncio.run(run())
+
+
+def test_edits_drop_cached_entries(database):
+    question_id = add_question('Question 0')
+
+    async def run():
+        bot = make_bot()
+        try:
+            await bot.get_answer_entry(question_id)
+            with get_db_connection() as conn:
+                conn.execute("UPDATE questions SET question_text = 'Edited' WHERE id = ?", (question_id,))
+                conn.commit()
+            bot.question_cache.refresh()
+            assert question_id not in bot.answer_entries
+            assert (await bot.get_answer_entry(question_id))['question_text'] == 'Edited'
+        finally:
+            bot.db.close()
+
+    asyncio.run(run())
+
+
+def test_entry_read_across_a_refresh_is_not_cached(database):
+    question_id = add_question('Question 0')
+
+    async def run():
+        bot = make_bot()
+        read = bot.question_cache.get_with_channel
+
+        def read_then_edit(question_id):
+            found = read(question_id)
+            # An edit refreshed in while the read was under way
+            with get_db_connection() as conn:
+                conn.execute("UPDATE questions SET question_text = 'Edited' WHERE id = ?", (question_id,))
+                conn.commit()
+            bot.question_cache.refresh()
+            return found
+
+        bot.question_cache.get_with_channel = read_then_edit
+        try:
+            assert (await bot.get_answer_entry(question_id))['question_text'] == 'Question 0'
+            assert question_id not in bot.answer_entries
+        finally:
+            bot.db.close()
+
+    asyncio.run(run())
+
+
+def test_entries_are_cached_without_a_loaded_question_cache(database):
+    question_id = add_question('Question 0')
+
+    async def run():
+        bot = AnswerBot()
+        try:
+            assert bot.question_cache.versions is None
+            await bot.get_answer_entry(question_id)
+            assert question_id in bot.answer_entries
+            with get_db_connection() as conn:
+                conn.execute("UPDATE questions SET question_text = 'Edited' WHERE id = ?", (question_id,))
+                conn.commit()
+            # What refresh_questions does when the data versions move on
+            bot.set_entry_versions(await bot.db.read(answer_bot.question_data_versions))
+            assert question_id not in bot.answer_entries
+            assert (await bot.get_answer_entry(question_id))['question_text'] == 'Edited'
+            assert question_id in bot.answer_entries
+        finally:
+            bot.db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+from models import ChannelCache, get_db_connection
+
+
+def rename_channel(name):
+    with get_db_connection() as conn:
+        conn.execute('UPDATE channels SET channel_name = ? WHERE id = 1', (name,))
+        conn.commit()
+
+
+def test_cached_channels_are_dropped_when_the_version_moves(database):
+    cache = ChannelCache(check_interval=0)
+    channel = cache.get_by_id(1)
+    assert cache.get_by_channel_id('@test') is channel
+    assert cache.get_by_id(1) is channel
+
+    rename_channel('Renamed')
+    assert cache.get_by_id(1).channel_name == 'Renamed'
+    assert cache.get_by_channel_id('@test').channel_name == 'Renamed'
+
+
+def test_records_stay_cached_between_version_checks(database):
+    cache = ChannelCache(check_interval=3600)
+    channel = cache.get_by_id(1)
+    assert cache.cached_by_id(1) is channel
+    rename_channel('Renamed')
+    # Edits show up once the interval is over
+    assert cache.get_by_id(1).channel_name == 'Test'
+    cache.checked_at -= 3600
+    assert cache.cached_by_id(1) is None
+    assert cache.get_by_id(1).channel_name == 'Renamed'
+
+
+def test_quiz_sends_update_the_cached_record(database):
+    cache = ChannelCache(check_interval=0)
+    channel = cache.get_by_id(1)
+    cache.record_quiz_sent(1, '2026-01-01 10:00:00+05:30')
+    # The write UsageBuffer makes does not move the version
+    with get_db_connection() as conn:
+        conn.execute("UPDATE channels SET last_quiz_sent = '2026-01-01 10:00:00+05:30' WHERE id = 1")
+        conn.commit()
+    assert cache.get_by_id(1) is channel
+    assert channel.last_quiz_sent == '2026-01-01 10:00:00+05:30'
@@ -0,0 +1,97 @@
+import datetime
+import time
+
+from conftest import add_question
+from leaderboard import Leaderboards, RankedScores, iso_week_sql, period_keys
+from models import PollRegistry, get_db_connection
+
+
+def insert_scores(rows):
+    """Insert (channel_id, period, period_key, user_id, score) rollup rows"""
+    with get_db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO leaderboard_scores (channel_id, period, period_key, user_id, score, answers)
+            VALUES (?, ?, ?, ?, ?, 1)
+        ''', rows)
+        conn.commit()
+
+
+def rollups():
+    with get_db_connection() as conn:
+        return sorted(tuple(row) for row in conn.execute(
+            'SELECT channel_id, period, period_key, user_id, score, answers FROM leaderboard_scores'))
+
+
+def register_polls(count):
+    """Register count polls of new questions of channel 1, the correct option is 0"""
+    registry = PollRegistry()
+    for number in range(count):
+        registry.register(f'poll{number}', add_question(f'Question {number}'), '@test', number, time.time())
+
+
+def test_boards_built_from_sorted_rows_match_incremental_updates():
+    built = RankedScores.from_sorted([(3, 5), (1, 2), (2, 2)])
+    added = RankedScores()
+    for user_id, score in ((1, 2), (2, 1), (3, 5), (2, 1)):
+        added.add(user_id, score)
+    assert built.ranking == added.ranking
+    assert built.top(2) == [(3, 5), (1, 2)]
+
+
+def test_load_ranks_each_channel_by_score(database):
+    keys = period_keys(time.time())
+    insert_scores([(1, 'day', keys['day'], 7, 1), (1, 'day', keys['day'], 8, 4),
+                   (1, 'day', keys['day'], 9, 4), (2, 'day', keys['day'], 7, 2),
+                   (1, 'all', 'all', 7, 10), (1, 'day', '2000-01-01', 6, 99)])
+    leaderboards = Leaderboards()
+    leaderboards.load()
+    assert [(user_id, score) for user_id, _, score in leaderboards.top(1)] == [(8, 4), (9, 4), (7, 1)]
+    assert [(user_id, score) for user_id, _, score in leaderboards.top(2)] == [(7, 2)]
+    assert [(user_id, score) for user_id, _, score in leaderboards.top(1, 'all')] == [(7, 10)]
+
+
+def test_purge_deletes_past_day_and_week_rollups(database):
+    keys = period_keys(time.time())
+    insert_scores([(1, 'day', keys['day'], 7, 1), (1, 'day', '2000-01-01', 7, 1),
+                   (1, 'week', keys['week'], 7, 1), (1, 'week', '2000-W01', 7, 1),
+                   (1, 'all', 'all', 7, 2)])
+    assert Leaderboards().purge() == 2
+    with get_db_connection() as conn:
+        left = conn.execute('SELECT period, period_key FROM leaderboard_scores ORDER BY period').fetchall()
+    assert [tuple(row) for row in left] == [('all', 'all'), ('day', keys['day']), ('week', keys['week'])]
+
+
+def test_iso_week_sql_matches_strftime(database):
+    start = datetime.date(2019, 12, 20)
+    days = [start + datetime.timedelta(days=offset) for offset in range(0, 6 * 366, 3)]
+    with get_db_connection() as conn:
+        for day in days:
+            week = conn.execute(f"SELECT {iso_week_sql(repr(day.isoformat()))}").fetchone()[0]
+            assert week == day.strftime('%G-W%V'), day
+
+
+def test_recorded_rollups_equal_a_rebuild(database):
+    register_polls(3)
+    now = time.time()
+    leaderboards = Leaderboards()
+    # Answers spread over three weeks, some wrong and one to an unknown poll
+    leaderboards.record_answers([('poll0', 7, 0, now - 15 * 86400, 'ann'), ('poll0', 8, 1, now, 'bob'),
+                                 ('poll1', 7, 0, now - 7 * 86400, 'ann'), ('other', 7, 0, now, 'ann')])
+    leaderboards.record_answers([('poll2', 7, 0, now, 'ann'), ('poll2', 8, 0, now, None)])
+    recorded = rollups()
+
+    leaderboards.rebuild()
+    assert rollups() == recorded
+    assert [(user_id, name, score) for user_id, name, score in leaderboards.top(1, 'all')] == \
+        [(7, 'ann', 3), (8, 'bob', 1)]
+
+
+def test_a_retried_batch_is_not_scored_twice(database):
+    register_polls(2)
+    batch = [('poll0', 7, 0, time.time(), 'ann'), ('poll1', 7, 0, time.time(), 'ann')]
+    leaderboards = Leaderboards()
+    leaderboards.record_answers(batch)
+    recorded = rollups()
+    leaderboards.record_answers(batch)
+    assert rollups() == recorded
+    assert leaderboards.top(1) == [(7, 'ann', 2)]
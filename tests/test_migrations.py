@@ -0,0 +1,83 @@
+import sqlite3
+
+import models
+
+# Schema of the first release, before migrations were versioned
+BASELINE_SCHEMA = '''
+    CREATE TABLE channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_name TEXT NOT NULL,
+        channel_id TEXT NOT NULL UNIQUE,
+        discussion_group_id TEXT,
+        category TEXT NOT NULL,
+        questions_per_batch INTEGER DEFAULT 10,
+        active BOOLEAN DEFAULT 1,
+        last_quiz_sent DATETIME,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER,
+        question_text TEXT NOT NULL,
+        option_a TEXT NOT NULL,
+        option_b TEXT NOT NULL,
+        option_c TEXT NOT NULL,
+        option_d TEXT NOT NULL,
+        correct_option INTEGER NOT NULL,
+        explanation TEXT,
+        reason TEXT,
+        used_count INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (channel_id) REFERENCES channels (id)
+    );
+    CREATE TABLE schedules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER,
+        schedule_time TEXT NOT NULL,
+        days_of_week TEXT NOT NULL,
+        interval_type TEXT NOT NULL,
+        active BOOLEAN DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (channel_id) REFERENCES channels (id)
+    );
+    CREATE TABLE quiz_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER,
+        questions_sent INTEGER,
+        sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (channel_id) REFERENCES channels (id)
+    );
+    INSERT INTO channels (channel_name, channel_id, category) VALUES ('Old', '@old', 'GK');
+    INSERT INTO questions (channel_id, question_text, option_a, option_b, option_c, option_d, correct_option)
+    VALUES (1, 'Kept?', 'a', 'b', 'c', 'd', 0);
+'''
+
+
+def user_version():
+    with models.get_db_connection() as conn:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def test_a_baseline_database_is_migrated_to_the_latest_version(tmp_path, monkeypatch):
+    path = str(tmp_path / 'baseline.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    monkeypatch.setattr(models, 'DATABASE', path)
+
+    models.init_db()
+    assert user_version() == len(models.MIGRATIONS)
+    with models.get_db_connection() as conn:
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        question = conn.execute('SELECT question_text, row_version FROM questions').fetchone()
+    assert {'idx_questions_channel_used', 'idx_schedules_active_channel',
+            'idx_poll_answers_poll_user'} <= indexes
+    assert tuple(question) == ('Kept?', 0)
+    assert models.Channel.get_by_id(1).channel_name == 'Old'
+    cache = models.QuestionCache()
+    cache.refresh()
+    assert list(cache.questions) == [1]
+
+    # Running it again applies nothing
+    models.init_db()
+    assert user_version() == len(models.MIGRATIONS)
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from conftest import wait_for
+from models import OutboxMessage, get_db_connection
+from outbox import Outbox
+from repository import Repository
+
+
+class FakeBot:
+    """Records send_message calls, each returns a message with the next id"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(self.sent), chat_id=chat_id)
+
+
+def outbox_rows():
+    with get_db_connection() as conn:
+        return [tuple(row) for row in conn.execute(
+            'SELECT idempotency_key, status, attempts FROM outbox ORDER BY id')]
+
+
+def test_stop_during_mark_sending_leaves_the_message_pending(database):
+    release = threading.Event()
+
+    async def run():
+        db = Repository(1)
+        bot = FakeBot()
+        outbox = Outbox('test', db=db)
+        try:
+            await outbox.start(bot)
+            await outbox.enqueue_async('a', 'chat', 'send_message', {'text': 'hello'})
+            # Hold the short writer before the lane runs, it stops while mark_sending is queued
+            db.submit_short_write(release.wait, 5)
+            await wait_for(lambda: 'chat' in outbox.lane_tasks)
+            await outbox.stop()
+        finally:
+            release.set()
+            db.close()
+        assert bot.sent == []
+        assert outbox_rows() == [('a', 'pending', 0)]
+
+        # The next start sends it once
+        db = Repository(1)
+        outbox = Outbox('test', db=db)
+        try:
+            await outbox.start(bot)
+            await wait_for(lambda: bot.sent)
+            await outbox.stop()
+        finally:
+            db.close()
+        assert bot.sent == [('chat', 'hello')]
+        assert outbox_rows() == [('a', 'sent', 1)]
+
+    asyncio.run(run())
+
+
+def test_on_sent_runs_to_the_end_when_stopped(database):
+    callbacks = []
+    proceed = asyncio.Event()
+
+    async def on_sent(message, sent):
+        callbacks.append('started')
+        await proceed.wait()
+        callbacks.append(sent.message_id)
+
+    async def run():
+        db = Repository(1)
+        outbox = Outbox('test', on_sent=on_sent, db=db)
+        try:
+            await outbox.start(FakeBot())
+            await outbox.enqueue_async('a', 'chat', 'send_message', {'text': 'hello'})
+            await wait_for(lambda: callbacks)
+            stopping = asyncio.ensure_future(outbox.stop())
+            await asyncio.sleep(0.05)
+            assert not stopping.done()
+            proceed.set()
+            await stopping
+        finally:
+            db.close()
+
+    asyncio.run(run())
+    assert callbacks == ['started', 1]
+    assert outbox_rows() == [('a', 'sent', 1)]
+
+
+def test_expedite_sends_a_delayed_message_now(database):
+    async def run():
+        bot = FakeBot()
+        outbox = Outbox('test')
+        await outbox.start(bot)
+        later = time.time() + 60
+        for key in ('a', 'b', 'c'):
+            outbox.enqueue(key, 'chat', 'send_message', {'text': key}, not_before=later)
+        assert await outbox.expedite('b')
+        assert not await outbox.expedite('b')
+        assert not await outbox.expedite('missing')
+        await wait_for(lambda: bot.sent)
+        assert len(outbox) == 2
+        await outbox.stop()
+        return bot.sent
+
+    assert asyncio.run(run()) == [('chat', 'b')]
+
+
+def test_digest_sections_are_cut_at_line_then_word_boundaries(database):
+    outbox = Outbox('test', digest_limit=20)
+    parts = outbox._split_digest(['short', 'first line here\nsecond line is longer words',
+                                  'x' * 25])
+    assert all(len(part) <= 20 for part in parts)
+    assert parts[:3] == ['short', 'first line here', 'second line is']
+    assert parts[3] == 'longer words'
+    assert ''.join(parts[4:]).replace('\n', '') == 'x' * 25
+
+
+def test_prune_paced_forgets_groups_past_the_retention(database):
+    outbox = Outbox('test', retention=60)
+    outbox.paced = {'old': time.time() - 120, 'recent': time.time()}
+    outbox.prune_paced()
+    assert list(outbox.paced) == ['recent']
+
+
+def test_start_expires_messages_overdue_past_the_resume_window(database):
+    OutboxMessage.enqueue('test', 'stale', 'chat', 'send_message', {'text': 'stale'},
+                          not_before=time.time() - 3600)
+    OutboxMessage.enqueue('test', 'fresh', 'chat', 'send_message', {'text': 'fresh'})
+
+    async def run():
+        bot = FakeBot()
+        outbox = Outbox('test', resume_window=1800)
+        try:
+            await outbox.start(bot)
+            await wait_for(lambda: bot.sent)
+        finally:
+            await outbox.stop()
+        return bot.sent
+
+    assert asyncio.run(run()) == [('chat', 'fresh')]
+    assert outbox_rows() == [('stale', 'failed', 0), ('fresh', 'sent', 1)]
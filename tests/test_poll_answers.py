@@ -0,0 +1,53 @@
+import asyncio
+
+from poll_answers import PollAnswerWriter
+
+
+def test_answers_are_written_in_batches_and_flushed_on_stop():
+    batches = []
+
+    async def run():
+        writer = PollAnswerWriter(lambda batch: batches.append([answer[1] for answer in batch]),
+                                  batch_size=3, flush_interval=0.05)
+        writer.start()
+        for user_id in range(7):
+            writer.submit('poll', user_id, 0, answered_at=1.0)
+        await writer.stop()
+        return writer.written
+
+    assert asyncio.run(run()) == 7
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_a_full_queue_drops_answers_instead_of_blocking():
+    stored = []
+
+    async def run():
+        writer = PollAnswerWriter(stored.extend, max_queue_size=2)
+        for user_id in range(3):
+            writer.submit('poll', user_id, 0)
+        writer.start()
+        await writer.stop()
+        return writer.dropped
+
+    assert asyncio.run(run()) == 1
+    assert [answer[1] for answer in stored] == [0, 1]
+
+
+def test_a_failed_write_is_retried():
+    attempts = []
+
+    def store(batch):
+        attempts.append(len(batch))
+        if len(attempts) == 1:
+            raise RuntimeError('database is locked')
+
+    async def run():
+        writer = PollAnswerWriter(store, flush_interval=0.01)
+        writer.start()
+        writer.submit('poll', 1, 0)
+        await writer.stop()
+        return writer.written
+
+    assert asyncio.run(run()) == 1
+    assert attempts == [1, 1]
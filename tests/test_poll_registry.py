@@ -0,0 +1,49 @@
+import time
+
+from models import PollRegistry
+
+
+def test_evicted_polls_are_still_found_in_the_table(database):
+    registry = PollRegistry(grace_period=60, max_entries=2, retention=3600)
+    now = time.time()
+    registry.register('closed', 1, '@test', 10, now - 120)
+    registry.register('open', 2, '@test', 11, now + 60)
+
+    # Registering evicts too, the closed poll is past its grace period
+    assert list(registry.entries) == ['open']
+    assert registry.evict(now + 180) == 1
+    assert not registry.entries
+    assert registry.get('closed').question_id == 1
+    assert registry.get('open').question_id == 2
+
+    # More polls than max_entries drops the oldest from memory
+    registry.register('newer', 3, '@test', 12, now + 60)
+    registry.register('newest', 4, '@test', 13, now + 60)
+    registry.register('latest', 5, '@test', 14, now + 60)
+    assert list(registry.entries) == ['newest', 'latest']
+    assert registry.get('newer').message_id == 12
+
+
+def test_purge_deletes_rows_past_the_retention(database):
+    registry = PollRegistry(retention=3600)
+    now = time.time()
+    registry.register('old', 1, '@test', 10, now - 7200)
+    registry.register('recent', 2, '@test', 11, now - 60)
+
+    assert registry.purge(now) == 1
+    registry.entries.clear()
+    assert registry.get('old') is None
+    assert registry.get('recent').question_id == 2
+
+
+def test_mark_closed_moves_the_close_time_forward(database):
+    registry = PollRegistry()
+    registry.register('poll', 1, '@test', 10, time.time() + 300)
+    closed_at = time.time()
+    registry.mark_closed('poll', closed_at)
+
+    record = registry.get('poll')
+    assert (record.close_time, record.closed_at) == (closed_at, closed_at)
+    registry.entries.clear()
+    assert registry.get('poll').closed_at == closed_at
+    assert registry.get_closed_since(closed_at - 1) == [('poll', closed_at)]
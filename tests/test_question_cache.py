@@ -0,0 +1,92 @@
+import threading
+import time
+
+from conftest import add_question
+from models import Question, QuestionCache, get_db_connection
+
+
+def test_concurrent_refreshes_apply_in_order(database):
+    cache = QuestionCache()
+    cache.refresh()
+    running = []
+    overlapped = []
+    seen = []
+
+    def slow_listener(changes):
+        running.append(1)
+        if len(running) > 1:
+            overlapped.append(changes)
+        time.sleep(0.02)
+        seen.append(cache.versions[0])
+        running.pop()
+
+    cache.subscribe(slow_listener)
+
+    done = threading.Event()
+
+    def refresh_often():
+        while not done.is_set():
+            cache.refresh()
+
+    threads = [threading.Thread(target=refresh_often) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    question_ids = []
+    for number in range(10):
+        question_ids.append(add_question(f'Question {number}'))
+        time.sleep(0.01)
+    done.set()
+    for thread in threads:
+        thread.join()
+    cache.refresh()
+
+    assert not overlapped
+    assert seen == sorted(seen)
+    assert sorted(cache.questions) == question_ids
+
+
+def test_purged_tombstones_make_older_caches_reload(database):
+    question_ids = [add_question(f'Question {number}') for number in range(3)]
+    current, lagging = QuestionCache(), QuestionCache()
+    current.refresh()
+    lagging.refresh()
+
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM questions WHERE id = ?', (question_ids[0],))
+        conn.commit()
+    current.refresh()
+    assert current.purge_tombstones() == 1
+    assert current.purge_tombstones() == 0
+
+    changes = lagging.refresh()
+    assert changes.full
+    assert sorted(lagging.questions) == question_ids[1:]
+
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM questions WHERE id = ?', (question_ids[1],))
+        conn.commit()
+    changes = lagging.refresh()
+    assert not changes.full
+    assert changes.deleted == [question_ids[1]]
+
+
+def test_bulk_inserted_questions_reach_a_loaded_cache_in_one_version(database):
+    cache = QuestionCache()
+    cache.refresh()
+    before = cache.versions[0]
+
+    questions = [Question(channel_id=1, question_text=f'Bulk {number}', option_a='a', option_b='b',
+                          option_c='c', option_d='d', correct_option=number % 4)
+                 for number in range(600)]
+    with get_db_connection() as conn:
+        assert Question.bulk_insert(conn, questions) == 600
+        conn.commit()
+
+    changes = cache.refresh()
+    assert not changes.full and len(changes.updated) == 600
+    assert cache.versions[0] == before + 1
+
+    # More ids than one IN (...) batch, unknown ids are skipped
+    found = Question.get_many(changes.updated + [999999])
+    assert sorted(question.question_text for question in found) == sorted(f'Bulk {n}' for n in range(600))
+    assert not hasattr(found[0], '__dict__')
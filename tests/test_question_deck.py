@@ -0,0 +1,60 @@
+from conftest import add_question
+from models import QuestionDeck, get_db_connection
+
+
+def set_used_counts(counts):
+    """Set used_count of questions from a question id -> count dict"""
+    with get_db_connection() as conn:
+        conn.executemany('UPDATE questions SET used_count = ? WHERE id = ?',
+                         [(count, question_id) for question_id, count in counts.items()])
+        conn.commit()
+
+
+def deck_round(channel_id=1):
+    with get_db_connection() as conn:
+        return conn.execute('SELECT round FROM question_decks WHERE channel_id = ?', (channel_id,)).fetchone()[0]
+
+
+def test_least_used_questions_are_dealt_first(database):
+    ids = [add_question(f'Question {number}') for number in range(4)]
+    set_used_counts({ids[0]: 2, ids[1]: 0, ids[2]: 1, ids[3]: 0})
+    dealt = QuestionDeck.deal(1, 4)
+    assert set(dealt[:2]) == {ids[1], ids[3]}
+    assert dealt[2:] == [ids[2], ids[0]]
+
+
+def test_an_exhausted_deck_is_reshuffled(database):
+    ids = [add_question(f'Question {number}') for number in range(3)]
+    first = QuestionDeck.deal(1, 2)
+    second = QuestionDeck.deal(1, 2)
+    # The last card of the round comes first, then a different card of the new round
+    assert sorted(first + second[:1]) == ids
+    assert second[1] != second[0]
+    assert deck_round() == 2
+
+
+def test_uploads_are_dealt_in_the_current_round(database):
+    ids = [add_question(f'Question {number}') for number in range(4)]
+    first = QuestionDeck.deal(1, 2)
+    uploaded = add_question('Uploaded')
+    # Uploads are only added to the deck by the next deal
+    assert uploaded not in QuestionDeck.peek(1, 3)
+    rest = QuestionDeck.deal(1, 3)
+    assert sorted(first + rest) == ids + [uploaded]
+    assert deck_round() == 1
+
+
+def test_cards_of_deleted_questions_are_discarded(database):
+    ids = [add_question(f'Question {number}') for number in range(3)]
+    # The deleted question is the least used, so its card is dealt first
+    set_used_counts({ids[0]: 1, ids[2]: 1})
+    # Build the deck, then delete a question it holds
+    QuestionDeck.deal(1, 0)
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM questions WHERE id = ?', (ids[1],))
+        conn.commit()
+    questions = QuestionDeck.deal_questions(1, 2)
+    assert sorted(question.id for question in questions) == [ids[0], ids[2]]
+    with get_db_connection() as conn:
+        cards = [row[0] for row in conn.execute('SELECT question_id FROM question_deck_cards ORDER BY question_id')]
+    assert cards == [ids[0], ids[2]]
@@ -0,0 +1,45 @@
+from question_index import QuestionIndex
+
+
+def test_exact_lookup_ignores_case_punctuation_and_spacing():
+    index = QuestionIndex()
+    index.add('What is 2 + 2?', 1)
+    index.add('Who wrote Hamlet?', 2)
+    assert index.lookup('what is  2 2') == 1
+    assert index.lookup('WHO WROTE HAMLET') == 2
+    assert index.lookup('Completely unrelated text') is None
+
+
+def test_fuzzy_lookup_returns_the_best_match():
+    index = QuestionIndex()
+    # Both are similar enough, the one added first is not the closest
+    index.add('What is the capital city of France please', 1)
+    index.add('What is the capital of Franc', 2)
+    index.add('Which planet is the largest', 3)
+    assert index.lookup('What is the capital of France?') == 2
+    assert index.lookup('Which planet is largest') == 3
+
+
+def test_removed_questions_are_not_found_and_get_compacted():
+    index = QuestionIndex(compact_after=1)
+    for question_id, text in enumerate(['Who painted the Mona Lisa', 'How many legs does a spider have',
+                                        'What is the boiling point of water', 'Which metal is liquid'], 1):
+        index.add(text, question_id)
+    index.remove(1)
+    assert index.lookup('Who painted the Mona Lisa') is None
+    assert index.removed == 1
+
+    # Compacted once the removed entries outnumber the live ones
+    index.remove(2)
+    assert index.removed == 2
+    index.remove(3)
+    assert index.removed == 0
+    assert len(index.ids) == len(index) == 1
+    assert index.lookup('What is the boiling point of water') is None
+    assert index.lookup('Which metal is a liquid') == 4
+
+    # A new version of a question replaces the old one
+    index.add('Name the planet closest to the sun', 4)
+    assert index.lookup('Name the planet closest to the sun?') == 4
+    assert index.lookup('Which metal is liquid') is None
+    assert len(index) == 1
@@ -0,0 +1,121 @@
+import asyncio
+
+from conftest import add_question
+from models import Question, QuestionCache, get_db_connection
+from quiz_bot import QuizBot
+
+
+def add_channel_with_schedule(database):
+    """Add a second channel (row id 2) and schedule only the test channel, return the questions"""
+    with get_db_connection() as conn:
+        conn.execute('''
+            INSERT INTO channels (channel_name, channel_id, discussion_group_id, category)
+            VALUES ('Other', '@other', '-200', 'GK')
+        ''')
+        conn.execute('''
+            INSERT INTO schedules (channel_id, schedule_time, days_of_week, interval_type)
+            VALUES (1, '09:00', '0,1,2,3,4,5,6', 'daily')
+        ''')
+        conn.commit()
+    return add_question('Scheduled'), add_question('Unscheduled', channel_id=2)
+
+
+def cached_questions(restrict_question_cache):
+    question_cache = QuestionCache()
+
+    async def run():
+        bot = QuizBot(question_cache=question_cache, restrict_question_cache=restrict_question_cache)
+        try:
+            await bot.sync_schedules(force=True)
+            await bot.db.read(question_cache.refresh)
+        finally:
+            bot.db.close()
+
+    asyncio.run(run())
+    return {question.question_text for question, _ in question_cache.items()}
+
+
+def test_shared_question_cache_is_restricted_to_scheduled_channels(database):
+    add_channel_with_schedule(database)
+    assert cached_questions(restrict_question_cache=True) == {'Scheduled'}
+
+
+def test_shared_question_cache_holds_every_channel_for_text_matching(database):
+    add_channel_with_schedule(database)
+    assert cached_questions(restrict_question_cache=False) == {'Scheduled', 'Unscheduled'}
+
+
+def test_schedule_changes_are_synced_without_a_restart(database):
+    with get_db_connection() as conn:
+        schedule_id = conn.execute('''
+            INSERT INTO schedules (channel_id, schedule_time, days_of_week, interval_type)
+            VALUES (1, '09:00', '0,1,2,3,4', 'daily')
+        ''').lastrowid
+        conn.commit()
+
+    def update(sql):
+        with get_db_connection() as conn:
+            conn.execute(sql, (schedule_id,))
+            conn.commit()
+
+    async def run():
+        bot = QuizBot()
+        job_id = f'quiz_{schedule_id}'
+        bot.scheduler.start()
+        try:
+            await bot.sync_schedules(force=True)
+            assert bot.schedule_jobs == {job_id: ('@test', '09:00', '0,1,2,3,4')}
+            assert str(bot.scheduler.get_job(job_id).trigger.fields[5]) == '9'
+
+            update("UPDATE schedules SET schedule_time = '18:30' WHERE id = ?")
+            await bot.sync_schedules()
+            assert bot.schedule_jobs[job_id] == ('@test', '18:30', '0,1,2,3,4')
+            assert str(bot.scheduler.get_job(job_id).trigger.fields[5]) == '18'
+
+            update('UPDATE schedules SET active = 0 WHERE id = ?')
+            await bot.sync_schedules()
+            assert bot.schedule_jobs == {}
+            assert bot.scheduler.get_job(job_id) is None
+        finally:
+            bot.scheduler.shutdown(wait=False)
+            bot.db.close()
+
+    asyncio.run(run())
+
+
+def test_warm_up_peeks_at_the_deck_without_dealing(database):
+    with get_db_connection() as conn:
+        conn.execute('UPDATE channels SET questions_per_batch = 2 WHERE id = 1')
+        conn.commit()
+    for number in range(5):
+        add_question(f'Question {number}')
+
+    async def run():
+        bot = QuizBot()
+        try:
+            await bot.db.decks.deal(1, 1)  # Builds the deck, warm-up only peeks at a built one
+            warm = await bot.prepare_quiz('@test', peek=True)
+            again = await bot.prepare_quiz('@test', peek=True)
+            dealt = await bot.db.decks.deal(1, 2)
+        finally:
+            bot.db.close()
+        return warm, again, dealt
+
+    warm, again, dealt = asyncio.run(run())
+    assert warm.question_ids == again.question_ids == dealt
+    assert [payload['question'][:4] for _, payload in warm.polls] == ['Q1: ', 'Q2: ']
+
+
+def test_questions_over_telegram_limits_are_not_sent(database):
+    bot = QuizBot()
+    try:
+        question = Question(id=1, channel_id=1, question_text='Q' * 400, option_a='a', option_b='b',
+                            option_c='c', option_d='d', correct_option=0)
+        assert bot.build_poll_payload(question, 1) is None
+        question.question_text = 'Short enough'
+        question.explanation = 'E' * 500
+        payload = bot.build_poll_payload(question, 3)
+        assert payload['question'] == 'Q3: Short enough'
+        assert payload['explanation'] == 'Check discussion group for detailed explanation.'
+    finally:
+        bot.db.close()
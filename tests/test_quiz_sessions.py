@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+from conftest import wait_for
+from models import get_db_connection
+from outbox import Outbox
+from quiz_sessions import QuizSessions, SessionStep
+from repository import Repository
+from timer_wheel import TimerWheel
+
+STEPS = [
+    SessionStep('start', 'send_message', {'text': 'start'}, None),
+    SessionStep('poll:1', 'send_poll', {'question': 'Q1'}, None),
+    SessionStep('complete', 'send_message', {'text': 'done'}, None),
+]
+
+
+def outbox_keys():
+    with get_db_connection() as conn:
+        return [row[0] for row in conn.execute('SELECT idempotency_key FROM outbox ORDER BY id')]
+
+
+def test_sessions_queue_their_steps_through_the_writer(database):
+    finished = []
+
+    async def run():
+        db = Repository(1)
+        wheel = TimerWheel(tick=0.01)
+        sessions = QuizSessions(Outbox('test', db=db), wheel, 0.05, on_finished=finished.append, db=db)
+        wheel.start()
+        try:
+            assert await sessions.start('chat', 'quiz:1', STEPS)
+            assert await sessions.start('chat', 'quiz:1', STEPS) is None
+            await wait_for(lambda: finished)
+        finally:
+            await wheel.stop()
+            await sessions.stop()
+            db.close()
+        return sessions
+
+    sessions = asyncio.run(run())
+    assert len(sessions) == 0
+    assert finished[0].state == 'finished'
+    assert outbox_keys() == ['quiz:1:start', 'quiz:1:poll:1', 'quiz:1:complete']
+
+
+def test_pausing_while_a_step_is_written_holds_the_next_one(database):
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    async def run():
+        db = Repository(1)
+        wheel = TimerWheel(tick=0.01)
+        sessions = QuizSessions(Outbox('test', db=db), wheel, 0.05, db=db)
+        wheel.start()
+        try:
+            session = await sessions.start('chat', 'quiz:1', STEPS[1:])
+            db.submit_write(hold)
+            started.wait(1)
+            await wait_for(lambda: session.queuing)
+            assert sessions.pause(session.id)
+            release.set()
+            await wait_for(lambda: not session.queuing)
+            assert session.index == 1
+            assert session.timer is None
+            assert session.next_at == 0.05
+
+            assert sessions.resume(session.id)
+            await wait_for(lambda: not sessions.get(session.id))
+        finally:
+            release.set()
+            await wheel.stop()
+            await sessions.stop()
+            db.close()
+
+    asyncio.run(run())
+    assert outbox_keys() == ['quiz:1:poll:1', 'quiz:1:complete']
+
+
+def test_has_run_tells_used_quiz_keys_apart(database):
+    async def run():
+        sessions = QuizSessions(Outbox('test'), TimerWheel(), 60)
+        assert not await sessions.has_run('quiz:1')
+        await sessions.start('chat', 'quiz:1', STEPS)
+        return await sessions.has_run('quiz:1'), await sessions.has_run('quiz:2')
+
+    assert asyncio.run(run()) == (True, False)
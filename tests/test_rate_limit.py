@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+from rate_limit import TokenBucketRateLimiter
+
+
+def test_retry_after_blocks_only_its_own_chat():
+    limiter = TokenBucketRateLimiter(group_burst=5, max_retries=0)
+    sent = []
+
+    async def send(chat_id):
+        if chat_id == -1 and not sent:
+            sent.append('flood')
+            raise RetryAfter(2)
+        sent.append(chat_id)
+
+    async def request(chat_id):
+        await limiter.process_request(send, (chat_id,), {}, 'sendMessage', {'chat_id': chat_id}, None)
+
+    async def run():
+        with pytest.raises(RetryAfter):
+            await request(-1)
+        # Other chats keep sending while the flooded one waits
+        await asyncio.wait_for(asyncio.gather(request(-2), request('@other')), 0.5)
+        blocked = asyncio.ensure_future(request(-1))
+        await asyncio.sleep(0.3)
+        assert not blocked.done()
+        blocked.cancel()
+        await asyncio.gather(blocked, return_exceptions=True)
+
+    asyncio.run(run())
+    assert sent == ['flood', -2, '@other']
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+from models import Channel
+from repository import Repository
+
+
+def test_reads_and_writes_run_on_their_threads(database):
+    async def run():
+        db = Repository(2)
+        try:
+            read = await db.read(lambda: threading.current_thread().name)
+            write = await db.write(lambda: threading.current_thread().name)
+            short = await db.short_write(lambda: threading.current_thread().name)
+        finally:
+            db.close()
+        return read, write, short
+
+    read, write, short = asyncio.run(run())
+    assert read.startswith('db-read')
+    assert write == short == 'db-write'
+
+
+def test_submitted_writes_apply_in_order_and_errors_are_only_logged(database):
+    applied = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    db = Repository(1)
+    for number in range(3):
+        db.submit_write(applied.append, number)
+    db.submit_write(fail)
+    db.submit_write(applied.append, 3)
+    db.close()
+    assert applied == [0, 1, 2, 3]
+
+
+def test_short_writes_go_ahead_of_queued_bulk_writes(database):
+    release = threading.Event()
+    applied = []
+
+    db = Repository(1)
+    try:
+        db.submit_write(release.wait, 5)
+        for number in range(2):
+            db.submit_write(applied.append, f'bulk {number}')
+        for number in range(2):
+            db.submit_short_write(applied.append, f'short {number}')
+        release.set()
+    finally:
+        release.set()
+        db.close()
+    assert applied == ['short 0', 'short 1', 'bulk 0', 'bulk 1']
+
+
+def test_cancelled_writes_are_skipped(database):
+    started = threading.Event()
+    release = threading.Event()
+    applied = []
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    async def run():
+        db = Repository(1)
+        try:
+            db.submit_write(hold)
+            started.wait(1)
+            write = asyncio.ensure_future(db.short_write(applied.append, 'cancelled'))
+            await asyncio.sleep(0.01)
+            write.cancel()
+            await asyncio.gather(write, return_exceptions=True)
+            release.set()
+            await db.short_write(applied.append, 'kept')
+        finally:
+            release.set()
+            db.close()
+
+    asyncio.run(run())
+    assert applied == ['kept']
+
+
+def test_async_models_route_writes_to_the_writer(database):
+    async def run():
+        db = Repository(1)
+        try:
+            assert db.decks.deal.func == db.write
+            assert db.decks.peek.func == db.read
+            channel = await db.channels.get_by_id(1)
+            cached = await db.channels.get_by_id(1)
+        finally:
+            db.close()
+        return channel, cached
+
+    channel, cached = asyncio.run(run())
+    assert isinstance(channel, Channel)
+    assert channel.channel_name == 'Test'
+    assert cached is channel
+
+
+def test_pooled_connections_are_reused_and_rolled_back(database, tmp_path, monkeypatch):
+    first = database.get_db_connection()
+    assert first.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    first.execute("INSERT INTO channels (channel_name, channel_id, category) VALUES ('Other', '@other', 'GK')")
+    first.close()
+
+    # Returned to the pool without its uncommitted insert
+    with database.get_db_connection() as conn:
+        assert conn is first
+        assert conn.execute('SELECT COUNT(*) FROM channels').fetchone()[0] == 1
+
+    # A connection to another database file is never handed out again
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'other.db'))
+    with database.get_db_connection() as conn:
+        assert conn is not first
+        assert conn.database.endswith('other.db')
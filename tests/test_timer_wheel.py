@@ -0,0 +1,61 @@
+import time
+
+from timer_wheel import TimerWheel
+
+
+def make_wheel(slots=4, levels=2):
+    """A wheel with one-second ticks that is advanced by hand, delays map to whole ticks"""
+    wheel = TimerWheel(tick=1, slots=slots, levels=levels)
+    wheel.origin = time.monotonic() + 0.5
+    return wheel
+
+
+def run_ticks(wheel, ticks):
+    for _ in range(ticks):
+        wheel._advance()
+
+
+def test_timers_fire_on_their_tick():
+    wheel = make_wheel()
+    fired = []
+    for delay in (3, 1, 2):
+        wheel.schedule(delay, lambda delay=delay: fired.append((delay, wheel.current_tick)))
+    assert len(wheel) == 3
+    run_ticks(wheel, 3)
+    assert fired == [(1, 1), (2, 2), (3, 3)]
+    assert len(wheel) == 0
+
+
+def test_far_timers_cascade_down_the_levels():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(10, lambda: fired.append(wheel.current_tick))
+    assert not any(wheel.wheels[0])
+    run_ticks(wheel, 9)
+    assert fired == []
+    run_ticks(wheel, 1)
+    assert fired == [10]
+
+
+def test_timers_past_the_top_level_wait_in_overflow():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(40, lambda: fired.append(wheel.current_tick))
+    assert len(wheel.overflow) == 1
+    run_ticks(wheel, 39)
+    assert fired == []
+    run_ticks(wheel, 1)
+    assert fired == [40]
+
+
+def test_cancelled_timers_do_not_fire():
+    wheel = make_wheel()
+    fired = []
+    timer = wheel.schedule(2, fired.append, 'cancelled')
+    wheel.schedule(2, fired.append, 'kept')
+    timer.cancel()
+    timer.cancel()
+    assert len(wheel) == 1
+    run_ticks(wheel, 2)
+    assert fired == ['kept']
+    assert len(wheel) == 0
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+
+import pytest
+
+from conftest import add_question
+from models import Question, UsageBuffer, get_db_connection
+
+
+def used_count(question_id):
+    with get_db_connection() as conn:
+        return conn.execute('SELECT used_count FROM questions WHERE id = ?', (question_id,)).fetchone()[0]
+
+
+def test_spooled_usage_is_replayed_exactly_once(database, tmp_path):
+    question_id = add_question('Question 0')
+    spool_path = str(tmp_path / 'usage_spool.json')
+
+    # The database is gone at shutdown, the increments are spooled instead
+    buffer = UsageBuffer(spool_path)
+    buffer.record_question_used(question_id, 2)
+    buffer.record_quiz_sent(1, '2024-01-01 09:00:00')
+    buffer.persist()
+    assert os.path.exists(spool_path)
+
+    restarted = UsageBuffer(spool_path)
+    assert restarted.replay() == 2
+    assert used_count(question_id) == 2
+    assert not os.path.exists(spool_path)
+    with get_db_connection() as conn:
+        assert conn.execute('SELECT last_quiz_sent FROM channels WHERE id = 1').fetchone()[0] == '2024-01-01 09:00:00'
+
+    # Neither a later flush nor the next start applies the spooled increments again
+    assert restarted.flush() == 0
+    assert UsageBuffer(spool_path).replay() == 0
+    assert used_count(question_id) == 2
+
+
+def test_failed_replay_keeps_the_spool_file(database, tmp_path, monkeypatch):
+    question_id = add_question('Question 0')
+    spool_path = str(tmp_path / 'usage_spool.json')
+    buffer = UsageBuffer(spool_path)
+    buffer.record_question_used(question_id)
+    buffer.persist()
+
+    restarted = UsageBuffer(spool_path)
+
+    def locked(conn, counts):
+        raise sqlite3.OperationalError('database is locked')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Question, 'bulk_update_usage', locked)
+        with pytest.raises(sqlite3.OperationalError):
+            restarted.replay()
+    assert os.path.exists(spool_path)
+    assert restarted.pending() == 1
+
+    assert restarted.flush() == 1
+    assert used_count(question_id) == 1
+    assert not os.path.exists(spool_path)
@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import webhook
+from webhook import start_receiving_updates
+
+
+class FakeUpdater:
+    """Records how the updater was started"""
+
+    def __init__(self):
+        self.started = None
+
+    async def start_webhook(self, **kwargs):
+        self.started = ('webhook', kwargs)
+
+    async def start_polling(self, **kwargs):
+        self.started = ('polling', kwargs)
+
+
+def start(allowed_updates, port=8443, url_path='quiz_bot'):
+    application = SimpleNamespace(updater=FakeUpdater())
+    asyncio.run(start_receiving_updates(application, allowed_updates, port, url_path))
+    return application.updater.started
+
+
+def test_long_polling_only_asks_for_handled_updates(monkeypatch):
+    monkeypatch.setattr(webhook, 'USE_WEBHOOK', False)
+    assert start(['message', 'poll']) == ('polling', {'allowed_updates': ['message', 'poll']})
+
+
+def test_webhook_is_registered_under_the_bot_path(monkeypatch):
+    monkeypatch.setattr(webhook, 'USE_WEBHOOK', True)
+    monkeypatch.setattr(webhook, 'WEBHOOK_URL', 'https://bots.example.com/')
+    monkeypatch.setattr(webhook, 'WEBHOOK_SECRET_TOKEN', 'secret')
+
+    mode, options = start(['poll_answer'], port=8444, url_path='answer_bot')
+    assert mode == 'webhook'
+    assert options['webhook_url'] == 'https://bots.example.com/answer_bot'
+    assert (options['port'], options['url_path']) == (8444, 'answer_bot')
+    assert options['allowed_updates'] == ['poll_answer']
+    assert options['secret_token'] == 'secret'
+
+
+def test_webhook_mode_needs_a_url(monkeypatch):
+    monkeypatch.setattr(webhook, 'USE_WEBHOOK', True)
+    monkeypatch.setattr(webhook, 'WEBHOOK_URL', '')
+    with pytest.raises(ValueError):
+        start(['message'])
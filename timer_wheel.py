@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """Callback scheduled on a TimerWheel"""
+    __slots__ = ('expiry_tick', 'callback', 'args', 'wheel', 'cancelled')
+
+    def __init__(self, expiry_tick, callback, args, wheel):
+        self.expiry_tick = expiry_tick
+        self.callback = callback
+        self.args = args
+        self.wheel = wheel
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the timer, a no-op once it fired"""
+        if not self.cancelled and self.wheel:
+            self.cancelled = True
+            self.wheel.count -= 1
+            self.wheel = None
+
+
+class TimerWheel:
+    """Hierarchical timer wheel driven by one asyncio task.
+
+    Level 0 has one slot per tick, every higher level covers a whole turn of
+    the level below it in each slot. Timers are appended to the slot of their
+    expiry and cascaded one level down when the wheel reaches that slot, so
+    scheduling and cancelling are O(1) and each tick only touches one slot.
+    Callbacks are plain functions called on the event loop, they must not
+    block. Timers further out than the top level wait in an overflow list.
+    """
+
+    def __init__(self, tick=0.5, slots=64, levels=4):
+        self.tick = tick  # Seconds per tick, the timer resolution
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overflow = []
+        self.current_tick = 0
+        self.origin = time.monotonic()
+        self.count = 0  # Timers scheduled and not yet fired or cancelled
+        self.task = None
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) after delay seconds, returns the Timer"""
+        # Ticks already elapsed since the last advance count towards the delay
+        elapsed = time.monotonic() - self.origin
+        expiry_tick = max(self.current_tick + 1, math.ceil((elapsed + max(delay, 0)) / self.tick))
+        timer = Timer(expiry_tick, callback, args, self)
+        self._add(timer)
+        self.count += 1
+        return timer
+
+    def _add(self, timer):
+        delta = timer.expiry_tick - self.current_tick
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                slot = (timer.expiry_tick // span) % self.slots
+                self.wheels[level][slot].append(timer)
+                return
+            span *= self.slots
+        self.overflow.append(timer)
+
+    def _cascade(self, level):
+        span = self.slots ** level
+        slot = (self.current_tick // span) % self.slots
+        timers, self.wheels[level][slot] = self.wheels[level][slot], []
+        for timer in timers:
+            if not timer.cancelled:
+                self._add(timer)
+
+    def _advance(self):
+        self.current_tick += 1
+
+        # Move timers down from the higher levels whose slot came round, highest first
+        for level in range(self.levels - 1, 0, -1):
+            if self.current_tick % self.slots ** level == 0:
+                if level == self.levels - 1 and self.overflow:
+                    overflow, self.overflow = self.overflow, []
+                    for timer in overflow:
+                        if not timer.cancelled:
+                            self._add(timer)
+                self._cascade(level)
+
+        slot = self.current_tick % self.slots
+        timers, self.wheels[0][slot] = self.wheels[0][slot], []
+        for timer in timers:
+            if timer.cancelled:
+                continue
+            timer.wheel = None
+            self.count -= 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"Error in timer callback {timer.callback.__name__}: {e}")
+
+    async def _run(self):
+        while True:
+            next_tick_at = self.origin + (self.current_tick + 1) * self.tick
+            await asyncio.sleep(max(0, next_tick_at - time.monotonic()))
+
+            # Catch up on ticks missed while the loop was busy
+            target = int((time.monotonic() - self.origin) / self.tick)
+            while self.current_tick < target:
+                self._advance()
+
+    def start(self):
+        """Start turning the wheel"""
+        if not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop turning the wheel, pending timers do not fire"""
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
@@ -1,7 +1,9 @@
+import datetime
 import json
 import logging
 import os
 from typing import List, Dict, Any
+from config import POLL_QUESTION_MAX_LENGTH, POLL_OPTION_MAX_LENGTH
 
 logger = logging.getLogger(__name__)
 
@@ -101,6 +103,22 @@ def format_question_for_poll(question: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"Error formatting question for poll: {e}")
         return None
 
+def check_poll_limits(question: str, options: List[str]) -> List[str]:
+    """Check poll text against Telegram limits, returns a list of problems"""
+    errors = []
+    
+    if not question or len(question) > POLL_QUESTION_MAX_LENGTH:
+        errors.append(f"question must be 1-{POLL_QUESTION_MAX_LENGTH} characters")
+    
+    if not 2 <= len(options) <= 10:
+        errors.append("poll must have 2-10 options")
+    
+    for i, option in enumerate(options):
+        if not option or len(option) > POLL_OPTION_MAX_LENGTH:
+            errors.append(f"option {chr(65 + i)} must be 1-{POLL_OPTION_MAX_LENGTH} characters")
+    
+    return errors
+
 def create_sample_questions(category: str, count: int = 10) -> List[Dict[str, Any]]:
     """Create sample questions for testing"""
     samples = {
@@ -0,0 +1,48 @@
+import logging
+
+from telegram.ext import Application
+
+from config import (USE_WEBHOOK, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_SECRET_TOKEN,
+                    TELEGRAM_API_BASE_URL)
+
+logger = logging.getLogger(__name__)
+
+
+def application_builder(token, request=None):
+    """Application builder pointed at the configured Bot API server, optionally sending
+    through a shared request object"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+    )
+    if request:
+        builder = builder.request(request)
+    return builder
+
+
+async def start_receiving_updates(application, allowed_updates, port, url_path):
+    """Start the update receiver selected in config.py.
+
+    In webhook mode a local HTTP server on WEBHOOK_LISTEN:port receives the
+    updates Telegram posts to WEBHOOK_URL/url_path and puts them straight into
+    the application's update queue. Otherwise the bot long-polls getUpdates.
+    Either way Telegram only delivers the update types in allowed_updates.
+    """
+    if USE_WEBHOOK:
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when USE_WEBHOOK is enabled")
+
+        await application.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=port,
+            url_path=url_path,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+            allowed_updates=allowed_updates,
+            secret_token=WEBHOOK_SECRET_TOKEN
+        )
+        logger.info(f"Receiving updates via webhook on {WEBHOOK_LISTEN}:{port}/{url_path}")
+    else:
+        await application.updater.start_polling(allowed_updates=allowed_updates)
+        logger.info("Receiving updates via long polling")